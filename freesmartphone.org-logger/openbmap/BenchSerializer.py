@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Microbenchmark of the serializer module, compared with the formatting it replaced.
+
+Usage: BenchSerializer.py [number of scans] [number of runs]
+"""
+
+import logging
+import sys
+import time
+import timeit
+
+import serializer
+from TestBinLog import make_records
+
+def reference_format_scan(record):
+    """The scan formatting of the logger before the serializer module (values are not escaped)."""
+    servingCell = record.servingCell
+    logmsg = ["<scan time=\"%s\">" % record.date,
+              "<gsmserving mcc=\"%s\" mnc=\"%s\" lac=\"%s\" id=\"%s\" ss=\"%i\" act=\"%s\"" % servingCell[:6]]
+    if servingCell[6] != "":
+        logmsg.append(" tav=\"%s\"" % servingCell[6])
+    else:
+        logging.debug("No timing advance available for serving cell, skip it.")
+    if servingCell[7] != "":
+        logmsg.append(" rxlev=\"%s\"" % servingCell[7])
+    else:
+        logging.debug("No rxlev available for serving cell, skip it.")
+    logmsg.append("/>")
+
+    for cell in record.neighbourCells:
+        logmsg.append("<gsmneighbour mcc=\"%s\" mnc=\"%s\" lac=\"%s\" id=\"%s\" rxlev=\"%i\" c1=\"%i\" c2=\"%i\"/>" %
+                      (servingCell[:2] + (cell['lac'], cell['cid'], cell['rxlev'], cell['c1'], cell['c2'])))
+
+    logmsg.append(reference_format_gps_data((True, record.tstamp, record.lat, record.lng, record.alt,
+                                             record.pdop, record.hdop, record.vdop, record.spe, record.heading)))
+    logmsg.append('</scan>\n')
+    return ''.join(logmsg)
+
+def reference_format_gps_data(gpsData):
+    """The GPS data formatting of the logger before the serializer module."""
+    latLonPrecision = 9
+    altitudePrecision = 1
+    speedPrecision = 3
+    hvpdopPrecision = 2
+    headingPrecision = 9
+
+    return (
+            "<gps time=\"%s\"" % time.strftime('%Y%m%d%H%M%S', time.gmtime(gpsData[1])) + \
+            " lng=\"%s\"" % ( ('%.*f' % (latLonPrecision, gpsData[3])).rstrip('0').rstrip('.') ) + \
+            " lat=\"%s\"" % ( ('%.*f' % (latLonPrecision, gpsData[2])).rstrip('0').rstrip('.') ) + \
+            " alt=\"%s\"" % ( ('%.*f' % (altitudePrecision, gpsData[4])).rstrip('0').rstrip('.') ) + \
+            " hdg=\"%s\"" % ( ('%.*f' % (headingPrecision, gpsData[9])).rstrip('0').rstrip('.') ) + \
+            " spe=\"%s\"" % ( ('%.*f' % (speedPrecision, gpsData[8])).rstrip('0').rstrip('.') ) + \
+            " hdop=\"%s\"" % ( ('%.*f' % (hvpdopPrecision, gpsData[6])).rstrip('0').rstrip('.') ) + \
+            " vdop=\"%s\"" % ( ('%.*f' % (hvpdopPrecision, gpsData[7])).rstrip('0').rstrip('.') ) + \
+            " pdop=\"%s\"" % ( ('%.*f' % (hvpdopPrecision, gpsData[5])).rstrip('0').rstrip('.') ) + \
+            "/>"
+            )
+
+def bench(name, function, records, runs):
+    """Prints and returns the best throughput (in scans per second) of function over the records."""
+    best = min(timeit.repeat(lambda: function(records), number=1, repeat=runs))
+    throughput = len(records) / best
+    print '%-30s %10.0f scans/s' % (name, throughput)
+    return throughput
+
+def main(nbScans=2000, runs=5):
+    records = make_records(nbScans)
+    if ''.join([reference_format_scan(record) for record in records]) != serializer.serialize_scans(records):
+        print 'Warning: the serializer output differs from the reference one.'
+    reference = bench('reference (one by one)', lambda records: [reference_format_scan(record) for record in records],
+                      records, runs)
+    bench('serializer (one by one)', lambda records: [serializer.serialize_scan(record) for record in records],
+          records, runs)
+    batch = bench('serializer (batch)', serializer.serialize_scans, records, runs)
+    print 'Speed up: %.2f' % (batch / reference)
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
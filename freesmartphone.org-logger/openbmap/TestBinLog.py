@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import os
+import random
+import shutil
+import tempfile
+from cStringIO import StringIO
+
+import binlog
+import serializer
+import xmllog
+from logwriter import LogWriter
+
+HEADER = '<?xml version="1.0" encoding="UTF-8"?>\n' + \
+         '<logfile manufacturer="FIC" model="Neo1973 GTA02" revision="HW: GTA02" swid="FSOnen1" swver="0.4.1">\n'
+TAIL = '</logfile>'
+
+def make_records(nb, seed=1):
+    """Returns nb scan records, with the values the logger may produce."""
+    rand = random.Random(seed)
+    records = []
+    date = 20100605143059
+    tstamp = 1275748259.0
+    lac = 1234
+    cid = 56789
+    for i in range(nb):
+        date += rand.choice((0, 1, 3, 10, 41, 8870))
+        tstamp += rand.choice((0, 0.5, 1, 3, 10, -1))
+        if rand.random() < 0.2:
+            (lac, cid) = (rand.randint(1, 65535), rand.randint(1, 65535))
+        servingCell = (rand.choice(('208', '228', '1', '')), rand.choice(('1', '10', '', '0x')),
+                       str(lac), str(cid), rand.randint(-113, -51), rand.choice(('GSM', 'EDGE', '')),
+                       rand.choice(('', '0', '12', 'n/a')), rand.choice(('', '33', '007')))
+        neighbourCells = []
+        for j in range(rand.randint(0, 6)):
+            neighbourCells.append({'lac': rand.choice((str(lac), str(rand.randint(1, 65535)), '0123')),
+                                   'cid': str(rand.randint(1, 65535)),
+                                   'rxlev': rand.randint(1, 63),
+                                   'c1': rand.randint(-20, 60),
+                                   'c2': rand.choice((rand.randint(-20, 60), 12.7))})
+        records.append(xmllog.ScanRecord(str(date), tstamp, servingCell,
+                                         rand.uniform(-180, 180), rand.uniform(-90, 90),
+                                         rand.choice((rand.uniform(-50, 3000), 120, 0.05)),
+                                         rand.choice((rand.uniform(0, 250), 0, 35.1234567)),
+                                         rand.uniform(0, 360), rand.uniform(0.5, 50),
+                                         rand.uniform(0.5, 50), rand.uniform(0.5, 50),
+                                         tuple(neighbourCells)))
+    return records
+
+def to_xml(records):
+    return HEADER + ''.join([serializer.serialize_scan(record) for record in records]) + TAIL
+
+def to_binary(records):
+    format = binlog.BinaryFormat()
+    data = [format.begin(HEADER, TAIL)]
+    for record in records:
+        data.append(format.encode(record)[0])
+    data.append(format.end(TAIL))
+    return ''.join(data)
+
+class TestBinLog(unittest.TestCase):
+
+    def test_round_trip(self):
+        records = make_records(500)
+        binary = to_binary(records)
+        out = StringIO()
+        self.failUnless(binlog.convert(StringIO(binary), out) == len(records), '')
+        self.failUnless(out.getvalue() == to_xml(records), 'XML must be byte identical')
+        self.failUnless(len(binary) * 2 < len(to_xml(records)), 'binary should be compact')
+
+    def test_varint(self):
+        for n in (0, 1, -1, 63, -64, 64, 127, 128, 300, -300, 2 ** 40, -(2 ** 40)):
+            out = []
+            binlog._put_int(out, n)
+            self.failUnless(binlog._get_int(''.join(out), 0) == (n, len(''.join(out))), '')
+
+    def test_xml_size(self):
+        record = make_records(1)[0]
+        self.failUnless(binlog.BinaryFormat().encode(record)[1] == len(serializer.serialize_scan(record)), '')
+
+    def test_complete_length(self):
+        records = make_records(3)
+        binary = to_binary(records)
+        format = binlog.BinaryFormat()
+        self.failUnless(format.complete_length(binary) == len(binary), '')
+        self.failUnless(format.complete_length(binary[:-1]) < len(binary), '')
+        self.failUnless(format.complete_length(binary[:len(binlog.MAGIC) + 10]) == -1, 'no record')
+        self.failUnless(format.complete_length('garbage') == -1, '')
+        out = StringIO()
+        self.failUnless(binlog.convert(StringIO(binary[:-1]), out) == 2, 'truncated record ignored')
+        self.failUnless(out.getvalue() == to_xml(records[:2]), '')
+
+class TestBinaryLogWriter(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._logDir = os.path.join(self._dir, 'FSO_GSM')
+        self._journalDir = os.path.join(self._dir, 'Journal')
+        self._writer = LogWriter(self._logDir, self._journalDir, 'V2', HEADER, TAIL, binlog.BinaryFormat)
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def test_write_and_convert(self):
+        records = make_records(20)
+        xml = to_xml(records)
+        # the size limit applies to the XML
+        self._writer.set_rotation(len(xml), 0)
+        for record in records:
+            self._writer.append('208', record)
+        self.failUnless(self._writer.get_size('208') + len(TAIL) == len(xml), '')
+        self.failUnless(self._writer.get_disk_size('208') < self._writer.get_size('208'), '')
+        filename = self._writer.finish('208')
+        self.failUnless(filename.endswith(binlog.EXTENSION), '')
+        self.failUnless(binlog.convert_file(filename) == xml, '')
+
+    def test_recover(self):
+        records = make_records(3)
+        for record in records:
+            self._writer.append('208', record)
+        filename = self._writer.get_filename('208')
+        f = open(self._writer.journal_filename(filename), 'ab')
+        f.write('\x30truncated')
+        f.close()
+        writer = LogWriter(self._logDir, self._journalDir, 'V2', HEADER, TAIL)
+        self.failUnless(writer.recover() == [filename], '')
+        self.failUnless(binlog.convert_file(filename) == to_xml(records), '')
+
+if __name__ == '__main__':
+    unittest.main()
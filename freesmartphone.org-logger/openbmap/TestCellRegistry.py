@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import os
+import shutil
+import tempfile
+
+import cellregistry
+from cellregistry import CellRegistry, SeenCellsIndex, SERVING, NEIGHBOUR
+
+class TestCellRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self._total = 'total'
+        self._registry = CellRegistry(self._total)
+
+    def test_pack_unpack(self):
+        key = cellregistry.pack_cell('208', '1', '12345', '268435455', NEIGHBOUR)
+        self.failUnless(cellregistry.unpack_cell(key) == (208, 1, 12345, 268435455, NEIGHBOUR), '')
+        self.failIf(key == cellregistry.pack_cell('208', '1', '12345', '268435455', SERVING), '')
+        self.failUnlessRaises(ValueError, cellregistry.pack_cell, '208', '1', '65536', '1', SERVING)
+
+    def test_add_total_only(self):
+        self.failUnless(self._registry.add('208', '1', '10', '20', SERVING), '')
+        self.failIf(self._registry.add('208', '1', '10', '20', SERVING), '')
+        self.failUnless(self._registry.count(SERVING) == 1, '')
+        self.failUnless(self._registry.count(NEIGHBOUR) == 0, '')
+        self.failUnless(self._registry.contains('208', '1', '10', '20', SERVING), '')
+        self.failIf(self._registry.contains('208', '1', '10', '20', NEIGHBOUR), '')
+
+    def test_sessions_share_total(self):
+        self._registry.set_current_session('first')
+        self._registry.add('208', '1', '10', '20', SERVING)
+        self._registry.add('208', '1', '10', '21', NEIGHBOUR)
+        self._registry.set_current_session('second')
+        # already in the total, but new for this session
+        self.failUnless(self._registry.add('208', '1', '10', '20', SERVING), '')
+        self._registry.add('208', '1', '11', '22', SERVING)
+        self.failUnless(self._registry.count(SERVING, 'first') == 1, '')
+        self.failUnless(self._registry.count(SERVING, 'second') == 2, '')
+        self.failUnless(self._registry.count(SERVING) == 2, '')
+        self.failUnless(self._registry.count(NEIGHBOUR, 'second') == 0, '')
+        self.failUnless(self._registry.count(NEIGHBOUR) == 1, '')
+
+    def test_queries_per_lac_and_mnc(self):
+        for cid in ('3', '1', '2'):
+            self._registry.add('208', '1', '10', cid, NEIGHBOUR)
+        self._registry.add('208', '1', '11', '1', NEIGHBOUR)
+        self._registry.add('208', '2', '10', '1', NEIGHBOUR)
+        self.failUnless(self._registry.count_per_lac('208', '1', '10', NEIGHBOUR) == 3, '')
+        self.failUnless(self._registry.cells_per_lac('208', '1', '10', NEIGHBOUR) == [1, 2, 3], '')
+        self.failUnless(self._registry.count_per_mnc('208', '1', NEIGHBOUR) == 4, '')
+        self.failUnless(self._registry.lacs_per_mnc('208', '1', NEIGHBOUR) == [10, 11], '')
+        self.failUnless(self._registry.count_per_mnc('208', '2', SERVING) == 0, '')
+        self._registry.set_current_session('second')
+        self._registry.add('208', '1', '10', '4', NEIGHBOUR)
+        self.failUnless(self._registry.cells_per_lac('208', '1', '10', NEIGHBOUR, 'second') == [4], '')
+        self.failUnless(self._registry.cells_per_lac('208', '1', '10', NEIGHBOUR) == [1, 2, 3, 4], '')
+        self.failUnless(self._registry.cells_per_lac('208', '1', '10', SERVING) == [], '')
+        self.failUnless(self._registry.cells_per_lac('208', '1', '10', NEIGHBOUR, 'unknown') == [], '')
+        # the number of digits of the MNC is not kept
+        self.failUnless(self._registry.cells_per_lac('208', '001', '10', NEIGHBOUR) == [1, 2, 3, 4], '')
+
+    def test_add_session_twice(self):
+        self._registry.add_session('first')
+        self.failUnlessRaises(ValueError, self._registry.add_session, 'first')
+
+class TestSeenCellsIndex(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._filename = os.path.join(self._dir, 'seen.idx')
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def test_no_file(self):
+        index = SeenCellsIndex(self._filename)
+        self.failUnless(index.count() == 0, '')
+        self.failIf(index.contains('208', '1', '10', '20'), '')
+        index.save()
+        self.failIf(os.path.exists(self._filename), '')
+
+    def test_add_save_reload(self):
+        index = SeenCellsIndex(self._filename)
+        self.failUnless(index.add('208', '1', '10', '20'), '')
+        self.failIf(index.add('208', '1', '10', '20'), '')
+        index.add('208', '1', '9', '300000')
+        self.failUnless(index.save(), '')
+        self.failIf(os.path.exists(self._filename), 'saved in the side file')
+        self.failUnless(os.path.getsize(self._filename + SeenCellsIndex.SIDE_SUFFIX) ==
+                        2 * SeenCellsIndex.RECORD.size, '')
+
+        index = SeenCellsIndex(self._filename)
+        self.failUnless(index.count() == 2, '')
+        self.failUnless(index.contains('208', '1', '9', '300000'), '')
+        self.failIf(index.add('208', '1', '10', '20'), '')
+        index.close()
+        self.failUnless(os.path.getsize(self._filename) == 2 * SeenCellsIndex.RECORD.size, '')
+        self.failIf(os.path.exists(self._filename + SeenCellsIndex.SIDE_SUFFIX), '')
+
+        index = SeenCellsIndex(self._filename)
+        # merged in the middle, before and after the existing records
+        for cell in (('208', '1', '9', '301'), ('1', '1', '1', '1'), ('999', '999', '65535', '1')):
+            self.failUnless(index.add(*cell), '')
+        index.save()
+        self.failUnless(os.path.getsize(self._filename) == 2 * SeenCellsIndex.RECORD.size, 'not rewritten')
+
+        index = SeenCellsIndex(self._filename)
+        self.failUnless(index.count() == 5, '')
+        index.merge()
+        self.failUnless(os.path.getsize(self._filename) == 5 * SeenCellsIndex.RECORD.size, '')
+        for cell in (('208', '1', '9', '301'), ('1', '1', '1', '1'), ('999', '999', '65535', '1'),
+                     ('208', '1', '10', '20'), ('208', '1', '9', '300000')):
+            self.failUnless(index.contains(*cell), '')
+        self.failIf(index.contains('208', '1', '10', '21'), '')
+        data = open(self._filename, 'rb').read()
+        size = SeenCellsIndex.RECORD.size
+        records = [data[i:i + size] for i in range(0, len(data), size)]
+        self.failUnless(records == sorted(records), '')
+
+    def test_automatic_save(self):
+        index = SeenCellsIndex(self._filename)
+        index.MAX_SIDE = 2 * SeenCellsIndex.MAX_PENDING
+        for cid in xrange(SeenCellsIndex.MAX_PENDING):
+            index.add('208', '1', '10', str(cid))
+        self.failUnless(os.path.getsize(self._filename + SeenCellsIndex.SIDE_SUFFIX) ==
+                        SeenCellsIndex.MAX_PENDING * SeenCellsIndex.RECORD.size, '')
+        self.failUnless(index.contains('208', '1', '10', '0'), '')
+        self.failUnless(index.count() == SeenCellsIndex.MAX_PENDING, '')
+        for cid in xrange(SeenCellsIndex.MAX_PENDING):
+            index.add('208', '1', '11', str(cid))
+        self.failUnless(os.path.getsize(self._filename) ==
+                        2 * SeenCellsIndex.MAX_PENDING * SeenCellsIndex.RECORD.size, 'merged')
+        self.failIf(os.path.exists(self._filename + SeenCellsIndex.SIDE_SUFFIX), '')
+        self.failUnless(index.count() == 2 * SeenCellsIndex.MAX_PENDING, '')
+
+    def test_interrupted_merge(self):
+        index = SeenCellsIndex(self._filename)
+        index.add('208', '1', '10', '20')
+        index.save()
+        shutil.copy(self._filename + SeenCellsIndex.SIDE_SUFFIX, os.path.join(self._dir, 'side'))
+        index.close()
+        # stopped before the side file was deleted
+        shutil.copy(os.path.join(self._dir, 'side'), self._filename + SeenCellsIndex.SIDE_SUFFIX)
+        index = SeenCellsIndex(self._filename)
+        self.failUnless(index.count() == 1, '')
+        self.failIf(index.add('208', '1', '10', '20'), '')
+
+    def test_save_error(self):
+        index = SeenCellsIndex(os.path.join(self._dir, 'missing', 'seen.idx'))
+        for cid in xrange(SeenCellsIndex.MAX_PENDING):
+            index.add('208', '1', '10', str(cid))
+        self.failIf(index.save(), '')
+        self.failIf(index.merge(), '')
+        self.failUnless(index.count() == SeenCellsIndex.MAX_PENDING, 'kept in memory')
+        self.failUnless(index.contains('208', '1', '10', '0'), '')
+
+if __name__ == '__main__':
+    unittest.main()
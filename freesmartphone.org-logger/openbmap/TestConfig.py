@@ -16,9 +16,10 @@
 
 import unittest
 import os
+import tempfile
 import ConfigParser
 
-from logger import Config
+from logger import Config, parse_plugins_list
 
 Config.CONFIGURATION_FILENAME += '.test'
 
@@ -98,5 +99,59 @@ class TestConfig(unittest.TestCase):
         self.failUnless(self._config.get(params[0][0],
                                          'toto') == 'titi', '')
 
+class TestConfigSnapshot(unittest.TestCase):
+
+    def setUp(self):
+        (fd, self._filename) = tempfile.mkstemp()
+        os.close(fd)
+        self._config = Config(self._filename)
+        self._config.set_config_if_not_exist([('General', [('size', '20'),
+                                                           ('level', 'info'),
+                                                           ('plugins', [])])])
+        self._config.set_schema([('SIZE', 'General', 'size', int),
+                                 ('LEVEL', 'General', 'level', str.upper),
+                                 ('PLUGINS', 'General', 'plugins', parse_plugins_list)])
+
+    def tearDown(self):
+        os.remove(self._filename)
+
+    def test_typed_values(self):
+        snapshot = self._config.get_snapshot()
+        self.failUnless(snapshot.SIZE == 20, '')
+        self.failUnless(snapshot.LEVEL == 'INFO', '')
+        self.failUnless(snapshot.PLUGINS == (), '')
+        self.failUnless(self._config.get_snapshot() is snapshot, 'parsed once')
+        self.failUnlessRaises(AttributeError, setattr, snapshot, 'SIZE', 1)
+
+    def test_invalidation(self):
+        snapshot = self._config.get_snapshot()
+        self._config.set('General', 'size', '30')
+        self._config.set('General', 'plugins', ['Dummy', 'Other'])
+        self.failUnless(self._config.get_snapshot().SIZE == 30, '')
+        self.failUnless(self._config.get_snapshot().PLUGINS == ('Dummy', 'Other'), '')
+        self.failUnless(snapshot.SIZE == 20, 'a snapshot never changes')
+        self._config.save_config()
+        self.failUnless(Config(self._filename).get('General', 'plugins') == "['Dummy', 'Other']", '')
+
+    def test_reload(self):
+        snapshot = self._config.get_snapshot()
+        self.failIf(self._config.reload(lambda candidate: True), 'not modified')
+        other = Config(self._filename)
+        other.set('General', 'size', '40')
+        other.save_config()
+        os.utime(self._filename, (0, 0))
+        self.failIf(self._config.reload(lambda candidate: False), 'invalid')
+        self.failUnless(self._config.get_snapshot() is snapshot, '')
+        os.utime(self._filename, (1, 1))
+        self.failUnless(self._config.reload(lambda candidate: candidate.get_snapshot().SIZE == 40), '')
+        self.failUnless(self._config.get_snapshot().SIZE == 40, '')
+        self.failIf(self._config.reload(lambda candidate: True), 'already reloaded')
+
+    def test_parse_plugins_list(self):
+        self.failUnless(parse_plugins_list("['A', \"B\"]") == ('A', 'B'), '')
+        self.failUnlessRaises(ValueError, parse_plugins_list, "[1]")
+        self.failUnlessRaises(ValueError, parse_plugins_list, "'A'")
+        self.failUnlessRaises(ValueError, parse_plugins_list, "__import__('os').remove('x')")
+
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import os
+import shutil
+import tempfile
+
+import container
+from container import LogContainer
+
+class TestContainer(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._container = LogContainer(os.path.join(self._dir, 'V2_208' + container.EXTENSION))
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def make_file(self, name, content):
+        filename = os.path.join(self._dir, name)
+        f = open(filename, 'wb')
+        f.write(content)
+        f.close()
+        return filename
+
+    def test_name_prefix(self):
+        self.failUnless(container.name_prefix('/a/V2_208_log20100605143059.xml.gz') == 'V2_208', '')
+        self.failUnless(container.container_filename('/a', 'V2_1_log1.obmb') == '/a/V2_1.pack', '')
+
+    def test_append_and_extract(self):
+        self.failUnless(self._container.read_index() == [], '')
+        for (name, content) in [('V2_208_log1.xml', '<logfile>1</logfile>'), ('V2_208_log2.xml', ''),
+                                ('V2_208_log3.xml', '<logfile>3</logfile>')]:
+            entry = self._container.append(name, self.make_file('source', content))
+            self.failUnless(self._container.extract(entry) == content, '')
+        entries = self._container.read_index()
+        self.failUnless([entry.name for entry in entries] == ['V2_208_log1.xml', 'V2_208_log2.xml', 'V2_208_log3.xml'], '')
+        self.failUnless(self._container.extract(entries[2]) == '<logfile>3</logfile>', '')
+        self.failUnless(self._container.contains('V2_208_log2.xml'), '')
+        self.failIf(self._container.contains('V2_208_log4.xml'), '')
+        self.failUnlessRaises(ValueError, self._container.append, 'x' * 56, self.make_file('source', ''))
+
+    def test_mark_done(self):
+        first = self._container.append('V2_208_log1.xml', self.make_file('source', 'one'))
+        second = self._container.append('V2_208_log2.xml', self.make_file('source', 'two'))
+        self._container.mark_done(first)
+        self.failUnless(self._container.get_pending() == [second], '')
+        self.failUnless(self._container.read_index()[0].done, '')
+        self._container.mark_done(second)
+        self.failIf(os.path.exists(self._container.get_filename()), 'deleted once all done')
+        self.failIf(self._container.exists(), '')
+
+    def test_interrupted_append(self):
+        self._container.append('V2_208_log1.xml', self.make_file('source', 'one'))
+        # slice written, but not its index entry (which is truncated)
+        f = open(self._container.get_filename(), 'ab')
+        f.write('garbage')
+        f.close()
+        f = open(self._container.get_filename() + container.INDEX_SUFFIX, 'ab')
+        f.write('\0' * 10)
+        f.close()
+        self.failUnless(len(self._container.read_index()) == 1, '')
+        entry = self._container.append('V2_208_log2.xml', self.make_file('source', 'two'))
+        self.failUnless(entry.offset == 3, 'garbage dropped')
+        self.failUnless([self._container.extract(e) for e in self._container.read_index()] == ['one', 'two'], '')
+
+    def test_compact(self):
+        logDir = os.path.join(self._dir, 'FSO_GSM')
+        os.mkdir(logDir)
+        for name in ['V2_208_log1.xml', 'V2_208_log2.xml.gz', 'V2_228_log1.obmb']:
+            f = open(os.path.join(logDir, name), 'wb')
+            f.write(name)
+            f.close()
+        containersDir = os.path.join(self._dir, 'Packed')
+        self.failUnless(container.compact(logDir, containersDir) == 3, '')
+        self.failUnless(os.listdir(logDir) == [], '')
+        containers = container.list_containers(containersDir)
+        self.failUnless([os.path.basename(c.get_filename()) for c in containers] == ['V2_208.pack', 'V2_228.pack'], '')
+        entries = containers[0].read_index()
+        self.failUnless([containers[0].extract(entry) for entry in entries] == ['V2_208_log1.xml', 'V2_208_log2.xml.gz'], '')
+        # interrupted before deleting the file: not packed twice
+        f = open(os.path.join(logDir, 'V2_228_log1.obmb'), 'wb')
+        f.write('V2_228_log1.obmb')
+        f.close()
+        self.failUnless(container.compact(logDir, containersDir) == 1, '')
+        self.failUnless(len(containers[1].read_index()) == 1, '')
+
+if __name__ == '__main__':
+    unittest.main()
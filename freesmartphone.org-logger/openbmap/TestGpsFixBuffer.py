@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+
+from gpsfixes import GpsFixBuffer
+
+class TestGpsFixBuffer(unittest.TestCase):
+
+    def setUp(self):
+        self._buffer = GpsFixBuffer(4)
+
+    def append(self, when, valid=True, lat=45.0, speed=10.0, hdop=1.0):
+        # tstamp, lat, lng, alt, pdop, hdop, vdop, speed, heading
+        return self._buffer.append(when, valid, 1000 + when, lat, 15.0, 100.0, 2.0, hdop, 1.5, speed, 90.0)
+
+    def test_empty(self):
+        self.failUnless(self._buffer.get_at(10) == None, '')
+        self.failUnless(self._buffer.newest_time() == None, '')
+
+    def test_interpolation(self):
+        self.append(10, lat=45.0, speed=10.0, hdop=1.0)
+        self.append(12, lat=46.0, speed=20.0, hdop=3.0)
+        fix = self._buffer.get_at(10.5)
+        self.failUnless(fix[0], '')
+        self.failUnless(fix[1] == 1010.5, '')
+        self.failUnless(fix[2] == 45.25, '')
+        self.failUnless(fix[6] == 3.0, 'worst hdop expected')
+        self.failUnless(fix[8] == 10.0, 'nearest speed expected')
+        self.failUnless(self._buffer.get_at(11.5)[8] == 20.0, 'nearest speed expected')
+        self.failUnless(self._buffer.get_at(12)[2] == 46.0, '')
+
+    def test_validity(self):
+        self.append(10, valid=False)
+        self.append(12)
+        self.failIf(self._buffer.get_at(11)[0], '')
+        self.failUnless(self._buffer.get_at(12)[0], '')
+
+    def test_out_of_range(self):
+        self.append(10)
+        self.append(20)
+        self.failUnless(self._buffer.get_at(9) == None, 'before the oldest fix')
+        self.failUnless(self._buffer.get_at(15) == None, 'fixes too far apart')
+        self.failUnless(self._buffer.get_at(21)[1] == 1020, 'newest fix expected')
+        self.failUnless(self._buffer.get_at(23) == None, 'newest fix too old')
+
+    def test_ring(self):
+        for when in range(10, 16):
+            self.append(when, lat=when)
+        self.failUnless(len(self._buffer) == 4, '')
+        self.failUnless(self._buffer.get_at(11) == None, 'dropped fix')
+        self.failUnless(self._buffer.get_at(12.5)[2] == 12.5, '')
+        self.failUnless(self._buffer.newest_time() == 15, '')
+
+    def test_ordering(self):
+        self.failUnless(self.append(10, lat=1), '')
+        self.failIf(self.append(9), '')
+        self.failUnless(self.append(10, lat=2), '')
+        self.failUnless(len(self._buffer) == 1, '')
+        self.failUnless(self._buffer.get_at(10)[2] == 2, '')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import os
+import shutil
+import tempfile
+from cStringIO import StringIO
+
+import hashindex
+from hashindex import HashIndex, DIGEST_SIZE
+
+class TestHashIndex(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._filename = os.path.join(self._dir, 'Uploaded.hashes')
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def test_digests(self):
+        content = '<logfile>' + 'x' * 100000 + '</logfile>'
+        digest = hashindex.digest_string(content)
+        self.failUnless(len(digest) == DIGEST_SIZE, '')
+        self.failUnless(hashindex.digest_file(StringIO(content + 'trailing'), len(content)) == digest, '')
+        self.failIf(hashindex.digest_string(content + ' ') == digest, '')
+        self.failUnlessRaises(IOError, hashindex.digest_file, StringIO(content), len(content) + 1)
+
+    def test_no_file(self):
+        index = HashIndex(self._filename)
+        self.failUnless(index.count() == 0, '')
+        self.failIf(index.contains(hashindex.digest_string('a')), '')
+        index.close()
+        self.failIf(os.path.exists(self._filename), '')
+        self.failUnlessRaises(ValueError, index.add, 'too short')
+
+    def test_add_save_reload(self):
+        index = HashIndex(self._filename)
+        self.failUnless(index.add('\x80' * DIGEST_SIZE), '')
+        self.failIf(index.add('\x80' * DIGEST_SIZE), '')
+        index.add('\x40' * DIGEST_SIZE)
+        self.failUnless(index.save(), '')
+        self.failIf(os.path.exists(self._filename), 'only the side file is written')
+        self.failUnless(os.path.getsize(self._filename + HashIndex.SIDE_SUFFIX) == 2 * DIGEST_SIZE, '')
+
+        index = HashIndex(self._filename)
+        self.failUnless(index.count() == 2, '')
+        self.failUnless(index.contains('\x40' * DIGEST_SIZE), '')
+        # merged in the middle, before and after the existing records
+        for digest in ('\x60' * DIGEST_SIZE, '\x00' * DIGEST_SIZE, '\xff' * DIGEST_SIZE):
+            self.failUnless(index.add(digest), '')
+        index.close()
+
+        index = HashIndex(self._filename)
+        self.failUnless(index.count() == 5, '')
+        for c in '\x00\x40\x60\x80\xff':
+            self.failUnless(index.contains(c * DIGEST_SIZE), '')
+        self.failIf(index.contains('\x41' * DIGEST_SIZE), '')
+        data = open(self._filename, 'rb').read()
+        self.failUnless(data == ''.join([c * DIGEST_SIZE for c in '\x00\x40\x60\x80\xff']), 'sorted')
+
+    def test_many(self):
+        digests = [hashindex.digest_string(str(i)) for i in xrange(20000)]
+        index = HashIndex(self._filename)
+        for digest in digests:
+            index.add(digest)
+        index.close()
+        self.failUnless(os.path.getsize(self._filename) == len(digests) * DIGEST_SIZE, '')
+        data = open(self._filename, 'rb').read()
+        self.failUnless(data == ''.join(sorted(digests)), '')
+        index = HashIndex(self._filename)
+        self.failUnless(index.count() == len(digests), '')
+        self.failIf([digest for digest in digests[::97] if not index.contains(digest)], '')
+        self.failIf(index.contains(hashindex.digest_string('20000')), '')
+
+    def test_merge_threshold(self):
+        index = HashIndex(self._filename)
+        index.MAX_SIDE = 3 * HashIndex.MAX_PENDING
+        digests = [hashindex.digest_string(str(i)) for i in xrange(3 * HashIndex.MAX_PENDING)]
+        for digest in digests[:2 * HashIndex.MAX_PENDING]:
+            index.add(digest)
+        self.failIf(os.path.exists(self._filename), 'saved in the side file')
+        self.failUnless(os.path.getsize(self._filename + HashIndex.SIDE_SUFFIX) ==
+                        2 * HashIndex.MAX_PENDING * DIGEST_SIZE, '')
+        for digest in digests[2 * HashIndex.MAX_PENDING:]:
+            index.add(digest)
+        self.failUnless(os.path.getsize(self._filename) == len(digests) * DIGEST_SIZE, 'merged')
+        self.failIf(os.path.exists(self._filename + HashIndex.SIDE_SUFFIX), '')
+        self.failIf([digest for digest in digests if not index.contains(digest)], '')
+        index.close()
+
+    def test_corrupted(self):
+        f = open(self._filename, 'wb')
+        f.write('\x10' * DIGEST_SIZE + '\x20' * 3)
+        f.close()
+        index = HashIndex(self._filename)
+        self.failUnless(index.count() == 1, 'trailing bytes ignored')
+        index.add('\x30' * DIGEST_SIZE)
+        index.close()
+        self.failUnless(open(self._filename, 'rb').read() == '\x10' * DIGEST_SIZE + '\x30' * DIGEST_SIZE, '')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,293 @@
+#!/usr/bin/env python
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import os
+import shutil
+import tempfile
+import time
+import gzip
+from cStringIO import StringIO
+
+import logwriter
+from logwriter import LogWriter, BackgroundWriter
+import xmllog
+
+class TextFormat(xmllog.XmlFormat):
+    """Writes the records (strings) as they are."""
+
+    def encode(self, record):
+        return (record, len(record))
+
+class TestLogWriter(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._logDir = os.path.join(self._dir, 'FSO_GSM')
+        self._journalDir = os.path.join(self._dir, 'Journal')
+        self._writer = LogWriter(self._logDir, self._journalDir, 'V2', '<logfile>\n', '</logfile>', TextFormat)
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def read(self, filename):
+        f = open(filename, 'r')
+        content = f.read()
+        f.close()
+        return content
+
+    def test_segment(self):
+        self.failIf(self._writer.is_open(), '')
+        self.failUnless(self._writer.finish('208') == None, '')
+        self._writer.append('208', '<scan a/>\n')
+        filename = self._writer.get_filename('208')
+        self.failUnless(os.path.basename(filename).startswith('V2_208_log'), '')
+        self.failIf(os.path.exists(filename), 'published before being finished')
+        self.failUnless(os.listdir(self._logDir) == [], '')
+        self._writer.append('208', '<scan b/>\n')
+        self.failUnless(self._writer.get_nb_scans('208') == 2, '')
+        self.failUnless(self._writer.get_size('208') == len('<logfile>\n<scan a/>\n<scan b/>\n'), '')
+        self.failUnless(self._writer.finish('208') == filename, '')
+        self.failIf(self._writer.is_open(), '')
+        content = self.read(filename)
+        self.failUnless(content == '<logfile>\n<scan a/>\n<scan b/>\n</logfile>', '')
+
+    def test_one_segment_per_mcc(self):
+        self._writer.append('208', '<scan a/>\n')
+        self._writer.append('228', '<scan b/>\n')
+        self._writer.append('208', '<scan c/>\n')
+        self.failUnless(self._writer.get_open_mccs() == ['208', '228'], '')
+        self.failUnless(self._writer.get_nb_scans('208') == 2, '')
+        self.failUnless(self._writer.get_nb_scans('228') == 1, '')
+        self.failUnless(os.path.basename(self._writer.get_filename('228')).startswith('V2_228_log'), '')
+        first = self._writer.get_filename('208')
+        self.failUnless(len(self._writer.finish_all()) == 2, '')
+        self.failIf(self._writer.is_open(), '')
+        self.failUnless(self.read(first) == '<logfile>\n<scan a/>\n<scan c/>\n</logfile>', '')
+
+    def test_age_rotation(self):
+        self._writer.set_rotation(0, 0, 60)
+        self.failUnless(self._writer.next_expiry() == None, '')
+        self._writer.append('208', '<scan a/>\n')
+        self.failUnless(self._writer.next_expiry() > 50, '')
+        self.failUnless(self._writer.finish_expired() == [], '')
+        self._writer.set_rotation(0, 0, 0.01)
+        time.sleep(0.02)
+        self.failUnless(self._writer.next_expiry() == 0, '')
+        self.failUnless(len(self._writer.finish_expired()) == 1, '')
+        self.failIf(self._writer.is_open(), '')
+
+    def test_rotation(self):
+        self._writer.set_rotation(len('<logfile>\n<scan a/>\n<scan b/>\n</logfile>'), 0)
+        self._writer.append('208', '<scan a/>\n')
+        self._writer.append('208', '<scan b/>\n')
+        first = self._writer.get_filename('208')
+        self._writer.append('208', '<scan c/>\n')
+        self.failUnless(self.read(first) == '<logfile>\n<scan a/>\n<scan b/>\n</logfile>', '')
+        self.failUnless(self._writer.get_nb_scans('208') == 1, '')
+
+        self._writer.set_rotation(0, 2)
+        self._writer.append('208', '<scan d/>\n')
+        self.failIf(self._writer.is_open(), '')
+        self.failUnless(len(os.listdir(self._logDir)) == 2, '')
+
+    def test_compression(self):
+        self._writer.set_compression(True)
+        scans = ['<scan time="%i"><gsmserving mcc="208" mnc="1"/></scan>\n' % i for i in range(100)]
+        for scan in scans:
+            self._writer.append('208', scan)
+        filename = self._writer.finish('208')
+        self.failUnless(filename.endswith('.xml.gz'), '')
+        self.failUnless(os.listdir(self._journalDir) == [], '')
+        xml = '<logfile>\n' + ''.join(scans) + '</logfile>'
+        self.failUnless(logwriter.load_as_xml(filename) == xml, '')
+        self.failUnless(logwriter.get_xml_name(filename) == filename[:-len('.gz')], '')
+        self.failUnless(logwriter.get_xml_name('plugin.log.gz') == 'plugin.log', 'unknown format kept')
+        self.failUnless(logwriter.get_xml_size(filename) == len(xml), '')
+        self.failUnless(logwriter.open_log(filename).read() == xml, '')
+        stats = self._writer.get_stats()
+        self.failUnless(stats['published'] == len(xml), '')
+        self.failUnless(stats['stored'] == os.path.getsize(filename), '')
+        self.failUnless(stats['saved'] > len(xml) / 2, '')
+
+    def test_gzip_part(self):
+        xml = '<logfile>\n' + ''.join(['<scan time="%i"/>\n' % i for i in range(20000)]) + '</logfile>'
+        compressed = StringIO()
+        out = gzip.GzipFile('V2_208_log1.xml.gz', 'wb', fileobj=compressed)
+        out.write(xml)
+        out.close()
+        data = 'prefix' + compressed.getvalue() + 'next slice'
+        end = len(data) - len('next slice')
+        self.failUnless(logwriter.get_gzip_size(StringIO(data), end) == len(xml), '')
+        file = StringIO(data)
+        file.seek(len('prefix'))
+        reader = logwriter.open_gzip_part(file, end - len('prefix'))
+        pieces = []
+        while True:
+            piece = reader.read(1000)
+            if piece == '':
+                break
+            self.failUnless(len(piece) <= 1000, '')
+            pieces.append(piece)
+        self.failUnless(''.join(pieces) == xml, '')
+        file.seek(len('prefix'))
+        self.failUnless(logwriter.open_gzip_part(file, end - len('prefix')).read() == xml, '')
+        file.seek(len('prefix'))
+        self.failUnlessRaises(IOError, logwriter.open_gzip_part(file, len(data)).read)
+
+    def test_publish_listener(self):
+        published = []
+        self._writer.set_publish_listener(published.append)
+        self._writer.append('208', '<scan time="1"><gsmserving mcc="208" mnc="1"/></scan>\n')
+        self.failUnless(published == [], '')
+        self.failUnless(published == [os.path.basename(self._writer.finish('208'))], '')
+        self._writer.set_publish_listener(lambda name: 1 / 0)
+        self._writer.append('262', '<scan time="1"><gsmserving mcc="262" mnc="1"/></scan>\n')
+        self.failUnless(os.path.exists(self._writer.finish('262')), 'a failing listener is ignored')
+
+    def test_recover_compressed(self):
+        self._writer.set_compression(True)
+        self._writer.append('208', '<scan time="1"></scan>\n')
+        filename = self._writer.get_filename('208')
+        # simulates a crash while compressing
+        open(self._writer.journal_filename(filename)[:-len('.journal')], 'w').close()
+        writer = LogWriter(self._logDir, self._journalDir, 'V2', '<logfile>\n', '</logfile>')
+        self.failUnless(writer.recover() == [filename], '')
+        self.failUnless(logwriter.load_as_xml(filename) == '<logfile>\n<scan time="1"></scan>\n</logfile>', '')
+        self.failUnless(os.listdir(self._journalDir) == [], '')
+
+    def test_sync_policy(self):
+        self._writer.set_sync_policy(2, 0)
+        for i in range(5):
+            self._writer.append('208', '<scan/>\n')
+        self.failUnless(self._writer.get_nb_syncs() == 2, '')
+        self._writer.finish('208')
+        self.failUnless(self._writer.get_nb_syncs() == 3, 'finish() always syncs')
+
+    def test_sync_period_expiry(self):
+        self._writer.set_sync_policy(0, 60)
+        self._writer.append('208', '<scan/>\n')
+        self.failUnless(self._writer.get_nb_syncs() == 0, '')
+        self.failUnless(55 < self._writer.next_expiry() <= 60, 'sync due')
+        self._writer.set_sync_policy(0, 0)
+        self.failUnless(self._writer.next_expiry() == None, '')
+
+    def test_recover(self):
+        self._writer.append('208', '<scan time="1"></scan>\n')
+        self._writer.append('208', '<scan time="2"></scan>\n')
+        filename = self._writer.get_filename('208')
+        journal = self._writer.journal_filename(filename)
+        # simulates a crash while writing a scan
+        f = open(journal, 'a')
+        f.write('<scan time="3"><gsm')
+        f.close()
+        empty = os.path.join(self._journalDir, 'V2_208_log20100101000000.xml.journal')
+        f = open(empty, 'w')
+        f.write('<logfile>\n')
+        f.close()
+
+        writer = LogWriter(self._logDir, self._journalDir, 'V2', '<logfile>\n', '</logfile>')
+        self.failUnless(writer.recover() == [filename], '')
+        self.failUnless(self.read(filename) ==
+                        '<logfile>\n<scan time="1"></scan>\n<scan time="2"></scan>\n</logfile>', '')
+        self.failUnless(os.listdir(self._journalDir) == [], '')
+        self.failUnless(writer.recover() == [], '')
+
+    def test_containers(self):
+        containerDir = os.path.join(self._dir, 'Packed')
+        self._writer.set_container_dir(containerDir)
+        self._writer.set_compression(True)
+        self._writer.append('208', '<scan time="1"></scan>\n')
+        first = self._writer.finish('208')
+        self._writer.append('208', '<scan time="2"></scan>\n')
+        # another journal left by a crash, already packed
+        self._writer.append('228', '<scan time="3"></scan>\n')
+        journal = self._writer.journal_filename(self._writer.get_filename('228'))
+        shutil.copy(journal, journal + '.copy')
+        third = self._writer.finish('228')
+        os.rename(journal + '.copy', journal)
+        second = self._writer.finish('208')
+        self.failUnless(os.listdir(self._logDir) == [], 'nothing published as separate files')
+        self.failUnless(sorted(os.listdir(containerDir)) ==
+                        ['V2_208.pack', 'V2_208.pack.idx', 'V2_228.pack', 'V2_228.pack.idx'], '')
+        logContainer = self._writer.get_container(first)
+        entries = logContainer.read_index()
+        self.failUnless([entry.name for entry in entries] == [os.path.basename(first), os.path.basename(second)], '')
+        self.failUnless(logwriter.decode_as_xml(entries[1].name, logContainer.extract(entries[1])) ==
+                        '<logfile>\n<scan time="2"></scan>\n</logfile>', '')
+        self.failUnless(self._writer.get_stats()['stored'] == entries[0].length + entries[1].length +
+                        self._writer.get_container(third).read_index()[0].length, '')
+        self.failUnless(self._writer.recover() == [], '')
+        self.failUnless(os.listdir(self._journalDir) == [], '')
+
+class TestBackgroundWriter(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._logDir = os.path.join(self._dir, 'FSO_GSM')
+        self._writer = LogWriter(self._logDir, os.path.join(self._dir, 'Journal'), 'V2', '<logfile>\n', '</logfile>',
+                                 TextFormat)
+        self._thread = BackgroundWriter(self._writer, 4)
+        self._thread.start()
+
+    def tearDown(self):
+        if self._thread.isAlive():
+            self._thread.stop()
+        shutil.rmtree(self._dir)
+
+    def test_write_and_barrier(self):
+        for i in range(10):
+            self._thread.write('208', '<scan/>\n')
+        self.failUnless(self._thread.barrier(5), '')
+        counters = self._thread.get_counters()
+        self.failUnless(counters['written'] == 10, '')
+        self.failUnless(counters['depth'] == 0, '')
+        self.failUnless(counters['max_depth'] <= 4, '')
+        self.failUnless(counters['batches'] <= 11, '')
+        self.failUnless(self._thread.call(lambda: self._writer.get_nb_scans('208')) == 10, '')
+        self._thread.stop(5)
+        self.failIf(self._thread.isAlive(), '')
+        self.failUnless(len(os.listdir(self._logDir)) == 1, '')
+
+    def test_expiry_timer(self):
+        self._thread.call(lambda: self._writer.set_rotation(0, 0, 0.2))
+        self._thread.write('208', '<scan/>\n')
+        self.failUnless(self._thread.barrier(5), '')
+        self.failUnless(self._thread.call(self._writer.is_open), '')
+        batches = self._thread.get_counters()['batches']
+        # nothing else is queued: the timer wakes the writer up
+        time.sleep(0.6)
+        self.failUnless(len(os.listdir(self._logDir)) == 1, 'finished once too old')
+        # the batch of the call above may be counted late
+        self.failUnless(self._thread.get_counters()['batches'] <= batches + 2, 'no polling')
+
+    def test_sync_period_timer(self):
+        self._thread.call(lambda: self._writer.set_sync_policy(0, 0.2))
+        self._thread.write('208', '<scan/>\n')
+        self._thread.write('208', '<scan/>\n')
+        self.failUnless(self._thread.barrier(5), '')
+        self.failUnless(self._thread.call(self._writer.get_nb_syncs) == 0, '')
+        # no further scan: the timer wakes the writer up to fsync them
+        time.sleep(0.6)
+        self.failUnless(self._thread.call(self._writer.get_nb_syncs) == 1, '')
+        self.failUnless(self._thread.call(self._writer.next_expiry) == None, 'nothing left to sync')
+
+    def test_call_exception(self):
+        def fails():
+            raise ValueError, 'expected'
+        self.failUnlessRaises(ValueError, self._thread.call, fails, 5)
+        self.failUnless(self._thread.barrier(5), 'still running')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+#!/usr/bin/env python
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import os
+import shutil
+import tempfile
+
+import manifest
+
+class TestUploadManifest(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._filename = os.path.join(self._dir, 'Uploads.manifest')
+        self._manifest = self.reload()
+
+    def tearDown(self):
+        self._manifest.close()
+        shutil.rmtree(self._dir)
+
+    def reload(self):
+        result = manifest.UploadManifest(self._filename, 3, 10)
+        result.load()
+        return result
+
+    def nb_lines(self):
+        f = open(self._filename)
+        try:
+            return len(f.readlines())
+        finally:
+            f.close()
+
+    def test_states(self):
+        key = manifest.make_key('FSO_GSM', 'V2_208_log1.xml')
+        self.failUnless(key == 'FSO_GSM/V2_208_log1.xml', '')
+        self.failUnless(self._manifest.get(key) == None, '')
+        self._manifest.add(key)
+        self.failUnless(self._manifest.get(key) == manifest.ManifestEntry(key, manifest.PENDING, 0, 0, ''), '')
+        self.failUnless(self._manifest.is_due(key), '')
+        self._manifest.start(key)
+        self.failUnless(self._manifest.get(key).state == manifest.IN_FLIGHT, '')
+        self.failUnless(self._manifest.get(key).attempts == 1, '')
+        self.failIf(self._manifest.is_due(key), '')
+        self._manifest.succeeded(key)
+        self.failUnless(self._manifest.get(key).state == manifest.DONE, '')
+        self._manifest.add(key)
+        self.failUnless(self._manifest.get(key).state == manifest.DONE, 'already known')
+
+    def test_backoff(self):
+        self._manifest.add('a')
+        now = 1000
+        for (attempt, delay) in [(1, 10), (2, 20)]:
+            self._manifest.start('a')
+            self.failUnless(self._manifest.failed('a', 'Error\tin\nthe answer', now=now) == manifest.PENDING, '')
+            entry = self._manifest.get('a')
+            self.failUnless(entry.attempts == attempt, '')
+            self.failUnless(entry.nextAttempt == now + delay, '')
+            self.failIf(self._manifest.is_due('a', now + delay - 1), '')
+            self.failUnless(self._manifest.is_due('a', now + delay), '')
+        self.failUnless(self._manifest.get_counts(now)['waiting'] == 1, '')
+        self._manifest.start('a')
+        self.failUnless(self._manifest.failed('a', 'refused', now=now) == manifest.REJECTED, 'third attempt')
+        self.failIf(self._manifest.is_due('a', now + manifest.MAX_RETRY_DELAY), '')
+        self.failUnless(self._manifest.get('a').lastError == 'refused', '')
+
+    def test_transient(self):
+        self._manifest.set_policy(1, 100)
+        self._manifest.add('a')
+        for i in range(30):
+            self._manifest.start('a')
+            self.failUnless(self._manifest.failed('a', 'timed out', True, now=0) == manifest.PENDING, '')
+        self.failUnless(self._manifest.get('a').nextAttempt == manifest.MAX_RETRY_DELAY, '')
+
+    def test_durable(self):
+        for key in ['a', 'b', 'c', 'd']:
+            self._manifest.add(key)
+        self._manifest.start('a')
+        self._manifest.failed('a', 'Error\tin\nthe answer', now=50)
+        self._manifest.start('b')
+        self._manifest.start('c')
+        self._manifest.succeeded('c')
+        self._manifest.close()
+        # interrupted write
+        f = open(self._filename, 'a')
+        f.write('d\tdone')
+        f.close()
+        self._manifest = self.reload()
+        self.failUnless(self._manifest.get('a') ==
+                        manifest.ManifestEntry('a', manifest.PENDING, 1, 60, 'Error in the answer'), '')
+        self.failUnless(self._manifest.get('b') == manifest.ManifestEntry('b', manifest.PENDING, 1, 0, ''),
+                        'in flight when stopped')
+        self.failUnless(self._manifest.get('c') == None, 'done ones are forgotten')
+        self.failUnless(self._manifest.get('d').state == manifest.PENDING, '')
+        self.failUnless(self.nb_lines() == 3, 'compacted')
+
+    def test_sync(self):
+        for key in ['a', 'b', 'c']:
+            self._manifest.add(key)
+        self._manifest.set_policy(1, 10)
+        self._manifest.start('c')
+        self._manifest.failed('c', 'refused')
+        self._manifest.sync(['b', 'd'])
+        self.failUnless([entry.key for entry in self._manifest.get_entries()] == ['b', 'c', 'd'], '')
+        self.failUnless(self._manifest.get_counts()[manifest.REJECTED] == 1, '')
+        self._manifest.sync(['b', 'c', 'd'])
+        self.failUnless(self._manifest.get('c') == manifest.ManifestEntry('c', manifest.PENDING, 0, 0, ''),
+                        'back from the quarantine')
+        self.failUnless(self._manifest.get_counts() == {manifest.PENDING: 3, manifest.IN_FLIGHT: 0,
+                                                        manifest.DONE: 0, manifest.REJECTED: 0, 'waiting': 0}, '')
+        self._manifest.close()
+        self.failUnless([entry.key for entry in self.reload().get_entries()] == ['b', 'c', 'd'], '')
+
+    def test_compaction(self):
+        self._manifest.add('a')
+        for i in range(2000):
+            self._manifest.start('a')
+            self._manifest.failed('a', 'timed out', True)
+        self.failUnless(self.nb_lines() <= 1001, '')
+        self._manifest.close()
+        self.failUnless(self.reload().get('a').attempts == 2000, '')
+
+if __name__ == '__main__':
+    unittest.main()
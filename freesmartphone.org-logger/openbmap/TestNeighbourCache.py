@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+
+from neighbourcache import NeighbourCellsCache
+
+class TestNeighbourCellsCache(unittest.TestCase):
+
+    def setUp(self):
+        # 30 sec., 500 m
+        self._cache = NeighbourCellsCache(30, 500)
+        self._cache.set_position(45.0, 15.0)
+        self._key = ('208', '1', 10, 20)
+        self._cells = ({'lac': 10, 'cid': 21}, {'lac': 10, 'cid': 22})
+
+    def test_hit(self):
+        self.failUnless(self._cache.lookup(self._key, 1000) == None, '')
+        self._cache.store(self._key, self._cells, 1000)
+        self.failUnless(self._cache.lookup(self._key, 1010) == self._cells, '')
+        self.failUnless(self._cache.lookup(('208', '1', 10, 21), 1010) == None, 'other serving cell')
+        self.failUnless(self._cache.get_counters() == {'hits': 1, 'misses': 2, 'invalidated': 0}, '')
+
+    def test_expiry(self):
+        self._cache.store(self._key, self._cells, 1000)
+        self.failUnless(self._cache.lookup(self._key, 1030) == self._cells, '')
+        self.failUnless(self._cache.lookup(self._key, 1031) == None, 'expired')
+        self._cache.store(self._key, self._cells, 1031)
+        self.failUnless(self._cache.lookup(self._key, 1040) == self._cells, 'stored again')
+
+    def test_disabled(self):
+        self._cache.store(self._key, self._cells, 1000)
+        self._cache.set_parameters(0, 500)
+        self.failUnless(self._cache.lookup(self._key, 1000) == None, '')
+        self._cache.store(self._key, self._cells, 1000)
+        self._cache.set_parameters(30, 500)
+        self.failUnless(self._cache.lookup(self._key, 1000) == None, 'nothing stored while disabled')
+        self.failUnless(self._cache.get_counters()['hits'] == 0, '')
+
+    def test_set_position_invalidation(self):
+        self._cache.store(self._key, self._cells, 1000)
+        # about 111 m to the north
+        self._cache.set_position(45.001, 15.0)
+        self.failUnless(self._cache.lookup(self._key, 1001) == self._cells, 'still close enough')
+        # about 1.1 km from where it was stored
+        self._cache.set_position(45.01, 15.0)
+        self.failUnless(self._cache.get_counters()['invalidated'] == 1, '')
+        self.failUnless(self._cache.lookup(self._key, 1002) == None, '')
+
+    def test_no_distance_limit(self):
+        self._cache.set_parameters(30, 0)
+        self._cache.store(self._key, self._cells, 1000)
+        self._cache.set_position(46.0, 15.0)
+        self.failUnless(self._cache.lookup(self._key, 1001) == self._cells, '')
+
+    def test_invalidate(self):
+        self._cache.store(self._key, self._cells, 1000)
+        self._cache.invalidate(self._key)
+        self._cache.invalidate(self._key)
+        self.failUnless(self._cache.get_counters()['invalidated'] == 1, '')
+        self.failUnless(self._cache.lookup(self._key, 1000) == None, '')
+
+if __name__ == '__main__':
+    unittest.main()
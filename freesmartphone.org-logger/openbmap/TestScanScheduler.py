@@ -0,0 +1,94 @@
+#!/usr/bin/env python
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+
+import scheduler
+from scheduler import ScanScheduler
+
+class TestScanScheduler(unittest.TestCase):
+
+    def setUp(self):
+        # between 3 and 60 sec., every 100 m
+        self._scheduler = ScanScheduler(3, 60, 100)
+        self._scheduler.start(1000, 10)
+        self._cell = ('208', '1', '10', '20')
+
+    def test_distance(self):
+        # one degree of latitude is about 111 km
+        d = scheduler.distance_m(45.0, 15.0, 46.0, 15.0)
+        self.failUnless(111000 < d < 111400, '')
+        self.failUnless(scheduler.distance_m(45.0, 15.0, 45.0, 15.0) == 0, '')
+
+    def test_next_delay_depends_on_speed(self):
+        # first scan at 1010, 36 km/h is 10 m/s: 10 sec. for 100 m
+        self.failUnless(self._scheduler.next_delay(1010, 36) == 10, '')
+        # at 360 km/h, bounded by the minimal interval
+        self.failUnless(self._scheduler.next_delay(1020, 360) == 3, '')
+        # parked: maximal interval
+        self.failUnless(self._scheduler.next_delay(1023, 0) == 60, '')
+
+    def test_drift_compensation(self):
+        # the scan took 2 sec., the next one is still on schedule
+        self.failUnless(self._scheduler.next_delay(1012, 36) == 8, '')
+        # very late: resynchronised
+        self.failUnless(self._scheduler.next_delay(1100, 36) == 3, '')
+
+    def test_should_scan(self):
+        s = self._scheduler
+        self.failIf(s.should_scan(1010, False, 50, 45.0, 15.0, self._cell, 0)[0], '')
+        self.failIf(s.should_scan(1010, True, 5, 45.0, 15.0, self._cell, 10)[0], '')
+        self.failUnless(s.should_scan(1010, True, 50, 45.0, 15.0, self._cell, 0)[0], '')
+        s.scan_done(True, 1010, 45.0, 15.0)
+        # about 11 m away
+        self.failIf(s.should_scan(1020, True, 50, 45.0001, 15.0, self._cell, 0)[0], '')
+        # the serving cell changed
+        self.failUnless(s.should_scan(1025, True, 50, 45.0001, 15.0, ('208', '1', '10', '21'), 0)[0], '')
+        s.scan_done(True, 1025, 45.0001, 15.0)
+        self.failIf(s.should_scan(1030, True, 50, 45.0001, 15.0, ('208', '1', '10', '21'), 0)[0], '')
+        # maximal interval elapsed
+        self.failUnless(s.should_scan(1090, True, 50, 45.0001, 15.0, ('208', '1', '10', '21'), 0)[0], '')
+        # about 111 m away
+        self.failUnless(s.should_scan(1030, True, 50, 45.0011, 15.0, ('208', '1', '10', '21'), 0)[0], '')
+        counters = s.get_counters()
+        self.failUnless(counters['avoided_no_fix'] == 1, '')
+        self.failUnless(counters['avoided_speed'] == 1, '')
+        self.failUnless(counters['avoided_distance'] == 2, '')
+        self.failUnless(counters['serving_cell_changes'] == 1, '')
+        self.failUnless(counters['accepted'] == 2, '')
+
+    def test_handover_scans(self):
+        s = self._scheduler
+        self.failUnless(s.handover_scan_allowed(1005), '')
+        # schedule restarts from the handover scan
+        self.failUnless(s.next_delay(1005, 36) == 10, '')
+        self.failIf(s.handover_scan_allowed(1006), 'rate limited')
+        self.failUnless(s.handover_scan_allowed(1008), '')
+        counters = s.get_counters()
+        self.failUnless(counters['handover_scans'] == 2, '')
+        self.failUnless(counters['handover_rate_limited'] == 1, '')
+
+    def test_reschedule(self):
+        self.failUnless(self._scheduler.reschedule(1005, 36) == None, 'first scan pending')
+        self.failUnless(self._scheduler.next_delay(1010, 0) == 60, '')
+        # the maximal interval is reduced while waiting for the next scan
+        self._scheduler.set_parameters(3, 20, 100)
+        self.failUnless(self._scheduler.reschedule(1015, 0) == 15, '')
+        # the schedule goes on from the rescheduled target
+        self.failUnless(self._scheduler.next_delay(1030, 0) == 20, '')
+        self.failUnless(self._scheduler.handover_scan_allowed(1040), '')
+        self.failUnless(self._scheduler.reschedule(1040, 0) == None, 'handover scan pending')
+
+if __name__ == '__main__':
+    unittest.main()
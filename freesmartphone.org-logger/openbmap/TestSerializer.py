@@ -0,0 +1,66 @@
+#!/usr/bin/env python
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+
+import serializer
+import xmllog
+from BenchSerializer import reference_format_scan, reference_format_gps_data
+from TestBinLog import make_records
+
+class TestSerializer(unittest.TestCase):
+
+    def test_same_as_reference(self):
+        for record in make_records(500):
+            self.failUnless(serializer.serialize_scan(record) == reference_format_scan(record), '')
+
+    def test_gps_data(self):
+        for gpsData in ((True, 1275748259.0, 48.5, 2.25, 120, 1.5, 2, 3.456, 0, 359.999999999),
+                        (True, 0, -0.0000000001, 180, -12.34, 0.001, 10.1, 0.005, 123.4567, 0)):
+            self.failUnless(serializer.format_gps_data(gpsData) == reference_format_gps_data(gpsData), '')
+
+    def test_format_fixed(self):
+        self.failUnless(serializer.format_fixed(1.5, 2) == '1.5', '')
+        self.failUnless(serializer.format_fixed(100, 9) == '100', '')
+        self.failUnless(serializer.format_fixed(0.123456, 3) == '0.123', '')
+
+    def test_batch(self):
+        records = make_records(20)
+        self.failUnless(serializer.serialize_scans(records) ==
+                        ''.join([serializer.serialize_scan(record) for record in records]), '')
+        self.failUnless(serializer.serialize_scans([]) == '', '')
+
+    def test_scan_length(self):
+        for record in make_records(500, 7):
+            self.failUnless(serializer.scan_length(record) == len(serializer.serialize_scan(record)), '')
+        record = make_records(1)[0]
+        cell = {'lac': '1&2', 'cid': '"3"', 'rxlev': 1, 'c1': 2, 'c2': 3}
+        record = record._replace(date=u'2010\xe9', servingCell=('2<8', "1>'") + record.servingCell[2:],
+                                 neighbourCells=(cell,))
+        self.failUnless(serializer.scan_length(record) == len(serializer.serialize_scan(record)), 'escaped')
+
+    def test_escape(self):
+        self.failUnless(serializer.escape(208) == '208', '')
+        self.failUnless(serializer.escape('a<b>&"c\'') == 'a&lt;b&gt;&amp;&quot;c&apos;', '')
+        self.failUnless(serializer.escape(u'\xe9&') == u'\xe9&amp;', 'unicode is kept')
+        record = make_records(1)[0]
+        cell = {'lac': '1&2', 'cid': '"3"', 'rxlev': 1, 'c1': 2, 'c2': 3}
+        record = record._replace(servingCell=('2<8', '1>') + record.servingCell[2:], neighbourCells=(cell,))
+        scan = serializer.serialize_scan(record)
+        self.failUnless('mcc="2&lt;8" mnc="1&gt;"' in scan, '')
+        self.failUnless('lac="1&amp;2" id="&quot;3&quot;"' in scan, '')
+        self.failUnless(scan.endswith(xmllog.SCAN_END), '')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import gzip
+import os
+import tempfile
+import threading
+import time
+import BaseHTTPServer
+import SocketServer
+from cStringIO import StringIO
+
+import Upload
+
+class StandInHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Answers every POST like the openBmap server, over keep-alive connections."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.server.nbConnections += 1
+        self._nbRequests = 0
+
+    def do_POST(self):
+        self.server.lastBody = self.rfile.read(int(self.headers['content-length']))
+        time.sleep(self.server.delay)
+        self.server.nbRequests += 1
+        self._nbRequests += 1
+        answer = 'Stored in V2_208_log.xml'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(answer)))
+        self.end_headers()
+        self.wfile.write(answer)
+        if self.server.maxRequestsPerConnection and self._nbRequests >= self.server.maxRequestsPerConnection:
+            # closes without telling the client, as a server timing out an idle connection
+            self.close_connection = 1
+
+    def log_message(self, format, *args):
+        pass
+
+class StandInServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, maxRequestsPerConnection=0):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', 0), StandInHandler)
+        self.nbConnections = 0
+        self.nbRequests = 0
+        self.lastBody = None
+        # seconds before answering
+        self.delay = 0
+        self.maxRequestsPerConnection = maxRequestsPerConnection
+        thread = threading.Thread(target=self.serve_forever)
+        thread.setDaemon(True)
+        thread.start()
+
+    def get_host(self):
+        return '%s:%i' % self.server_address
+
+FIELDS = [('openBmap_login', 'login'), ('openBmap_passwd', 'passwd')]
+FILES = [('file', 'V2_208_log.xml', '<logfile></logfile>')]
+
+class TestUploadClient(unittest.TestCase):
+
+    def setUp(self):
+        self._server = StandInServer()
+
+    def tearDown(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def test_one_connection_per_post(self):
+        for i in range(10):
+            self.failUnless(Upload.post_url('http://%s/upload' % self._server.get_host(), FIELDS, FILES)[0] == 200, '')
+        self.failUnless(self._server.nbConnections == 10, '')
+
+    def test_keep_alive(self):
+        client = Upload.UploadClient(self._server.get_host())
+        stats = {}
+        for i in range(10):
+            (status, reason, answer) = client.post('/upload', FIELDS, FILES, False, stats)
+            self.failUnless(answer.startswith('Stored in'), '')
+        client.close()
+        self.failUnless(self._server.nbRequests == 10, '')
+        self.failUnless(self._server.nbConnections == 1, 'a single connection for all the requests')
+        self.failUnless(client.get_counters() == {'requests': 10, 'connections': 1, 'reused': 9, 'stale': 0}, '')
+        timings = client.get_timings()
+        self.failUnless(len(timings) == 10 and not timings[0].reused and timings[1].reused, '')
+        self.failIf([t for t in timings if t.total < t.send + t.wait], '')
+        self.failUnless(stats['sent'] == stats['body'] > 0, '')
+
+    def test_stale_connection(self):
+        self.tearDown()
+        self._server = StandInServer(maxRequestsPerConnection=3)
+        client = Upload.UploadClient(self._server.get_host())
+        for i in range(7):
+            self.failUnless(client.post('/upload', FIELDS, FILES)[0] == 200, '')
+        self.failUnless(self._server.nbRequests == 7, 'no request lost nor duplicated')
+        self.failUnless(self._server.nbConnections == 3, '')
+        self.failUnless(client.get_counters()['stale'] == 2, '')
+
+    def test_one_retry_per_request(self):
+        self.tearDown()
+        self._server = StandInServer(maxRequestsPerConnection=1)
+        self._server.delay = 0.2
+        client = Upload.UploadClient(self._server.get_host(), maxIdle=2)
+        # two concurrent posts: two idle connections, both closed by the server
+        threads = [threading.Thread(target=client.post, args=('/upload', FIELDS, FILES)) for i in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.failUnless(self._server.nbConnections == 2, '')
+        self._server.delay = 0
+        self.failUnless(client.post('/upload', FIELDS, FILES)[0] == 200, '')
+        self.failUnless(client.get_counters()['stale'] == 1, 'not retried on the other idle connection')
+        self.failUnless(self._server.nbConnections == 3, '')
+
+class TestMultipartBody(unittest.TestCase):
+
+    def setUp(self):
+        (fd, self._filename) = tempfile.mkstemp()
+        self._content = ''.join(['<scan time="%i"><gsmserving mcc="208" mnc="1"/></scan>\n' % i
+                                 for i in range(3000)])
+        os.write(fd, self._content)
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self._filename)
+
+    def test_same_as_encode_multipart_formdata(self):
+        (contentType, expected) = Upload.encode_multipart_formdata(FIELDS, [('file', 'V2_208_log.xml', self._content)])
+        body = Upload.MultipartBody(FIELDS, [('file', 'V2_208_log.xml', Upload.file_part(self._filename))], 1000)
+        self.failUnless(body.content_type == contentType, '')
+        self.failUnless(body.length == len(expected), 'known before reading')
+        self.failUnless(body.read() == expected, '')
+        self.failUnless(body.read() == '', '')
+        body.rewind()
+        chunks = []
+        while True:
+            chunk = body.read(777)
+            if chunk == '':
+                break
+            self.failUnless(len(chunk) <= 777, '')
+            chunks.append(chunk)
+        self.failUnless(''.join(chunks) == expected, '')
+        self.failUnless(max([len(chunk) for chunk in body.iter_chunks()]) < 2000, 'streamed')
+        body.close()
+
+    def test_literal(self):
+        f = open(self._filename, 'wb')
+        f.write('<a/>')
+        f.close()
+        body = Upload.MultipartBody([('k', 'v')], [('file', 'x.xml', Upload.file_part(self._filename)),
+                                                   ('other', 'y.bin', 'zz')])
+        expected = '\r\n'.join(['------------ThIs_Is_tHe_bouNdaRY_$',
+                                 'Content-Disposition: form-data; name="k"',
+                                 '',
+                                 'v',
+                                 '------------ThIs_Is_tHe_bouNdaRY_$',
+                                 'Content-Disposition: form-data; name="file"; filename="x.xml"',
+                                 'Content-Type: application/xml',
+                                 '',
+                                 '<a/>',
+                                 '------------ThIs_Is_tHe_bouNdaRY_$',
+                                 'Content-Disposition: form-data; name="other"; filename="y.bin"',
+                                 'Content-Type: application/octet-stream',
+                                 '',
+                                 'zz',
+                                 '------------ThIs_Is_tHe_bouNdaRY_$--',
+                                 ''])
+        self.failUnless(body.read() == expected, '')
+        self.failUnless(body.length == len(expected), '')
+
+    def test_truncated_file(self):
+        part = Upload.FilePart(lambda: open(self._filename, 'rb'), len(self._content) + 1)
+        body = Upload.MultipartBody(FIELDS, [('file', 'V2_208_log.xml', part)])
+        self.failUnlessRaises(IOError, body.read)
+
+    def test_encode_request(self):
+        files = [('file', 'V2_208_log.xml', Upload.file_part(self._filename))]
+        stats = {}
+        (headers, body) = Upload.encode_request(FIELDS, files, False, stats)
+        expected = Upload.encode_multipart_formdata(FIELDS, [('file', 'V2_208_log.xml', self._content)])[1]
+        self.failUnless(headers['content-length'] == str(len(expected)), '')
+        self.failUnless(body.read() == expected, '')
+        Upload.close_body(body)
+        (headers, body) = Upload.encode_request(FIELDS, files, True, stats)
+        self.failUnless(isinstance(body, Upload.CompressedBody), 'not compressed in memory')
+        compressed = body.read()
+        self.failUnless(headers['content-length'] == str(len(compressed)), '')
+        self.failUnless(gzip.GzipFile(fileobj=StringIO(compressed)).read() == expected, '')
+        Upload.rewind_body(body)
+        self.failUnless(body.read(100) == compressed[:100], '')
+        Upload.close_body(body)
+        self.failUnless(stats['body'] == 2 * len(expected), '')
+        self.failUnless(stats['sent'] == len(expected) + len(compressed), '')
+
+    def test_post_streamed(self):
+        server = StandInServer(maxRequestsPerConnection=1)
+        client = Upload.UploadClient(server.get_host())
+        files = [('file', 'V2_208_log.xml', Upload.file_part(self._filename))]
+        expected = Upload.encode_multipart_formdata(FIELDS, [('file', 'V2_208_log.xml', self._content)])[1]
+        for i in range(2):
+            # the second request is sent again after the stale connection
+            self.failUnless(client.post('/upload', FIELDS, files)[0] == 200, '')
+            self.failUnless(server.lastBody == expected, '')
+        self.failUnless(client.get_counters()['stale'] == 1, '')
+        server.shutdown()
+        server.server_close()
+
+    def test_post_compressed(self):
+        server = StandInServer(maxRequestsPerConnection=1)
+        client = Upload.UploadClient(server.get_host())
+        files = [('file', 'V2_208_log.xml', Upload.file_part(self._filename))]
+        expected = Upload.encode_multipart_formdata(FIELDS, [('file', 'V2_208_log.xml', self._content)])[1]
+        for i in range(2):
+            # the second request sends the compressed body again after the stale connection
+            self.failUnless(client.post('/upload', FIELDS, files, True)[0] == 200, '')
+            self.failUnless(gzip.GzipFile(fileobj=StringIO(server.lastBody)).read() == expected, '')
+        self.failUnless(client.get_counters()['stale'] == 1, '')
+        server.shutdown()
+        server.server_close()
+
+class TestUpload(unittest.TestCase):
+
+    def test_gzip_data(self):
+        data = '<scan time="20100605143059"><gsmserving mcc="208" mnc="1"/></scan>\n' * 50
+        compressed = Upload.gzip_data(data)
+        self.failUnless(len(compressed) < len(data) / 10, '')
+        self.failUnless(gzip.GzipFile(fileobj=StringIO(compressed)).read() == data, '')
+
+if __name__ == '__main__':
+    unittest.main()
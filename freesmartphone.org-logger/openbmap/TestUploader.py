@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+import os
+import shutil
+import tempfile
+import gzip
+import threading
+import time
+
+import socket
+
+import container
+import hashindex
+import manifest
+import uploader
+import Upload
+
+class ConcurrentPost:
+    """Fake upload: records the contents posted and the maximum number of concurrent posts."""
+
+    def __init__(self, delay=0.02, failing=()):
+        self.delay = delay
+        self.failing = failing
+        self.posted = {}
+        self.running = 0
+        self.maxRunning = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, name, content):
+        self._lock.acquire()
+        self.running += 1
+        self.maxRunning = max(self.maxRunning, self.running)
+        self._lock.release()
+        time.sleep(self.delay)
+        if isinstance(content, Upload.FilePart):
+            file = content.open()
+            content = file.read(content.size)
+            file.close()
+        self._lock.acquire()
+        self.running -= 1
+        self.posted[name] = content
+        self._lock.release()
+        if name in self.failing:
+            return None
+        return 'stored'
+
+
+class TestParallelUploader(unittest.TestCase):
+
+    def setUp(self):
+        self._dir = tempfile.mkdtemp()
+        self._logDir = os.path.join(self._dir, 'Logs')
+        self._processedDir = os.path.join(self._dir, 'Processed_logs')
+        os.mkdir(self._logDir)
+        os.mkdir(self._processedDir)
+
+    def tearDown(self):
+        shutil.rmtree(self._dir)
+
+    def make_file_jobs(self, nbFiles):
+        jobs = []
+        for i in range(nbFiles):
+            filename = os.path.join(self._logDir, 'V2_208_log%i.xml' % i)
+            f = open(filename, 'w')
+            f.write('<logfile>%i</logfile>' % i)
+            f.close()
+            jobs.append(uploader.FileJob(filename, self._processedDir))
+        return jobs
+
+    def test_parallel(self):
+        post = ConcurrentPost()
+        engine = uploader.ParallelUploader(post, 4)
+        engine.start(self.make_file_jobs(20))
+        self.failUnless(engine.wait(), '')
+        self.failUnless(post.maxRunning == 4, '')
+        self.failUnless(len(post.posted) == 20, '')
+        self.failUnless(post.posted['V2_208_log7.xml'] == '<logfile>7</logfile>', '')
+        results = engine.get_results()
+        self.failUnless(sorted([r.name for r in results]) == sorted(post.posted.keys()), 'one result per file')
+        self.failIf([r for r in results if r.answer != 'stored' or r.error != None or r.duration < post.delay], '')
+        self.failUnless(os.listdir(self._logDir) == [], '')
+        self.failUnless(len(os.listdir(self._processedDir)) == 20, '')
+
+    def test_failures(self):
+        jobs = self.make_file_jobs(6)
+        os.remove(os.path.join(self._logDir, 'V2_208_log5.xml'))
+        engine = uploader.ParallelUploader(ConcurrentPost(0, ['V2_208_log2.xml']), 2)
+        engine.start(jobs)
+        self.failUnless(engine.wait(), '')
+        results = dict([(r.name, r) for r in engine.get_results()])
+        self.failUnless(len(results) == 6, '')
+        self.failUnless(results['V2_208_log2.xml'].answer == None, '')
+        self.failUnless(results['V2_208_log2.xml'].error == None, '')
+        self.failUnless(results['V2_208_log5.xml'].answer == None, '')
+        self.failIf(results['V2_208_log5.xml'].error == None, 'missing file')
+        self.failUnless(os.listdir(self._logDir) == ['V2_208_log2.xml'], 'kept for the next upload')
+        self.failUnless(len(os.listdir(self._processedDir)) == 4, '')
+
+    def test_container_slices(self):
+        logContainer = container.LogContainer(os.path.join(self._dir, 'V2_208' + container.EXTENSION))
+        for job in self.make_file_jobs(10):
+            logContainer.append(job.name, os.path.join(self._logDir, job.name))
+        post = ConcurrentPost(0.01)
+        engine = uploader.ParallelUploader(post, 3)
+        engine.start([uploader.SliceJob(logContainer, entry, self._processedDir)
+                      for entry in logContainer.get_pending()])
+        self.failUnless(engine.wait(), '')
+        self.failUnless(len(post.posted) == 10, '')
+        self.failUnless(post.posted['V2_208_log3.xml'] == '<logfile>3</logfile>', 'read in chunks')
+        self.failUnless(len(os.listdir(self._processedDir)) == 10, '')
+        self.failIf(logContainer.exists(), 'all the slices are done')
+
+    def test_compressed_slices(self):
+        logContainer = container.LogContainer(os.path.join(self._dir, 'V2_208' + container.EXTENSION))
+        xml = '<logfile>' + 'scan ' * 10000 + '</logfile>'
+        filename = os.path.join(self._logDir, 'V2_208_log1.xml.gz')
+        out = gzip.open(filename, 'wb')
+        out.write(xml)
+        out.close()
+        logContainer.append('V2_208_log0.xml', os.path.join(self._logDir, self.make_file_jobs(1)[0].name))
+        logContainer.append('V2_208_log1.xml.gz', filename)
+        entry = logContainer.get_pending()[1]
+        content = uploader.SliceJob(logContainer, entry, self._processedDir).load()
+        self.failUnless(isinstance(content, Upload.FilePart), 'streamed')
+        self.failUnless(content.size == len(xml), '')
+        post = ConcurrentPost(0)
+        engine = uploader.ParallelUploader(post, 1)
+        engine.start([uploader.SliceJob(logContainer, entry, self._processedDir)
+                      for entry in logContainer.get_pending()])
+        self.failUnless(engine.wait(), '')
+        self.failUnless(post.posted['V2_208_log1.xml.gz'] == xml, '')
+        self.failUnless(post.posted['V2_208_log0.xml'] == '<logfile>0</logfile>', '')
+
+    def test_manifest(self):
+        uploadManifest = manifest.UploadManifest(os.path.join(self._dir, 'Uploads.manifest'), 1, 10)
+        uploadManifest.load()
+        jobs = self.make_file_jobs(4)
+        for job in jobs:
+            job.key = manifest.make_key('FSO_GSM', job.name)
+        uploadManifest.sync([job.key for job in jobs])
+        def post(name, content):
+            if name == 'V2_208_log1.xml':
+                raise socket.error('Connection refused')
+            if name == 'V2_208_log2.xml':
+                return None
+            return 'stored'
+        quarantineDir = os.path.join(self._dir, 'Quarantine')
+        engine = uploader.ParallelUploader(post, 2, uploadManifest, quarantineDir)
+        engine.start(jobs)
+        self.failUnless(engine.wait(), '')
+        self.failUnless(uploadManifest.get('FSO_GSM/V2_208_log0.xml').state == manifest.DONE, '')
+        entry = uploadManifest.get('FSO_GSM/V2_208_log1.xml')
+        self.failUnless(entry.state == manifest.PENDING, 'transient')
+        self.failUnless(entry.lastError == 'Connection refused', '')
+        self.failIf(uploadManifest.is_due(entry.key), 'retried later')
+        self.failUnless(uploadManifest.get('FSO_GSM/V2_208_log2.xml').state == manifest.REJECTED, '')
+        self.failUnless(os.listdir(os.path.join(quarantineDir, 'FSO_GSM')) == ['V2_208_log2.xml'], '')
+        self.failUnless(os.listdir(self._logDir) == ['V2_208_log1.xml'], '')
+        uploadManifest.close()
+
+    def test_session_error(self):
+        uploadManifest = manifest.UploadManifest(os.path.join(self._dir, 'Uploads.manifest'), 1, 10)
+        uploadManifest.load()
+        jobs = self.make_file_jobs(4)
+        for job in jobs:
+            job.key = manifest.make_key('FSO_GSM', job.name)
+        uploadManifest.sync([job.key for job in jobs])
+        def post(name, content):
+            if name == 'V2_208_log1.xml':
+                raise uploader.SessionError('Unexpected answer 401/Unauthorized')
+            return 'stored'
+        quarantineDir = os.path.join(self._dir, 'Quarantine')
+        engine = uploader.ParallelUploader(post, 1, uploadManifest, quarantineDir)
+        engine.start(jobs)
+        self.failUnless(engine.wait(), '')
+        self.failUnless([r.name for r in engine.get_results()] == ['V2_208_log0.xml', 'V2_208_log1.xml'],
+                        'the jobs not started yet are cancelled')
+        entry = uploadManifest.get('FSO_GSM/V2_208_log1.xml')
+        self.failUnless(entry.state == manifest.PENDING, 'transient, even after the maximum attempts')
+        self.failUnless(uploadManifest.get('FSO_GSM/V2_208_log2.xml').attempts == 0, '')
+        self.failIf(os.path.exists(quarantineDir), '')
+        self.failUnless(sorted(os.listdir(self._logDir)) == ['V2_208_log1.xml', 'V2_208_log2.xml', 'V2_208_log3.xml'], '')
+        uploadManifest.close()
+
+    def test_skip_uploaded_content(self):
+        index = hashindex.HashIndex(os.path.join(self._dir, 'Uploaded.hashes'))
+        index.add(hashindex.digest_string('<logfile>1</logfile>'))
+        jobs = self.make_file_jobs(3)
+        # byte-identical to the first one
+        shutil.copy(os.path.join(self._logDir, 'V2_208_log0.xml'), os.path.join(self._logDir, 'V2_208_log9.xml'))
+        jobs.append(uploader.FileJob(os.path.join(self._logDir, 'V2_208_log9.xml'), self._processedDir))
+        post = ConcurrentPost(0)
+        engine = uploader.ParallelUploader(post, 1, hashIndex=index)
+        engine.start(jobs)
+        self.failUnless(engine.wait(), '')
+        self.failUnless(sorted(post.posted.keys()) == ['V2_208_log0.xml', 'V2_208_log2.xml'], '')
+        answers = dict([(r.name, r.answer) for r in engine.get_results()])
+        self.failUnless(answers['V2_208_log1.xml'] == uploader.SKIPPED, '')
+        self.failUnless(answers['V2_208_log9.xml'] == uploader.SKIPPED, '')
+        self.failUnless(len(os.listdir(self._processedDir)) == 4, '')
+        self.failUnless(index.count() == 3, '')
+        self.failUnless(uploader.content_digest(Upload.file_part(os.path.join(self._processedDir, 'V2_208_log2.xml')))
+                        == hashindex.digest_string('<logfile>2</logfile>'), '')
+        index.close()
+
+    def test_wait_timeout(self):
+        engine = uploader.ParallelUploader(ConcurrentPost(0.2), 1)
+        engine.start(self.make_file_jobs(2))
+        self.failIf(engine.wait(0.05), '')
+        engine.cancel()
+        self.failUnless(engine.wait(), '')
+        self.failUnless(len(engine.get_results()) == 1, 'the second job was cancelled')
+        self.failUnless(engine.wait(0), 'no job')
+
+if __name__ == '__main__':
+    unittest.main()
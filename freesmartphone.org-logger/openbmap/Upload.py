@@ -9,24 +9,331 @@
 # chris hoke (http://code.activestate.com/recipes/users/2022253/)
 
 import httplib, mimetypes
+import os
 import urlparse
+import zlib
+import collections
+import logging
+import socket
+import tempfile
+import threading
+import time
 
+# stats may be shared by concurrent uploads
+_statsLock = threading.Lock()
 
-def post_multipart(host, selector, fields, files):
-    content_type, body = encode_multipart_formdata(fields, files)
+def post_multipart(host, selector, fields, files, compress=False, stats=None):
+    """Posts fields and files as multipart/form-data. Returns (status, reason, response body).
+
+    If compress is True, the request body is gzip compressed (Content-Encoding: gzip).
+    If stats is a dictionary, the size of the body is added to stats['body'], and the
+    number of bytes actually sent to stats['sent'].
+    """
+    headers, body = encode_request(fields, files, compress, stats)
     h = httplib.HTTPConnection(host)
+    try:
+        h.request('POST', selector, body, headers)
+    finally:
+        close_body(body)
+    res = h.getresponse()
+    return res.status, res.reason, res.read()
+
+def post_url(url, fields, files, compress=False, stats=None):
+    urlparts = urlparse.urlsplit(url)
+    return post_multipart(urlparts[1], urlparts[2], fields, files, compress, stats)
+
+def encode_request(fields, files, compress=False, stats=None):
+    """Returns (headers, body) of the multipart/form-data POST of fields and files, see post_multipart().
+
+    The file values may be FilePart: the body is then a MultipartBody, or a CompressedBody if
+    compressed, read by httplib as a file.
+    """
+    if [value for (key, filename, value) in files if isinstance(value, FilePart)]:
+        body = MultipartBody(fields, files)
+        content_type = body.content_type
+        bodySize = body.length
+        if compress:
+            body = CompressedBody(body.iter_chunks())
+    else:
+        content_type, body = encode_multipart_formdata(fields, files)
+        bodySize = len(body)
+        if compress:
+            body = gzip_data(body)
     headers = {
         'User-Agent': 'OBM_FSO_logger',
         'Content-Type': content_type,
-        'content-length': str(len(body))
         }
-    h.request('POST', selector, body, headers)
-    res = h.getresponse()
-    return res.status, res.reason, res.read()
+    if compress:
+        headers['Content-Encoding'] = 'gzip'
+    headers['content-length'] = str(get_body_length(body))
+    if stats != None:
+        _statsLock.acquire()
+        try:
+            stats['body'] = stats.get('body', 0) + bodySize
+            stats['sent'] = stats.get('sent', 0) + get_body_length(body)
+        finally:
+            _statsLock.release()
+    return headers, body
 
-def post_url(url, fields, files):
-    urlparts = urlparse.urlsplit(url)
-    return post_multipart(urlparts[1], urlparts[2], fields, files)
+def get_body_length(body):
+    """Returns the length of a request body returned by encode_request()."""
+    if isinstance(body, (MultipartBody, CompressedBody)):
+        return body.length
+    return len(body)
+
+def rewind_body(body):
+    """The next read of a request body returned by encode_request() starts again from its beginning."""
+    if isinstance(body, (MultipartBody, CompressedBody)):
+        body.rewind()
+
+def close_body(body):
+    """Closes the file read by a request body returned by encode_request(), if any."""
+    if isinstance(body, (MultipartBody, CompressedBody)):
+        body.close()
+
+class FilePart:
+    """The content of a file part read in chunks: open() returns a file object positioned at
+    its start, size is its length (only size bytes are read)."""
+
+    def __init__(self, open, size):
+        self.open = open
+        self.size = size
+
+def file_part(filename):
+    """Returns the FilePart of the whole file named filename."""
+    return FilePart(lambda: open(filename, 'rb'), os.path.getsize(filename))
+
+class MultipartBody:
+    """The body encode_multipart_formdata() would return, read in chunks.
+
+    The file values may be strings or FilePart. Its length is known before reading, from the
+    size of the file parts. It is a file-like object for httplib, see read().
+    """
+
+    def __init__(self, fields, files, chunkSize=65536):
+        (self.content_type, items) = _multipart_items(fields, files)
+        # strings and FilePart, as concatenated by encode_multipart_formdata()
+        self._pieces = []
+        for item in items:
+            if len(self._pieces) > 0:
+                self._append(_CRLF)
+            self._append(item)
+        self.length = sum([piece.size if isinstance(piece, FilePart) else len(piece) for piece in self._pieces])
+        self._chunkSize = chunkSize
+        self._chunks = None
+
+    def _append(self, item):
+        if not isinstance(item, FilePart) and len(self._pieces) > 0 and not isinstance(self._pieces[-1], FilePart):
+            self._pieces[-1] += item
+        else:
+            self._pieces.append(item)
+
+    def iter_chunks(self):
+        """Yields the body, in chunks of at most chunkSize bytes for the file parts."""
+        for piece in self._pieces:
+            if not isinstance(piece, FilePart):
+                yield piece
+                continue
+            file = piece.open()
+            try:
+                remaining = piece.size
+                while remaining > 0:
+                    chunk = file.read(min(self._chunkSize, remaining))
+                    if chunk == '':
+                        raise IOError, 'File part truncated: %i bytes missing.' % remaining
+                    remaining -= len(chunk)
+                    yield chunk
+            finally:
+                file.close()
+
+    def read(self, size=-1):
+        """Returns the next bytes of the body: at most size, all the remaining ones if size < 0."""
+        if self._chunks == None:
+            self._chunks = self.iter_chunks()
+            self._buffer = ''
+        while size < 0 or len(self._buffer) < size:
+            try:
+                self._buffer += self._chunks.next()
+            except StopIteration:
+                break
+        if size < 0:
+            size = len(self._buffer)
+        data = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return data
+
+    def rewind(self):
+        """The next read() starts again from the beginning of the body."""
+        self.close()
+
+    def close(self):
+        """Closes the file being read, if any."""
+        if self._chunks != None:
+            self._chunks.close()
+            self._chunks = None
+
+class CompressedBody:
+    """A request body compressed in the gzip format chunk by chunk, into a temporary file (see
+    the tempfile module for its directory), thus its length is known before sending it.
+
+    chunks is an iterable of strings. It is a file-like object for httplib, like MultipartBody.
+    """
+
+    def __init__(self, chunks):
+        self._file = tempfile.TemporaryFile()
+        try:
+            compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+            for chunk in chunks:
+                self._file.write(compressor.compress(chunk))
+            self._file.write(compressor.flush())
+            self.length = self._file.tell()
+            self._file.seek(0)
+        except:
+            self._file.close()
+            raise
+
+    def read(self, size=-1):
+        """Returns the next bytes of the body: at most size, all the remaining ones if size < 0."""
+        return self._file.read(size)
+
+    def rewind(self):
+        """The next read() starts again from the beginning of the body."""
+        self._file.seek(0)
+
+    def close(self):
+        """Deletes the temporary file."""
+        self._file.close()
+
+# Timing of a request of UploadClient, in sec.: until the request is sent (connection included),
+# then until the response headers are received, then total. reused is True if the connection was.
+RequestTiming = collections.namedtuple('RequestTiming', 'reused send wait total')
+
+class UploadClient:
+    """Posts multipart/form-data to one host, over persistent (keep-alive) HTTP/1.1 connections.
+
+    Up to maxIdle connections are kept open between the requests. A request which fails on a
+    reused connection (probably closed by the server meanwhile) is sent again once, on a new
+    connection. Thread safe: each request uses its own connection.
+    """
+
+    def __init__(self, host, maxIdle=2, timeout=60, maxTimings=100):
+        self._host = host
+        self._maxIdle = maxIdle
+        self._timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+        self._counters = {'requests': 0,
+                          'connections': 0,
+                          'reused': 0,
+                          'stale': 0}
+        # timings of the last requests
+        self._timings = collections.deque([], maxTimings)
+
+    def get_host(self):
+        return self._host
+
+    def _get_connection(self, new=False):
+        """Returns (connection, True if reused). If new is True, a new connection is opened."""
+        self._lock.acquire()
+        try:
+            if not new and len(self._idle) > 0:
+                self._counters['reused'] += 1
+                return (self._idle.pop(), True)
+            self._counters['connections'] += 1
+        finally:
+            self._lock.release()
+        return (httplib.HTTPConnection(self._host, timeout=self._timeout), False)
+
+    def _release(self, connection, response):
+        """Keeps the connection for the next requests, unless the server closes it."""
+        if response.will_close:
+            connection.close()
+            return
+        self._lock.acquire()
+        try:
+            if len(self._idle) < self._maxIdle:
+                self._idle.append(connection)
+                return
+        finally:
+            self._lock.release()
+        connection.close()
+
+    def post(self, selector, fields, files, compress=False, stats=None):
+        """Posts fields and files, see post_multipart(). Returns (status, reason, response body)."""
+        headers, body = encode_request(fields, files, compress, stats)
+        try:
+            retried = False
+            while True:
+                # the retry does not take another idle connection, which may be stale as well
+                (connection, reused) = self._get_connection(retried)
+                start = time.time()
+                try:
+                    try:
+                        connection.request('POST', selector, body, headers)
+                    finally:
+                        # a retry reads a streamed body again
+                        rewind_body(body)
+                    sent = time.time()
+                    res = connection.getresponse()
+                    received = time.time()
+                    data = res.read()
+                except (httplib.HTTPException, socket.error):
+                    connection.close()
+                    if not reused or retried:
+                        raise
+                    # closed by the server while idle, retried once on a new connection
+                    self._lock.acquire()
+                    self._counters['stale'] += 1
+                    self._lock.release()
+                    retried = True
+                    continue
+                timing = RequestTiming(reused, sent - start, received - sent, time.time() - start)
+                logging.debug('POST %s on %s: %s' % (selector, self._host, timing))
+                self._lock.acquire()
+                self._counters['requests'] += 1
+                self._timings.append(timing)
+                self._lock.release()
+                self._release(connection, res)
+                return res.status, res.reason, data
+        finally:
+            close_body(body)
+
+    def post_url(self, url, fields, files, compress=False, stats=None):
+        """Posts to url, which must be on the host of this client."""
+        return self.post(urlparse.urlsplit(url)[2], fields, files, compress, stats)
+
+    def get_counters(self):
+        """Returns a copy of the counters: requests done, connections opened, connections reused, stale ones."""
+        self._lock.acquire()
+        try:
+            return dict(self._counters)
+        finally:
+            self._lock.release()
+
+    def get_timings(self):
+        """Returns the timings (RequestTiming) of the last requests, the oldest first."""
+        self._lock.acquire()
+        try:
+            return list(self._timings)
+        finally:
+            self._lock.release()
+
+    def close(self):
+        """Closes the idle connections."""
+        self._lock.acquire()
+        try:
+            idle = self._idle
+            self._idle = []
+        finally:
+            self._lock.release()
+        for connection in idle:
+            connection.close()
+
+def gzip_data(data):
+    """Returns data compressed in the gzip format."""
+    # 16 + MAX_WBITS: gzip header and trailer instead of zlib ones
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush()
 
 
 def post_multipart_original(host, selector, fields, files):
@@ -52,8 +359,16 @@ def encode_multipart_formdata(fields, files):
     files is a sequence of (name, filename, value) elements for data to be uploaded as files
     Return (content_type, body) ready for httplib.HTTP instance
     """
-    BOUNDARY = '----------ThIs_Is_tHe_bouNdaRY_$'
-    CRLF = '\r\n'
+    content_type, L = _multipart_items(fields, files)
+    body = _CRLF.join(L)
+    return content_type, body
+
+_BOUNDARY = '----------ThIs_Is_tHe_bouNdaRY_$'
+_CRLF = '\r\n'
+
+def _multipart_items(fields, files):
+    """Returns (content_type, items) where the body is the items joined by CRLF."""
+    BOUNDARY = _BOUNDARY
     L = []
     for (key, value) in fields:
         L.append('--' + BOUNDARY)
@@ -68,9 +383,8 @@ def encode_multipart_formdata(fields, files):
         L.append(value)
     L.append('--' + BOUNDARY + '--')
     L.append('')
-    body = CRLF.join(L)
     content_type = 'multipart/form-data; boundary=%s' % BOUNDARY
-    return content_type, body
+    return content_type, L
 
 def get_content_type(filename):
     return mimetypes.guess_type(filename)[0] or 'application/octet-stream'
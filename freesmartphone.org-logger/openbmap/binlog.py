@@ -0,0 +1,293 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Compact binary storage of the scan records, converted to XML (V2) when uploaded.
+
+A binary log file is:
+ * MAGIC,
+ * the XML header and tail of the log file, each as a varint length followed by the bytes,
+ * the scan records, each as a varint length followed by the encoded record.
+
+Integers are stored as (zigzag encoded) varints. The scan date, the GPS time stamp, and
+the lac and cid of the cells are stored as the difference with the previous one in the file
+(for the neighbour cells: with the previous cell of the scan, the serving cell for the first).
+Textual fields which are decimal numbers are stored as numbers, the others as bytes. The GPS
+floating point values are stored as doubles, thus the XML produced is exactly the one which
+would have been logged directly.
+"""
+
+import struct
+from cStringIO import StringIO
+
+import serializer
+import xmllog
+
+MAGIC = 'OBMB\x01'
+EXTENSION = '.obmb'
+# lng, lat, alt, heading, speed, hdop, vdop, pdop
+_GPS = struct.Struct('<8d')
+
+def _zigzag(n):
+    if n >= 0:
+        return n << 1
+    return ((-n) << 1) - 1
+
+def _unzigzag(n):
+    if n & 1:
+        return -((n + 1) >> 1)
+    return n >> 1
+
+def _put_varint(out, n):
+    """Appends the unsigned integer n to the out list, 7 bits per byte."""
+    while n > 0x7f:
+        out.append(chr((n & 0x7f) | 0x80))
+        n >>= 7
+    out.append(chr(n))
+
+def _get_varint(data, pos):
+    """Returns (unsigned integer, position after it) read in data at pos."""
+    result = 0
+    shift = 0
+    while True:
+        byte = ord(data[pos])
+        pos += 1
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return (result, pos)
+        shift += 7
+
+def _put_int(out, n):
+    _put_varint(out, _zigzag(int(n)))
+
+def _get_int(data, pos):
+    (n, pos) = _get_varint(data, pos)
+    return (_unzigzag(n), pos)
+
+def _is_number(text):
+    """Returns True if text is exactly the decimal representation of a non negative integer."""
+    return text.isdigit() and (text == '0' or text[0] != '0')
+
+def _put_text(out, value, ref=0):
+    """Appends str(value), as the difference with ref if it is a number. Returns the new reference."""
+    text = str(value)
+    if _is_number(text):
+        n = int(text)
+        _put_varint(out, _zigzag(n - ref) << 1)
+        return n
+    _put_varint(out, (len(text) << 1) | 1)
+    out.append(text)
+    return ref
+
+def _get_text(data, pos, ref=0):
+    """Returns (text, new reference, position after it) read in data at pos."""
+    (n, pos) = _get_varint(data, pos)
+    if n & 1:
+        length = n >> 1
+        return (data[pos : pos + length], ref, pos + length)
+    value = ref + _unzigzag(n >> 1)
+    return (str(value), value, pos)
+
+
+class BinaryEncoder:
+    """Encodes the scan records of one file. Keeps the references of the delta encoding."""
+
+    def __init__(self):
+        self._date = 0
+        self._tstamp = 0
+        self._lac = 0
+        self._cid = 0
+
+    def encode(self, record):
+        """Returns the encoded record (without its length)."""
+        out = []
+        servingCell = record.servingCell
+        self._date = _put_text(out, record.date, self._date)
+        # only the second matters, see serializer.format_gps_data()
+        tstamp = int(record.tstamp)
+        _put_int(out, tstamp - self._tstamp)
+        self._tstamp = tstamp
+        _put_text(out, servingCell[0])
+        _put_text(out, servingCell[1])
+        self._lac = _put_text(out, servingCell[2], self._lac)
+        self._cid = _put_text(out, servingCell[3], self._cid)
+        _put_int(out, servingCell[4])
+        for value in servingCell[5:8]:
+            _put_text(out, value)
+        out.append(_GPS.pack(record.lng, record.lat, record.alt, record.heading,
+                             record.spe, record.hdop, record.vdop, record.pdop))
+        _put_varint(out, len(record.neighbourCells))
+        (lac, cid) = (self._lac, self._cid)
+        for cell in record.neighbourCells:
+            lac = _put_text(out, cell['lac'], lac)
+            cid = _put_text(out, cell['cid'], cid)
+            for field in ('rxlev', 'c1', 'c2'):
+                _put_int(out, cell[field])
+        return ''.join(out)
+
+
+class BinaryDecoder:
+    """Decodes the scan records of one file, see BinaryEncoder."""
+
+    def __init__(self):
+        self._date = 0
+        self._tstamp = 0
+        self._lac = 0
+        self._cid = 0
+
+    def decode(self, data):
+        """Returns the xmllog.ScanRecord encoded in data."""
+        (date, self._date, pos) = _get_text(data, 0, self._date)
+        (delta, pos) = _get_int(data, pos)
+        self._tstamp += delta
+        (mcc, ref, pos) = _get_text(data, pos)
+        (mnc, ref, pos) = _get_text(data, pos)
+        (lac, self._lac, pos) = _get_text(data, pos, self._lac)
+        (cid, self._cid, pos) = _get_text(data, pos, self._cid)
+        (ss, pos) = _get_int(data, pos)
+        (act, ref, pos) = _get_text(data, pos)
+        (tav, ref, pos) = _get_text(data, pos)
+        (rxlev, ref, pos) = _get_text(data, pos)
+        gps = _GPS.unpack_from(data, pos)
+        pos += _GPS.size
+        (nbNeighbours, pos) = _get_varint(data, pos)
+        neighbourCells = []
+        (lacRef, cidRef) = (self._lac, self._cid)
+        for i in xrange(nbNeighbours):
+            cell = {}
+            (cell['lac'], lacRef, pos) = _get_text(data, pos, lacRef)
+            (cell['cid'], cidRef, pos) = _get_text(data, pos, cidRef)
+            for field in ('rxlev', 'c1', 'c2'):
+                (cell[field], pos) = _get_int(data, pos)
+            neighbourCells.append(cell)
+        (lng, lat, alt, heading, spe, hdop, vdop, pdop) = gps
+        return xmllog.ScanRecord(date, self._tstamp, (mcc, mnc, lac, cid, ss, act, tav, rxlev),
+                                 lng, lat, alt, spe, heading, hdop, vdop, pdop, tuple(neighbourCells))
+
+
+def _read_varint(file):
+    """Returns the unsigned integer read in file, None at the end of the file or if it is truncated."""
+    result = 0
+    shift = 0
+    while True:
+        byte = file.read(1)
+        if byte == '':
+            return None
+        byte = ord(byte)
+        result |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            return result
+        shift += 7
+
+def _read_chunk(file):
+    """Returns the next length prefixed chunk of file, None at the end of the file or if it is truncated."""
+    length = _read_varint(file)
+    if length == None:
+        return None
+    data = file.read(length)
+    if len(data) != length:
+        return None
+    return data
+
+def read_header(file):
+    """Reads the beginning of the binary log file. Returns (XML header, XML tail).
+
+    Raises ValueError if this is not a binary log file."""
+    if file.read(len(MAGIC)) != MAGIC:
+        raise ValueError, 'Not a binary log file (wrong magic).'
+    header = _read_chunk(file)
+    tail = _read_chunk(file)
+    if header == None or tail == None:
+        raise ValueError, 'Truncated binary log file header.'
+    return (header, tail)
+
+def iter_records(file):
+    """Yields the scan records of the binary log file, read from its current position (after the header).
+
+    A truncated record at the end of the file is ignored.
+    """
+    decoder = BinaryDecoder()
+    while True:
+        data = _read_chunk(file)
+        if data == None:
+            return
+        yield decoder.decode(data)
+
+def convert(file, out):
+    """Streams the binary log file (a file object) to out (a file object), as an XML log file.
+
+    Returns the number of scans converted.
+    """
+    (header, tail) = read_header(file)
+    out.write(header)
+    nbScans = 0
+    for record in iter_records(file):
+        out.write(serializer.serialize_scan(record))
+        nbScans += 1
+    out.write(tail)
+    return nbScans
+
+def convert_to_string(file):
+    """Returns the content of the binary log file (a file object) converted to XML."""
+    out = StringIO()
+    convert(file, out)
+    return out.getvalue()
+
+def convert_file(filename):
+    """Returns the content of the binary log file converted to XML."""
+    file = open(filename, 'rb')
+    try:
+        return convert_to_string(file)
+    finally:
+        file.close()
+
+
+class BinaryFormat:
+    """Binary log files format, for logwriter.LogWriter. One instance per file."""
+
+    EXTENSION = EXTENSION
+
+    def __init__(self):
+        self._encoder = BinaryEncoder()
+
+    def begin(self, header, tail):
+        """Returns the data starting a file with given XML header and tail."""
+        out = [MAGIC]
+        for text in (header, tail):
+            _put_varint(out, len(text))
+            out.append(text)
+        return ''.join(out)
+
+    def encode(self, record):
+        """Returns (data, length of the scan in XML)."""
+        data = self._encoder.encode(record)
+        out = []
+        _put_varint(out, len(data))
+        out.append(data)
+        return (''.join(out), serializer.scan_length(record))
+
+    def end(self, tail):
+        """Returns the data ending a file. The tail is already in the header."""
+        return ''
+
+    def complete_length(self, content):
+        """Returns the length of content up to its last complete scan record, -1 if there is none."""
+        file = StringIO(content)
+        try:
+            read_header(file)
+        except ValueError:
+            return -1
+        end = -1
+        while True:
+            data = _read_chunk(file)
+            if data == None:
+                return end
+            end = file.tell()
@@ -0,0 +1,233 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Registry of the GSM cells seen, with O(1) membership tests.
+
+Every cell is identified by a single packed integer built from
+(mcc, mnc, lac, cid, type), see pack_cell(). All the sessions (one per
+start/stop of the logger, plus the 'total' one) share the same store:
+for every packed cell we keep a bit mask of the sessions which have seen it.
+
+The MNC is kept as a number: the 2 digits MNC '01' and the 3 digits MNC '001'
+of the same MCC are the same network here. The numbering plan does not assign
+both in one country, and the modem always gives the MNC of a network with the
+same number of digits.
+
+SeenCellsIndex is the persistent counterpart: a file of every cell ever seen.
+"""
+
+import logging
+import struct
+
+import recordindex
+
+SERVING = 0
+NEIGHBOUR = 1
+TYPES = (SERVING, NEIGHBOUR)
+
+# bit widths of the packed fields (from least to most significant)
+_TYPE_BITS = 1
+_CID_BITS = 28
+_LAC_BITS = 16
+_MNC_BITS = 10
+_MCC_BITS = 10
+
+_CID_SHIFT = _TYPE_BITS
+_LAC_SHIFT = _CID_SHIFT + _CID_BITS
+_MNC_SHIFT = _LAC_SHIFT + _LAC_BITS
+_MCC_SHIFT = _MNC_SHIFT + _MNC_BITS
+
+
+def _mask(bits):
+    return (1 << bits) - 1
+
+
+def pack_cell(mcc, mnc, lac, cid, type):
+    """Returns the packed integer key for the given cell.
+
+    mcc, mnc, lac and cid may be strings of decimal digits (as stored by Gsm) or integers.
+    The number of digits of mnc is not kept, see the module documentation.
+    type: SERVING or NEIGHBOUR.
+    Raises ValueError if a field does not fit.
+    """
+    if not type in TYPES:
+        raise ValueError, 'pack_cell() wrong type value (%s).' % type
+    fields = ((int(mcc), _MCC_BITS), (int(mnc), _MNC_BITS),
+              (int(lac), _LAC_BITS), (int(cid), _CID_BITS))
+    key = 0
+    for value, bits in fields:
+        if value < 0 or value > _mask(bits):
+            raise ValueError, 'pack_cell() value %s does not fit in %i bits.' % (value, bits)
+        key = (key << bits) | value
+    return (key << _TYPE_BITS) | type
+
+
+def unpack_cell(key):
+    """Returns the (mcc, mnc, lac, cid, type) integers tuple packed in key."""
+    return ((key >> _MCC_SHIFT) & _mask(_MCC_BITS),
+            (key >> _MNC_SHIFT) & _mask(_MNC_BITS),
+            (key >> _LAC_SHIFT) & _mask(_LAC_BITS),
+            (key >> _CID_SHIFT) & _mask(_CID_BITS),
+            key & _mask(_TYPE_BITS))
+
+
+class CellRegistry:
+    """Remembers the cells seen, for several sessions at once.
+
+    This class is not thread safe, the caller is in charge of locking (see Gsm.lock).
+    """
+
+    def __init__(self, totalId):
+        # packed cell -> bit mask of the sessions which have seen it
+        self._cells = {}
+        # session id -> session bit
+        self._sessions = {}
+        # (session bit, type) -> number of cells
+        self._counts = {}
+        # (session bit, type, mcc, mnc) -> number of cells
+        self._mncCounts = {}
+        # (session bit, type, mcc, mnc, lac) -> set of the cell ids
+        self._lacCells = {}
+        self._totalId = totalId
+        self._totalBit = self.add_session(totalId)
+        self._currentId = totalId
+
+    def add_session(self, id):
+        """Creates a new session with given id. Returns its bit.
+
+        Raises ValueError if id already exists."""
+        if id in self._sessions:
+            raise ValueError, 'add_session(): id (%s) already exists.' % id
+        bit = 1 << len(self._sessions)
+        self._sessions[id] = bit
+        for type in TYPES:
+            self._counts[(bit, type)] = 0
+        logging.info('id:%s added to remember cells registry.' % id)
+        return bit
+
+    def has_session(self, id):
+        return id in self._sessions
+
+    def set_current_session(self, id):
+        """Sets the session which will record the cells seen, creates it if necessary."""
+        if not id in self._sessions:
+            self.add_session(id)
+        self._currentId = id
+
+    def get_current_session(self):
+        return self._currentId
+
+    def get_total_session(self):
+        return self._totalId
+
+    def add(self, mcc, mnc, lac, cid, type, id=None):
+        """Remembers the cell as seen by session id (defaults to the current one) and the total.
+
+        Returns True if the cell was new for session id.
+        """
+        if id == None:
+            id = self._currentId
+        if not id in self._sessions:
+            logging.warning('CellRegistry.add(): id (%s) cannot be found.' % id)
+            return False
+        key = pack_cell(mcc, mnc, lac, cid, type)
+        seenBy = self._cells.get(key, 0)
+        wanted = self._sessions[id] | self._totalBit
+        newBits = wanted & ~seenBy
+        if newBits == 0:
+            return False
+        self._cells[key] = seenBy | newBits
+        mcc, mnc, lac = int(mcc), int(mnc), int(lac)
+        for bit in self._sessions.itervalues():
+            if bit & newBits:
+                self._counts[(bit, type)] += 1
+                k = (bit, type, mcc, mnc)
+                self._mncCounts[k] = self._mncCounts.get(k, 0) + 1
+                k += (lac,)
+                self._lacCells.setdefault(k, set()).add(int(cid))
+        return bool(newBits & self._sessions[id])
+
+    def contains(self, mcc, mnc, lac, cid, type, id=None):
+        """Returns True if the cell has been seen by session id (defaults to the total)."""
+        if id == None:
+            id = self._totalId
+        bit = self._sessions.get(id, 0)
+        return bool(self._cells.get(pack_cell(mcc, mnc, lac, cid, type), 0) & bit)
+
+    def count(self, type, id=None):
+        """Returns the number of cells of given type seen by session id (defaults to the total)."""
+        if id == None:
+            id = self._totalId
+        if not id in self._sessions:
+            return 0
+        return self._counts[(self._sessions[id], type)]
+
+    def count_per_mnc(self, mcc, mnc, type, id=None):
+        """Returns the number of cells of given type seen in this MCC/MNC by session id."""
+        if id == None:
+            id = self._totalId
+        if not id in self._sessions:
+            return 0
+        return self._mncCounts.get((self._sessions[id], type, int(mcc), int(mnc)), 0)
+
+    def count_per_lac(self, mcc, mnc, lac, type, id=None):
+        """Returns the number of cells of given type seen in this MCC/MNC/LAC by session id."""
+        if id == None:
+            id = self._totalId
+        if not id in self._sessions:
+            return 0
+        return len(self._lacCells.get((self._sessions[id], type, int(mcc), int(mnc), int(lac)), ()))
+
+    def cells_per_lac(self, mcc, mnc, lac, type, id=None):
+        """Returns the sorted list of cell ids of given type seen in this MCC/MNC/LAC by session id."""
+        if id == None:
+            id = self._totalId
+        if not id in self._sessions:
+            return []
+        return sorted(self._lacCells.get((self._sessions[id], type, int(mcc), int(mnc), int(lac)), ()))
+
+    def lacs_per_mnc(self, mcc, mnc, type, id=None):
+        """Returns the sorted list of LACs with cells of given type seen in this MCC/MNC by session id."""
+        if id == None:
+            id = self._totalId
+        if not id in self._sessions:
+            return []
+        prefix = (self._sessions[id], type, int(mcc), int(mnc))
+        result = [k[4] for k in self._lacCells if k[:4] == prefix]
+        result.sort()
+        return result
+
+
+class SeenCellsIndex(recordindex.RecordIndex):
+    """On disk index of every (mcc, mnc, lac, cid) ever seen (see recordindex.RecordIndex).
+
+    The records are fixed width big endian, thus the byte order of two records is the same
+    as the numeric order of their fields.
+    """
+
+    RECORD = struct.Struct('>HHHI')
+    DESCRIPTION = 'Seen cells index'
+    UNIT = 'cells'
+
+    def __init__(self, filename):
+        recordindex.RecordIndex.__init__(self, filename, self.RECORD.size)
+
+    def _pack(self, mcc, mnc, lac, cid):
+        return self.RECORD.pack(int(mcc), int(mnc), int(lac), int(cid))
+
+    def contains(self, mcc, mnc, lac, cid):
+        """Returns True if the cell has ever been seen."""
+        return recordindex.RecordIndex.contains(self, self._pack(mcc, mnc, lac, cid))
+
+    def add(self, mcc, mnc, lac, cid):
+        """Remembers the cell. Returns True if it had never been seen before."""
+        return recordindex.RecordIndex.add(self, self._pack(mcc, mnc, lac, cid))
@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Containers packing many finished log files into one file per MCC.
+
+A container is an append only data file (EXTENSION), where the log files are stored
+one after the other exactly as they would have been stored as separate files (slices),
+and an index (data file name + INDEX_SUFFIX) of fixed size entries: offset and length of
+the slice, flags, and name of the log file.
+The slice is fsync'ed before its index entry is written, thus the index only references
+complete slices. Data after the last slice of the index (interrupted append) is dropped
+by the next append.
+Once uploaded, the slices are marked done in the index. When all of them are, the
+container is deleted.
+
+Run as a script, merges the log files of a logs directory into containers:
+container.py LOGS_DIR CONTAINERS_DIR
+"""
+
+import collections
+import logging
+import os
+import struct
+import sys
+import threading
+
+EXTENSION = '.pack'
+INDEX_SUFFIX = '.idx'
+# offset, length, flags, name (padded with '\0')
+_ENTRY = struct.Struct('<QIB55s')
+_FLAGS_OFFSET = 12
+MAX_NAME_LENGTH = 55
+# flags
+DONE = 1
+_COPY_CHUNK_SIZE = 65536
+
+# position is the one of the entry in the index file
+ContainerEntry = collections.namedtuple('ContainerEntry', 'name offset length done position')
+
+# containers are modified by the disk writer and by the uploads
+_lock = threading.Lock()
+
+def name_prefix(name):
+    """Returns the name of the container of the log file name (e.g. 'V2_208' for 'V2_208_log20100605143059.xml')."""
+    return os.path.basename(name).rsplit('_log', 1)[0]
+
+def container_filename(directory, name):
+    """Returns the full path of the container of the log file name."""
+    return os.path.join(directory, name_prefix(name) + EXTENSION)
+
+def list_containers(directory):
+    """Returns the containers (LogContainer) found in directory."""
+    if not os.path.exists(directory):
+        return []
+    return [LogContainer(os.path.join(directory, f)) for f in sorted(os.listdir(directory))
+            if f.endswith(EXTENSION)]
+
+def _open_for_update(filename):
+    if os.path.exists(filename):
+        return open(filename, 'r+b')
+    return open(filename, 'w+b')
+
+
+class LogContainer:
+    """One container: data file and index."""
+
+    def __init__(self, filename):
+        self._filename = filename
+        self._indexFilename = filename + INDEX_SUFFIX
+
+    def get_filename(self):
+        return self._filename
+
+    def exists(self):
+        return os.path.exists(self._indexFilename)
+
+    def read_index(self):
+        """Returns the list of the entries (ContainerEntry) of the index, in the order of the slices."""
+        try:
+            file = open(self._indexFilename, 'rb')
+        except IOError:
+            return []
+        try:
+            data = file.read()
+        finally:
+            file.close()
+        try:
+            dataSize = os.path.getsize(self._filename)
+        except OSError:
+            dataSize = 0
+        entries = []
+        # a truncated entry at the end is ignored
+        for position in xrange(0, len(data) - _ENTRY.size + 1, _ENTRY.size):
+            (offset, length, flags, name) = _ENTRY.unpack_from(data, position)
+            if offset + length > dataSize:
+                logging.warning('Container \'%s\': slice \'%s\' is missing.' % (self._filename, name.rstrip('\0')))
+                break
+            entries.append(ContainerEntry(name.rstrip('\0'), offset, length, flags & DONE != 0, position))
+        return entries
+
+    def get_pending(self):
+        """Returns the entries which are not done yet."""
+        return [entry for entry in self.read_index() if not entry.done]
+
+    def contains(self, name):
+        """Returns True if a slice is named name (done or not)."""
+        for entry in self.read_index():
+            if entry.name == name:
+                return True
+        return False
+
+    def append(self, name, source):
+        """Appends the content of the file named source as the slice name. Returns its ContainerEntry."""
+        if len(name) > MAX_NAME_LENGTH:
+            raise ValueError, 'Log file name too long for a container: %s' % name
+        _lock.acquire()
+        try:
+            entries = self.read_index()
+            offset = 0
+            if len(entries) > 0:
+                offset = entries[-1].offset + entries[-1].length
+            position = len(entries) * _ENTRY.size
+            data = _open_for_update(self._filename)
+            try:
+                data.truncate(offset)
+                data.seek(offset)
+                input = open(source, 'rb')
+                try:
+                    while True:
+                        chunk = input.read(_COPY_CHUNK_SIZE)
+                        if chunk == '':
+                            break
+                        data.write(chunk)
+                finally:
+                    input.close()
+                data.flush()
+                os.fsync(data.fileno())
+                length = data.tell() - offset
+            finally:
+                data.close()
+            index = _open_for_update(self._indexFilename)
+            try:
+                index.truncate(position)
+                index.seek(position)
+                index.write(_ENTRY.pack(offset, length, 0, name))
+                index.flush()
+                os.fsync(index.fileno())
+            finally:
+                index.close()
+            return ContainerEntry(name, offset, length, False, position)
+        finally:
+            _lock.release()
+
+    def extract(self, entry):
+        """Returns the content of the slice."""
+        data = open(self._filename, 'rb')
+        try:
+            data.seek(entry.offset)
+            content = data.read(entry.length)
+        finally:
+            data.close()
+        if len(content) != entry.length:
+            raise IOError, 'Container \'%s\': slice \'%s\' is truncated.' % (self._filename, entry.name)
+        return content
+
+    def open_slice(self, entry):
+        """Returns the data file, opened at the start of the slice (its end is not enforced)."""
+        data = open(self._filename, 'rb')
+        data.seek(entry.offset)
+        return data
+
+    def extract_to(self, entry, filename):
+        """Writes the content of the slice in the file named filename."""
+        out = open(filename, 'wb')
+        try:
+            out.write(self.extract(entry))
+        finally:
+            out.close()
+
+    def mark_done(self, entry):
+        """Marks the slice done. Deletes the container once all its slices are done."""
+        _lock.acquire()
+        try:
+            index = open(self._indexFilename, 'r+b')
+            try:
+                index.seek(entry.position + _FLAGS_OFFSET)
+                index.write(chr(DONE))
+                index.flush()
+                os.fsync(index.fileno())
+            finally:
+                index.close()
+            if len([e for e in self.read_index() if not e.done]) == 0:
+                # without its index, the data would be dropped by the next append anyway
+                os.remove(self._indexFilename)
+                os.remove(self._filename)
+                logging.info('All the log files of container \'%s\' are done, deleted.' % self._filename)
+        finally:
+            _lock.release()
+
+
+def compact(logDir, containersDir):
+    """Moves the log files of logDir into the containers of containersDir. Returns the number of files moved.
+
+    Must not run while the logger writes in these directories (from another process).
+    """
+    if not os.path.exists(containersDir):
+        os.mkdir(containersDir)
+    nbFiles = 0
+    # container filename -> names of its slices
+    names = {}
+    for f in sorted(os.listdir(logDir)):
+        filename = os.path.join(logDir, f)
+        if not os.path.isfile(filename) or len(f) > MAX_NAME_LENGTH:
+            continue
+        container = LogContainer(container_filename(containersDir, f))
+        if not container.get_filename() in names:
+            names[container.get_filename()] = set([entry.name for entry in container.read_index()])
+        # already there if we were interrupted before deleting it
+        if not f in names[container.get_filename()]:
+            container.append(f, filename)
+            names[container.get_filename()].add(f)
+        os.remove(filename)
+        nbFiles += 1
+    return nbFiles
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        print __doc__
+        sys.exit(1)
+    print '%i log files moved into containers.' % compact(sys.argv[1], sys.argv[2])
@@ -0,0 +1,129 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Bounded history of recent GPS fixes, to get the position at a given instant."""
+
+from array import array
+
+class GpsFixBuffer:
+    """Ring buffer of the last GPS fixes, stored in one array per field.
+
+    Fixes are indexed by the local time (time.time()) they have been received at,
+    which must be increasing. get_at() returns the position interpolated at a given
+    local time, thus a GSM sample can be matched to where we were when it was taken.
+    This class is not thread safe, the caller is in charge of locking.
+    """
+
+    # order of the values in append() and get_at() results, after the validity boolean
+    FIELDS = ('tstamp', 'lat', 'lng', 'alt', 'pdop', 'hdop', 'vdop', 'speed', 'heading')
+
+    def __init__(self, capacity=64):
+        self._capacity = capacity
+        self._times = array('d', [0.0] * capacity)
+        self._valid = array('B', [0] * capacity)
+        self._values = [array('d', [0.0] * capacity) for f in self.FIELDS]
+        # physical index of the oldest fix
+        self._start = 0
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def _physical(self, i):
+        return (self._start + i) % self._capacity
+
+    def _time(self, i):
+        return self._times[self._physical(i)]
+
+    def _fix(self, i):
+        p = self._physical(i)
+        return (bool(self._valid[p]),) + tuple([values[p] for values in self._values])
+
+    def append(self, when, valid, *values):
+        """Records a fix received at local time when. values follow FIELDS.
+
+        Returns False (and ignores the fix) if when is older than the newest fix.
+        A fix received at the same time as the newest one replaces it.
+        """
+        if len(values) != len(self.FIELDS):
+            raise ValueError, 'append() expects %i values, got %i.' % (len(self.FIELDS), len(values))
+        if self._size > 0:
+            newest = self._time(self._size - 1)
+            if when < newest:
+                return False
+            elif when == newest:
+                p = self._physical(self._size - 1)
+            else:
+                p = self._next_slot()
+        else:
+            p = self._next_slot()
+        self._times[p] = when
+        self._valid[p] = valid and 1 or 0
+        for field, value in zip(self._values, values):
+            field[p] = value
+        return True
+
+    def _next_slot(self):
+        """Returns the physical index of a new slot, dropping the oldest fix if full."""
+        if self._size < self._capacity:
+            self._size += 1
+        else:
+            self._start = (self._start + 1) % self._capacity
+        return self._physical(self._size - 1)
+
+    def newest_time(self):
+        """Returns the local time of the newest fix, None if empty."""
+        if self._size == 0:
+            return None
+        return self._time(self._size - 1)
+
+    def get_at(self, when, maxGap=5, maxAge=2):
+        """Returns (validity boolean,) + FIELDS values of the position at local time when.
+
+        Between two fixes, the position (time stamp, lat, lng, alt) is linearly interpolated,
+        DOPs are the worst of both, speed and heading are the ones of the nearest fix.
+        Returns None if when is older than the oldest fix, if the two surrounding fixes are more
+        than maxGap seconds apart, or if when is more than maxAge seconds after the newest fix.
+        """
+        if self._size == 0:
+            return None
+        last = self._size - 1
+        if when >= self._time(last):
+            if when - self._time(last) > maxAge:
+                return None
+            return self._fix(last)
+        if when < self._time(0):
+            return None
+        # first fix strictly after when
+        lo, hi = 0, last
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._time(mid) <= when:
+                lo = mid + 1
+            else:
+                hi = mid
+        before, after = self._fix(lo - 1), self._fix(lo)
+        t0, t1 = self._time(lo - 1), self._time(lo)
+        if t1 - t0 > maxGap:
+            return None
+        ratio = (when - t0) / (t1 - t0)
+        nearest = ratio < 0.5 and before or after
+        result = [before[0] and after[0]]
+        for i, name in enumerate(self.FIELDS):
+            i += 1
+            if name in ('tstamp', 'lat', 'lng', 'alt'):
+                result.append(before[i] + (after[i] - before[i]) * ratio)
+            elif name in ('pdop', 'hdop', 'vdop'):
+                result.append(max(before[i], after[i]))
+            else:
+                result.append(nearest[i])
+        return tuple(result)
@@ -0,0 +1,108 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Index of the content hashes of the log files uploaded.
+
+Before uploading a log file, the uploader looks for the hash of its content: a log file
+byte-identical to one already uploaded (e.g. regenerated by a journal recovery, or copied
+from another device) is skipped.
+"""
+
+import hashlib
+import threading
+
+import recordindex
+
+# bytes of the SHA-1 kept: collisions are negligible for millions of log files
+DIGEST_SIZE = 16
+_CHUNK_SIZE = 65536
+
+def digest_string(content):
+    """Returns the digest of content (a string)."""
+    return hashlib.sha1(content).digest()[:DIGEST_SIZE]
+
+def digest_file(file, size):
+    """Returns the digest of the size first bytes read from file (by chunks)."""
+    sha1 = hashlib.sha1()
+    remaining = size
+    while remaining > 0:
+        chunk = file.read(min(_CHUNK_SIZE, remaining))
+        if chunk == '':
+            raise IOError, 'Unable to hash: %i bytes missing.' % remaining
+        sha1.update(chunk)
+        remaining -= len(chunk)
+    return sha1.digest()[:DIGEST_SIZE]
+
+
+class HashIndex(recordindex.RecordIndex):
+    """On disk set of digests (see digest_string()).
+
+    Like cellregistry.SeenCellsIndex, a recordindex.RecordIndex of fixed width records (the
+    digests, DIGEST_SIZE bytes): hundreds of thousands of digests cost a few MB of disk, and
+    almost no memory, and saving the new digests only rewrites the small side file.
+    Thread safe.
+    """
+
+    DESCRIPTION = 'Uploaded hashes index'
+    UNIT = 'hashes'
+
+    def __init__(self, filename):
+        recordindex.RecordIndex.__init__(self, filename, DIGEST_SIZE)
+        self._lock = threading.RLock()
+
+    def contains(self, digest):
+        """Returns True if digest has been added."""
+        self._lock.acquire()
+        try:
+            return recordindex.RecordIndex.contains(self, digest)
+        finally:
+            self._lock.release()
+
+    def add(self, digest):
+        """Adds digest. Returns True if it was not there yet."""
+        self._lock.acquire()
+        try:
+            return recordindex.RecordIndex.add(self, digest)
+        finally:
+            self._lock.release()
+
+    def count(self):
+        """Returns the number of digests."""
+        self._lock.acquire()
+        try:
+            return recordindex.RecordIndex.count(self)
+        finally:
+            self._lock.release()
+
+    def save(self):
+        """See recordindex.RecordIndex.save()."""
+        self._lock.acquire()
+        try:
+            return recordindex.RecordIndex.save(self)
+        finally:
+            self._lock.release()
+
+    def merge(self):
+        """See recordindex.RecordIndex.merge()."""
+        self._lock.acquire()
+        try:
+            return recordindex.RecordIndex.merge(self)
+        finally:
+            self._lock.release()
+
+    def close(self):
+        """Merges the new digests into the index file, and unmaps it."""
+        self._lock.acquire()
+        try:
+            recordindex.RecordIndex.close(self)
+        finally:
+            self._lock.release()
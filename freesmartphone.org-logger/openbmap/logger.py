@@ -24,49 +24,93 @@ import time
 from datetime import datetime
 import inspect
 import logging
+import ast
 import ConfigParser
 import threading
+import collections
 import os.path
 import urllib2
+import httplib
+import urlparse
 import math
 import plugins.obmplugin
+import cellregistry
+import gpsfixes
+import scheduler
+import logwriter
+import container
+import serializer
+import xmllog
+import binlog
 
 # HTTP multi part upload
 import Upload
+import uploader
+import manifest
+import hashindex
+import neighbourcache
+
+# Immutable snapshot of the GSM state received through D-Bus signals.
+# Gsm never modifies a snapshot, it publishes a new one instead (see Gsm.publish_state()),
+# thus a snapshot read once is always consistent.
+GsmState = collections.namedtuple('GsmState',
+                                  'MCC MNC lac cid strength act registration callOngoing')
 
 class Gsm:
-    # This lock will be used when reading/updating *any* GSM related variable.
-    # Thus MCC, MNC, lac, cellid and strength are consistent.
+    """GSM state received through D-Bus signals, and monitoring queries.
+
+    The neighbour cells cache (see neighbourcache.NeighbourCellsCache) is only used by
+    get_gsm_data(useCache=True), that is to say to refresh the display when not logging:
+    the neighbour cells logged are always queried. Thus its counters do not tell how many
+    modem queries the cache would save while logging.
+    """
+    # This lock protects the cells seen and the neighbour cells cache.
+    # It is never held while waiting for D-Bus.
     lock = threading.Lock()
     
-    def __init__(self, bus):
+    def __init__(self, bus, seenCellsIndexDir=None):
         # "MCC", "MNC", "lac", "cid" and "strength" are received asynchronuously, through signal handler
-        # thus we need to store them for the time the logging loop runs
-        self._lac = -1
-        self._cid = -1
-        self._strength = -1
-        self._networkAccessType = ''
-        self._MCC = ''
-        self._MNC = ''
-        self._registrationGSM = ''
+        # thus we need to store them for the time the logging loop runs.
+        # Readers simply take self._state, writers publish a new snapshot holding self._state_write_lock.
+        self._state = GsmState(MCC = '', MNC = '', lac = -1, cid = -1, strength = -1,
+                               act = '', registration = '', callOngoing = False)
+        self._state_write_lock = threading.Lock()
         
-        #This will remember all the cells seen. The structure is:
-        # {id}->{MCC}->{MNC}->( {LAC}->[cid], {LAC}->[cid] ) 0: servings, 1: neighbours
-        self._remember_cells_structures = {}
-        self._current_remember_cells_structure_id = None
+        #This will remember all the cells seen, for every remember cells structure id
+        # (one per logging session, plus the total one). See cellregistry.CellRegistry.
         self.REMEMBER_CELLS_STRUCTURE_TOTAL_ID = 'Total number of cells since Launch'
+        self._seen_cells = cellregistry.CellRegistry(self.REMEMBER_CELLS_STRUCTURE_TOTAL_ID)
+        self._current_remember_cells_structure_id = None
         self.set_current_remember_cells_id(self.REMEMBER_CELLS_STRUCTURE_TOTAL_ID)
-        self._nb_remember_servings_in_last_structure = 0
-        self._nb_remember_neighbours_in_last_structure = 0
-        self._nb_remember_servings_total = 0
-        self._nb_remember_neighbours_total = 0
+        # Every cell ever seen on this device, persistent across restarts.
+        # One index for servings, one for neighbours, loaded on first use.
+        self._seen_cells_ever = None
+        if seenCellsIndexDir:
+            self._seen_cells_ever = (cellregistry.SeenCellsIndex(os.path.join(seenCellsIndexDir,
+                                                                              'seen_servings.idx')),
+                                     cellregistry.SeenCellsIndex(os.path.join(seenCellsIndexDir,
+                                                                              'seen_neighbours.idx')))
 
         self._manufacturer = 'N/A'
         self._model = 'N/A'
         self._revision = 'N/A'
         self.get_device_info()
         self._observers = []
-        self._call_ongoing = False
+        # callables called (without the lock) when the serving cell changes
+        self._serving_cell_listeners = []
+        # call id -> status, updated from the CallStatus signal payloads.
+        # Released calls are removed. Protected by self._state_write_lock.
+        self._calls = {}
+        # Monitoring D-Bus calls timeout, in seconds. Serving and neighbour cells
+        # queries are issued concurrently, and share this deadline.
+        self.MONITORING_TIMEOUT = 0.8
+        # Period (in sec.) of the calls table reconciliation with ListCalls, see sync_calls().
+        self.CALLS_RECONCILIATION_PERIOD = 60
+        # name of the monitoring query -> (last latency in sec., number of calls, number of failures)
+        self._monitoring_latency = {}
+        # (MCC, MNC, lac, cid) of the serving cell -> neighbour cells tuple, disabled until
+        # set_neighbour_cache_parameters()
+        self._neighbour_cache = neighbourcache.NeighbourCellsCache()
         
         if bus:
             bus.add_signal_receiver(self.network_status_handler,
@@ -107,11 +151,12 @@ class Gsm:
         return result
         
     
-    def call_status_handler(self, data, *args, **kwargs):
+    def call_status_handler(self, id, status, properties, *args, **kwargs):
         """This maps to org.freesmartphone.GSM.Call.CallStatus.
+
+        The calls table is updated from the signal payload, no D-Bus call is made.
         """
-        logging.debug('Call status change notified, gets the lock.')
-        self.acquire_lock()
+        logging.debug('Call status change notified: %s, %s.' % (id, status))
         # CallStatus ( isa{sv} )
         #i: id
         #The index of the call that changed its status or properties.
@@ -122,28 +167,70 @@ class Gsm:
         # * "active" = The call is the active call (you can talk),
         # * "held" = The call is being held,
         # * "release" = The call has been released.
-        self._call_ongoing = False
-        list = self._gsmCallIface.ListCalls()
+        self._state_write_lock.acquire()
+        if status == 'release':
+            if id in self._calls:
+                del self._calls[id]
+        else:
+            logging.info('Call ongoing: %i, %s.' % (id, status) )
+            self._calls[id] = status
+        self.publish_calls()
+        self._state_write_lock.release()
+        logging.debug('Call status updated.')
+
+    def sync_calls(self):
+        """Rebuilds the calls table from org.freesmartphone.GSM.Call.ListCalls.
+
+        Used for the first synchronisation, then periodically in case a CallStatus
+        signal has been missed. Always returns True, to be usable as a gobject timeout callback.
+        """
+        try:
+            list = self._gsmCallIface.ListCalls()
+        except Exception, e:
+            logging.warning('Unable to list the calls (%s).' % str(e))
+            return True
+        calls = {}
         for call in list:
             index, status, properties = call
             if status != 'release':
-                logging.info('Call ongoing: %i, %s.' % (index, status) )
-                self._call_ongoing = True
-        if not self._call_ongoing:
+                calls[index] = status
+        self._state_write_lock.acquire()
+        if calls != self._calls:
+            logging.info('Calls table reconciled: %s (was %s).' % (calls, self._calls))
+        self._calls = calls
+        self.publish_calls()
+        self._state_write_lock.release()
+        return True
+
+    def publish_calls(self):
+        """Publishes callOngoing from the calls table. The caller must hold self._state_write_lock."""
+        callOngoing = len(self._calls) > 0
+        if self._state.callOngoing and not callOngoing:
             logging.info('No call ongoing left.')
-        logging.debug('Call status updated, released the lock.')
-        self.release_lock()
+        self._state = self._state._replace(callOngoing = callOngoing)
 
     def call_ongoing(self):
         """Returns True if a call is ongoing. False otherwise."""
-        logging.debug('call_ongoing() gets the lock.')
-        self.acquire_lock()
-        result = self._call_ongoing
+        result = self._state.callOngoing
         logging.debug('call_ongoing()? %s' % result)
-        logging.debug('call_ongoing(), released the lock.')
-        self.release_lock()
         return result
 
+    def get_state(self):
+        """Returns the current GsmState snapshot. Never blocks."""
+        return self._state
+
+    def publish_state(self, **changes):
+        """Publishes a new GsmState snapshot, the current one with given fields changed.
+
+        Returns (previous snapshot, new snapshot).
+        """
+        self._state_write_lock.acquire()
+        previous = self._state
+        self._state = previous._replace(**changes)
+        current = self._state
+        self._state_write_lock.release()
+        return (previous, current)
+
     def network_status_handler(self, data, *args, **kwargs):
         """Handler for org.freesmartphone.GSM.Network.Status signal.
         
@@ -151,9 +238,7 @@ class Gsm:
         Warning: we do not receive this signal when only the signal strength changes, see
         org.freesmartphone.GSM.Network.SignalStrength signal, and self.signal_strength_handler().
         """
-        logging.debug("Wait for updating GSM data.")
-        self.acquire_lock()
-        logging.debug("Lock acquired, updating GSM data.")
+        logging.debug("Updating GSM data.")
         try:
             if data['registration'] == 'home' or data['registration'] == 'roaming':
                 logging.info('Registration status is: %s.' % data['registration'])
@@ -162,12 +247,6 @@ class Gsm:
                 raise Exception, 'GSM data not available.'
                     
             if "lac" and "cid" and "strength" and "code" and "act" in data:
-                self._MCC = (str(data['code'])[:3]).lstrip('0')
-                self._MNC = (str(data['code'])[3:]).lstrip('0')
-                self._networkAccessType = data['act']
-                # lac and cid are hexadecimal strings
-                self._lac = str(self.get_hex(data["lac"]))
-                self._cid = str(self.get_hex(data["cid"]))
                 # The signal strength in percent (0-100) is returned.
                 # Mickey pointed out (see dev mailing list archive):
                 # in module ogsmd.gsm.const:
@@ -182,58 +261,79 @@ class Gsm:
                 #    return int( round( math.log( signal ) / math.log( 31 ) * 100 ) )
                 if data["strength"] == 0:
                     raise Exception, 'GSM strength (0) not suitable.'
-                else:
-                    self._strength = self.signal_percent_to_dbm( data["strength"] )
-                    val_from_modem = (self._strength + 113 ) / 2
-                    self._registrationGSM = data['registration']
-                    logging.info("MCC %s MNC %s LAC %s, CID %s, strength %i/%i/%i (dBm, modem, percent 0-100)" % \
-                                 (self._MCC, self._MNC, self._lac, self._cid,
-                                  self._strength, val_from_modem, data['strength']))
-                self.remember_serving_cell_as_seen(self._current_remember_cells_structure_id,
-                                                   [{'lac':self._lac,
-                                                     'cid':self._cid}]
-                                                   )
+                strength = self.signal_percent_to_dbm( data["strength"] )
+                (previous, current) = self.publish_state(MCC = (str(data['code'])[:3]).lstrip('0'),
+                                                         MNC = (str(data['code'])[3:]).lstrip('0'),
+                                                         act = data['act'],
+                                                         # lac and cid are hexadecimal strings
+                                                         lac = str(self.get_hex(data["lac"])),
+                                                         cid = str(self.get_hex(data["cid"])),
+                                                         strength = strength,
+                                                         registration = data['registration'])
             else:
                 raise Exception, 'One or more required GSM data (MCC, MNC, lac, cid or strength) is missing.'
         except Exception, e:
             logging.warning('Unable to get GSM data (%s).' % str(e))
-            self.empty_GSM_data()
-        self.release_lock()
-        logging.debug("GSM data updated, lock released.")
+            (previous, current) = self.empty_GSM_data()
+        else:
+            # the state published is valid: errors from now on must not reset it
+            val_from_modem = (strength + 113 ) / 2
+            logging.info("MCC %s MNC %s LAC %s, CID %s, strength %i/%i/%i (dBm, modem, percent 0-100)" % \
+                         (current.MCC, current.MNC, current.lac, current.cid,
+                          strength, val_from_modem, data['strength']))
+            self.acquire_lock()
+            try:
+                self.remember_serving_cell_as_seen(self._current_remember_cells_structure_id,
+                                                   [{'lac':current.lac,
+                                                     'cid':current.cid}]
+                                                   )
+            except Exception, e:
+                logging.error('Unable to remember the serving cell: %s' % str(e))
+            finally:
+                self.release_lock()
+        previousCell = (previous.MCC, previous.MNC, previous.lac, previous.cid)
+        currentCell = (current.MCC, current.MNC, current.lac, current.cid)
+        handover = self.check_GSM(current) and (previousCell[2] not in ('', -1)) and (currentCell != previousCell)
+        logging.debug("GSM data updated.")
+        if handover:
+            logging.info('Serving cell changed from %s to %s.' % (previousCell, currentCell))
+            self.notify_serving_cell_listeners()
         self.notify_observers()
 
     def signal_strength_handler(self, data, *args, **kwargs):
         """Handler for org.freesmartphone.GSM.Network.SignalStrength signal.
         """
-        logging.debug("Wait for updating GSM signal strength.")
-        self.acquire_lock()
-        logging.debug("Lock acquired, updating GSM signal strength.")
+        logging.debug("Updating GSM signal strength.")
         try:
             new_dbm = self.signal_percent_to_dbm(data)
-            if self.check_GSM():
+            # the check and the update must be done on the same snapshot
+            self._state_write_lock.acquire()
+            state = self._state
+            if self.check_GSM(state):
+                self._state = state._replace(strength = new_dbm)
+            self._state_write_lock.release()
+            if self.check_GSM(state):
                 logging.info('GSM Signal strength updated from %i dBm to %i dBm (%i %%)' %
-                             (self._strength,
+                             (state.strength,
                               new_dbm,
                               data))
-                self._strength = new_dbm
             else:
                 logging.info('GSM data invalid, no signal strength update to %i dBm (%i %%)' %
                              (new_dbm, data))
         except Exception, e:
             logging.warning('Unable to update GSM signal strength (%s).' % str(e))
-        self.release_lock()
-        logging.debug("GSM signal strength update finished, lock released.")
+        logging.debug("GSM signal strength update finished.")
         self.notify_observers()
 
     def empty_GSM_data(self):
-        """Empty all the local GSM related variables."""
-        self._lac = ''
-        self._cid = ''
-        self._MCC = ''
-        self._MNC = ''
-        self._strength = 0
-        self._registrationGSM = ''
-        self._networkAccessType = ''
+        """Empty all the local GSM related variables. Returns (previous snapshot, new snapshot)."""
+        return self.publish_state(lac = '',
+                                  cid = '',
+                                  MCC = '',
+                                  MNC = '',
+                                  strength = 0,
+                                  registration = '',
+                                  act = '')
     
     def get_device_info(self):
         """If available, returns the manufacturer, model and revision."""
@@ -265,11 +365,13 @@ class Gsm:
                      (self._manufacturer, self._model, self._revision))
         return(self._manufacturer, self._model, self._revision)
         
-    def check_GSM(self):
-        """Returns True if valid GSM data is available."""
+    def check_GSM(self, state=None):
+        """Returns True if valid GSM data is available (in the given snapshot, defaults to the current one)."""
+        if state == None:
+            state = self._state
         # if something went wrong with GSM data then strength will be set to 0 (see empty_GSM_data() )
         # see 3GPP documentation TS 07.07 Chapter 8.5, GSM 07.07 command +CSQ
-        return (self._strength >= -113 and self._strength <= -51)
+        return (state.strength >= -113 and state.strength <= -51)
     
     def signal_percent_to_dbm(self, val):
         """Translate the signal percent value to dbm."""
@@ -296,10 +398,23 @@ class Gsm:
         Otherwise returns an empty dictionary.
         Maximal timeout is 0.8 second.
         """
+        try:
+            data = self._gsmMonitoringIface.GetServingCellInformation(timeout = self.MONITORING_TIMEOUT)
+        except Exception, e:
+            logging.error('get serving cell info: %s' % str(e))
+            data = None
+        return self.parse_serving_cell_information(data)
+
+    def parse_serving_cell_information(self, data):
+        """Returns a dictionary with serving cell monitoring data, parsed from the D-Bus reply data.
+
+        See get_serving_cell_information(). data is None if the D-Bus call failed.
+        """
         result = {}
+        if data == None:
+            logging.debug( 'serving cell result: %s' % result)
+            return result
         try:
-            data = self._gsmMonitoringIface.GetServingCellInformation(timeout = 0.8)
-            
             # Debug
             # string hex
             #data['cid'] = '0'
@@ -353,9 +468,22 @@ class Gsm:
         They may contain rxlev, c1, c2, and ctype.
         Maximal timeout is 0.8 second.
         """
+        try:
+            data = self._gsmMonitoringIface.GetNeighbourCellInformation(timeout = self.MONITORING_TIMEOUT)
+        except Exception, e:
+            logging.error('get neighbour cells info: %s' % str(e))
+            data = None
+        return self.parse_neighbour_cell_info(data)
+
+    def parse_neighbour_cell_info(self, data):
+        """Returns a tuple of dictionaries, one for each cell, parsed from the D-Bus reply data.
+
+        See get_neighbour_cell_info(). data is None if the D-Bus call failed.
+        """
+        if data == None:
+            return ()
         results = []
         try:
-            data = self._gsmMonitoringIface.GetNeighbourCellInformation(timeout = 0.8)
             for cell in data:
                 #logging.debug( 'Raw data neighbour cell: %s' % cell)
                 if "lac" and "cid" in cell:
@@ -406,11 +534,128 @@ class Gsm:
             logging.error('get neighbour cells info: %s' % str(e))
             return ()
         return tuple(results)
+
+    def query_monitoring_data(self, callback, cachedNeighbourCells=None):
+        """Issues the serving and neighbour cells D-Bus queries concurrently, without waiting.
+
+        callback(servingInfo, neighbourCells) is called once, from the main loop, with the results
+        as returned by get_serving_cell_information() and get_neighbour_cell_info(): when both
+        replies have been received, or when their shared deadline of MONITORING_TIMEOUT expires.
+        If cachedNeighbourCells is not None, neighbour cells are not queried, it is passed instead.
+        The main loop is never iterated here: the caller may hold locks that D-Bus signal
+        handlers or idle callbacks need, they only run once it has returned.
+        """
+        replies = {}
+        queries = [('serving', self._gsmMonitoringIface.GetServingCellInformation)]
+        if cachedNeighbourCells == None:
+            queries.append(('neighbours', self._gsmMonitoringIface.GetNeighbourCellInformation))
+        # 'done' once callback has been called, 'deadline' is the timeout source id
+        status = {'done': False, 'deadline': None}
+
+        def complete(timedOut=False):
+            if status['done']:
+                return False
+            status['done'] = True
+            if not timedOut:
+                gobject.source_remove(status['deadline'])
+            for name, method in queries:
+                if not name in replies:
+                    logging.error('%s cells info: no reply within %g second(s).' % (name, self.MONITORING_TIMEOUT))
+                    replies[name] = None
+            servingInfo = self.parse_serving_cell_information(replies['serving'])
+            if cachedNeighbourCells != None:
+                callback(servingInfo, cachedNeighbourCells)
+            else:
+                callback(servingInfo, self.parse_neighbour_cell_info(replies['neighbours']))
+            # removes the deadline source when called by it
+            return False
+
+        def replied():
+            if len(replies) == len(queries):
+                complete()
+
+        status['deadline'] = gobject.timeout_add(int(self.MONITORING_TIMEOUT * 1000), complete, True)
+        for name, method in queries:
+            reply_handler, error_handler = self.create_monitoring_handlers(name, replies, replied)
+            try:
+                method(reply_handler = reply_handler,
+                       error_handler = error_handler,
+                       timeout = self.MONITORING_TIMEOUT)
+            except Exception, e:
+                # e.g. the interface is not available: counts as a failed reply
+                error_handler(e)
+
+    def set_neighbour_cache_parameters(self, ttl, maxDistance):
+        """Sets the neighbour cells cache time to live (in sec., 0 disables it) and invalidation distance (in m)."""
+        self.acquire_lock()
+        self._neighbour_cache.set_parameters(ttl, maxDistance)
+        self.release_lock()
+        logging.info('Neighbour cells cache: time to live %i sec., invalidation distance %i m.' % (ttl, maxDistance))
+
+    def set_position(self, lat, lng):
+        """Distance based invalidation hook of the neighbour cells cache: sets the current position.
+
+        Cached neighbour cells stored farther than the invalidation distance are dropped.
+        """
+        self.acquire_lock()
+        self._neighbour_cache.set_position(lat, lng)
+        self.release_lock()
+
+    def invalidate_neighbour_cache(self):
+        """Drops every cached neighbour cells list."""
+        self.acquire_lock()
+        self._neighbour_cache.clear()
+        self.release_lock()
+
+    def get_neighbour_cache_stats(self):
+        """Returns a dictionary with the neighbour cells cache 'hits', 'misses' and 'invalidated' counters.
+
+        Only the display refreshes look the cache up, see the class documentation.
+        """
+        self.acquire_lock()
+        result = self._neighbour_cache.get_counters()
+        self.release_lock()
+        return result
+
+    def create_monitoring_handlers(self, name, replies, replied):
+        """Returns a D-Bus (reply handler, error handler) pair storing the result in replies[name].
+
+        replied() is called after each result stored.
+        """
+        startTime = time.time()
+        def reply_handler(data):
+            self.record_monitoring_latency(name, time.time() - startTime, True)
+            replies[name] = data
+            replied()
+        def error_handler(e):
+            self.record_monitoring_latency(name, time.time() - startTime, False)
+            logging.error('%s cells info: %s' % (name, str(e)))
+            replies[name] = None
+            replied()
+        return reply_handler, error_handler
+
+    def record_monitoring_latency(self, name, latency, success):
+        """Records the latency (in sec.) of the monitoring query name."""
+        (last, calls, failures) = self._monitoring_latency.get(name, (0, 0, 0))
+        if not success:
+            failures += 1
+        self._monitoring_latency[name] = (latency, calls + 1, failures)
+        logging.debug('%s cells info D-Bus latency: %.3f sec.' % (name, latency))
+
+    def get_monitoring_latency(self):
+        """Returns a dictionary: monitoring query name -> (last latency in sec., number of calls, number of failures)."""
+        return dict(self._monitoring_latency)
         
-    def get_gsm_data(self):
-        """Return validity boolean, tuple serving cell data, tuple of neighbour cells dictionaries.
-        
-        Operation is atomic, values cannot be modified while reading it.
+    def get_gsm_data(self, callback, useCache=False):
+        """Reads GSM data: callback(validity boolean, tuple serving cell data, tuple of neighbour cells dictionaries).
+
+        callback is called once the monitoring D-Bus queries are done (see query_monitoring_data()),
+        or right away if the GSM data is not valid.
+        If useCache is True, the neighbour cells may come from the cache (e.g. for display), else
+        they are always queried: their measures are then fresh enough to be logged.
+        The state received through D-Bus signals is
+        read atomically. The lock is not held while waiting for the monitoring D-Bus queries,
+        only while merging their results.
         The validity boolean is True when all fields are valid and consistent,
         False otherwise.
         
@@ -420,30 +665,39 @@ class Gsm:
         Each neighbour cell dictionary contains lac and cid fields.
         They may contain rxlev, c1, c2, and ctype.
         """
-        logging.debug("Wait for reading GSM data.")
-        self.acquire_lock()
-        logging.debug("Lock acquired, reading GSM data.")
-        (valid, mcc, mnc, lac, cid, strength, act) = (self.check_GSM(),
-                                                      self._MCC,
-                                                      self._MNC,
-                                                      self._lac,
-                                                      self._cid,
-                                                      self._strength,
-                                                      self._networkAccessType)
-        neighbourCells = ()
-        tav = ''
-        rxlev = ''
+        state = self._state
+        (valid, mcc, mnc, lac, cid, strength, act) = (self.check_GSM(state),
+                                                      state.MCC,
+                                                      state.MNC,
+                                                      state.lac,
+                                                      state.cid,
+                                                      state.strength,
+                                                      state.act)
+        if not valid:
+            logging.info("valid=%s, MCC=%s, MNC=%s, lac=%s, cid=%s, strength=%s, act=%s" %
+                 (valid, mcc, mnc, lac, cid, strength, act))
+            callback(valid, (mcc, mnc, lac, cid, strength, act, '', ''), ())
+            return
+
+        cachedNeighbourCells = None
+        if useCache:
+            self.acquire_lock()
+            cachedNeighbourCells = self._neighbour_cache.lookup((mcc, mnc, lac, cid), time.time())
+            self.release_lock()
+
         # this is deactivated for release 0.2.0
         # and re-activated for release 0.3.0
-        if valid: 
-            neighbourCells = self.get_neighbour_cell_info()
-            servingInfo = self.get_serving_cell_information()
+        def merge(servingInfo, neighbourCells):
+            tav = ''
+            rxlev = ''
+            servingLac = lac
+            servingCid = cid
             # in case of a change in registration not already taken into account here
             # by processing D-Bus signal by network_status_handler(), we prefer using data
             # from get_serving_cell_information()
             if ('lac' in servingInfo) and ('cid' in servingInfo):
-                lac = servingInfo['lac']
-                cid = servingInfo['cid']
+                servingLac = servingInfo['lac']
+                servingCid = servingInfo['cid']
             
                 # deactivated. Timing advance only works for the serving cell, and when a channel is actually open
                 #if 'tav' in servingInfo:
@@ -452,16 +706,39 @@ class Gsm:
                 if 'rxlev' in servingInfo:
                     rxlev = str(servingInfo['rxlev'])
 
-            self.remember_neighbour_cells_as_seen(self._current_remember_cells_structure_id,
-                                                  neighbourCells)
+            logging.debug("Wait for merging GSM data.")
+            self.acquire_lock()
+            try:
+                logging.debug("Lock acquired, merging GSM data.")
+                if cachedNeighbourCells == None:
+                    # the neighbour cells were queried along with the serving cell information
+                    self._neighbour_cache.store((mcc, mnc, servingLac, servingCid), neighbourCells, time.time())
+                elif (servingLac, servingCid) != (lac, cid):
+                    # the cached neighbour cells are the ones of the previous serving cell
+                    logging.debug('Cached neighbour cells of %s / %s dropped, serving cell is now %s / %s.' %
+                                  (lac, cid, servingLac, servingCid))
+                    self._neighbour_cache.invalidate((mcc, mnc, lac, cid))
+                    neighbourCells = ()
+                self.remember_neighbour_cells_as_seen(self._current_remember_cells_structure_id,
+                                                      neighbourCells)
+            finally:
+                self.release_lock()
+            logging.debug("GSM data merged, lock released.")
+
+            logging.info("valid=%s, MCC=%s, MNC=%s, lac=%s, cid=%s, strength=%s, act=%s, tav=%s, rxlev=%s" %
+                 (valid, mcc, mnc, servingLac, servingCid, strength, act, tav, rxlev))
+            callback(valid, (mcc, mnc, servingLac, servingCid, strength, act, tav, rxlev), neighbourCells)
+
+        self.query_monitoring_data(merge, cachedNeighbourCells)
+    
+    def get_serving_cell(self):
+        """Returns (MCC, MNC, lac, cid) of the serving cell, as last received through D-Bus signals.
 
-        logging.info("valid=%s, MCC=%s, MNC=%s, lac=%s, cid=%s, strength=%s, act=%s, tav=%s, rxlev=%s" %
-             (valid, mcc, mnc, lac, cid, strength, act, tav, rxlev))
+        No D-Bus call is made, thus this is cheap.
+        """
+        state = self._state
+        return (state.MCC, state.MNC, state.lac, state.cid)
 
-        self.release_lock()
-        logging.debug("GSM data read, lock released.")
-        return (valid, (mcc, mnc, lac, cid, strength, act, tav, rxlev), neighbourCells )
-    
     def get_status(self):
         """Get GSM status.
         
@@ -476,11 +753,10 @@ class Gsm:
 
         Throws exception if id already exists.
         Returns id on success."""
-        if id in self._remember_cells_structures:
+        if self._seen_cells.has_session(id):
             raise Exception, 'create_remember_cells_strucutre(): id already exists.'
         else:
-            self._remember_cells_structures[id] = {}
-            logging.info('id:%s added to remember cells structure.' % id)
+            self._seen_cells.add_session(id)
             return id
 
     def remember_cells_as_seen(self, id, cells, type):
@@ -490,90 +766,43 @@ class Gsm:
         cells: a list of dictionaries describing cells to remember
         type: 0 : servings, 1 : neighbours
         Cells already seen are ignored.
-        If the id is not the one from the structure used to remember all the cells,
-        and a new value is added, it calls the method on the "total" structure."""
+        The structure used to remember all the cells is always updated as well.
+        """
 
-        if not type in (0, 1):
+        if not type in cellregistry.TYPES:
             raise Exception, 'remember_cells_as_seen() wrong type value (%s).' % type
 
-        structure = self._remember_cells_structures
-
-        if not id in structure:
+        if not self._seen_cells.has_session(id):
             logging.warning('Remember_cells_as_seen(): id (%s) cannot be found.' % id)
             return
-        else:
-            structure = self._remember_cells_structures[id]
 
-        if self._MCC == '':
+        state = self._state
+        if state.MCC == '':
             logging.debug('remember_cells_as_seen(): ignores empty MCC.')
             return
-        elif not self._MCC in structure:
-            logging.info('Adds MCC:%s to remember cell structure id (%s).' % (self._MCC, id))
-            structure[self._MCC] = {}
-
-        structure = structure[self._MCC]
-
-        if self._MNC == '':
+        if state.MNC == '':
             logging.debug('remember_cells_as_seen(): ignores empty MNC.')
             return
-        elif not self._MNC in structure:
-            logging.info('Adds MNC:%s to remember cell structure id (%s), MCC:%s.' %
-                         (self._MNC, id, self._MCC))
-            # servings and neighbours
-            structure[self._MNC] = ({}, {})
 
-        structure = structure[self._MNC][type]
         logging.info('Update remember cells structure for %s.' % ['servings', 'neighbours'][type])
-
         for cell in cells:
-            if cell['lac'] in structure:
-                if cell['cid'] in structure[ cell['lac'] ]:
-                    logging.debug('Cell %(lac)s / %(cid)s has already been seen' % cell)
-                    continue
-                else:
-                    structure[ cell['lac'] ].append(cell['cid'])
-                    logging.info('Cell %(lac)s / %(cid)s adds a new cid to remember' % cell +
+            try:
+                newSinceLaunch = not self._seen_cells.contains(state.MCC, state.MNC,
+                                                               cell['lac'], cell['cid'], type)
+                if self._seen_cells.add(state.MCC, state.MNC, cell['lac'], cell['cid'], type, id):
+                    logging.info('Cell %(lac)s / %(cid)s added to remember' % cell +
                                  ' to structure id: %s' % id)
-            else:
-                structure[ cell['lac'] ] = [ cell['cid'] ]
-                logging.info('Cell %(lac)s / %(cid)s adds new lac and cid to remember' % cell +
-                             ' to structure id: %s' % id)
-            self.increase_remember_cells_stats(id, type)
-            if id != self.REMEMBER_CELLS_STRUCTURE_TOTAL_ID:
-                    # we are not in the structure which gathers *all* cells seen
-                    logging.debug('Try updating remember cells total structure.')
-                    self.remember_cells_as_seen(self.REMEMBER_CELLS_STRUCTURE_TOTAL_ID,
-                                                [cell],
-                                                type)
-
-    def increase_remember_cells_stats(self, id, type):
-        """Increments the number of cells for the id and type.
-
-        id: id of the remember cells structure to act upon
-        type: 0 : servings, 1 : neighbours
-        """
-
-        if not type in (0, 1):
-            raise Exception, 'increase_remember_cells_stats() wrong type value (%s).' % type
-
-        if id == self.REMEMBER_CELLS_STRUCTURE_TOTAL_ID:
-            if type == 0:
-                self._nb_remember_servings_total += 1
-            else:
-                self._nb_remember_neighbours_total += 1
-            logging.debug('Total numbers of cells seen are now: %i, %i.' %
-                          (self._nb_remember_servings_total,
-                           self._nb_remember_neighbours_total)
-                          )
-        else:
-            if type == 0:
-                self._nb_remember_servings_in_last_structure += 1
-            else:
-                self._nb_remember_neighbours_in_last_structure += 1
-            logging.debug('Numbers of cells seen in last structure are now: %i, %i.' %
-                          (self._nb_remember_servings_in_last_structure,
-                           self._nb_remember_neighbours_in_last_structure)
-                          )
+                else:
+                    logging.debug('Cell %(lac)s / %(cid)s has already been seen' % cell)
+                if newSinceLaunch and self._seen_cells_ever:
+                    # only cells new since launch may be new for ever
+                    if self._seen_cells_ever[type].add(state.MCC, state.MNC, cell['lac'], cell['cid']):
+                        logging.info('Cell %(lac)s / %(cid)s has never been seen before' % cell)
+            except ValueError, e:
+                logging.warning('Unable to remember cell %s: %s' % (cell, str(e)))
+            except EnvironmentError, e:
+                # the index of the cells ever seen could not be saved, the cell is still remembered
+                logging.error('Unable to save the seen cells index: %s' % str(e))
 
     def remember_serving_cell_as_seen(self, id, serving):
         """Remembers having seen the serving cell.
@@ -602,17 +831,13 @@ class Gsm:
         self.acquire_lock()
         logging.debug("Lock acquired by set_current_remember_cells_id().")
 
-        if id in self._remember_cells_structures:
+        if self._seen_cells.has_session(id):
             logging.info('id:\'%s\' already existed in remember cells structure.' % id)
         else:
             self.create_remember_cells_structure(id)
 
         self._current_remember_cells_structure_id = id
-        #TODO: you can set an existing id. In that case, you should initialise
-        # the values with the content of the existing structure
-        self._nb_remember_servings_in_last_structure = 0
-        self._nb_remember_neighbours_in_last_structure = 0
-        logging.debug('Remember cells counters for current structure reset to 0.')
+        self._seen_cells.set_current_session(id)
         logging.info('current remember cells structure id set to: %s' % id)
 
         self.release_lock()
@@ -625,19 +850,54 @@ class Gsm:
         number of serving cells seen in last remember structure,
         number of neighbour cells seen in last remember structure,
         number of serving cells seen since launch,
-        number of neighbour cells seen since launch
+        number of neighbour cells seen since launch,
+        number of serving cells ever seen,
+        number of neighbour cells ever seen
+        The last two are -1 if there is no persistent index of cells seen.
         """
         logging.debug("Wait for GSM Lock data.")
         self.acquire_lock()
         logging.debug("Lock acquired by get_seen_cells_stats(), reading.")
-        res = (self._nb_remember_servings_in_last_structure,
-                self._nb_remember_neighbours_in_last_structure,
-                self._nb_remember_servings_total,
-                self._nb_remember_neighbours_total)
+        current = self._current_remember_cells_structure_id
+        if current == self.REMEMBER_CELLS_STRUCTURE_TOTAL_ID:
+            # no logging session has been started yet
+            current = None
+        res = (current and self._seen_cells.count(cellregistry.SERVING, current) or 0,
+               current and self._seen_cells.count(cellregistry.NEIGHBOUR, current) or 0,
+               self._seen_cells.count(cellregistry.SERVING),
+               self._seen_cells.count(cellregistry.NEIGHBOUR))
+        if self._seen_cells_ever:
+            res += (self._seen_cells_ever[cellregistry.SERVING].count(),
+                    self._seen_cells_ever[cellregistry.NEIGHBOUR].count())
+        else:
+            res += (-1, -1)
         self.release_lock()
         logging.debug("Lock released by get_seen_cells_stats().")
         return res
 
+    def save_seen_cells_index(self, merge=False):
+        """Saves to disk the cells seen for the first time, if any.
+
+        If merge is True, they are merged into the index files (e.g. at exit), see
+        cellregistry.SeenCellsIndex.merge().
+        """
+        if not self._seen_cells_ever:
+            return
+        logging.debug("Wait for GSM Lock data.")
+        self.acquire_lock()
+        logging.debug("Lock acquired by save_seen_cells_index().")
+        try:
+            for index in self._seen_cells_ever:
+                if merge:
+                    index.close()
+                else:
+                    index.save()
+        except Exception, e:
+            logging.error('Unable to save the seen cells index: %s' % str(e))
+        finally:
+            self.release_lock()
+        logging.debug("Lock released by save_seen_cells_index().")
+
     def acquire_lock(self):
         """Acquire the lock to prevent state of the GSM variables to be modified."""
         self.lock.acquire()
@@ -653,12 +913,35 @@ class Gsm:
             
     def register(self, observer):
         self._observers.append(observer)
+
+    def register_serving_cell_listener(self, listener):
+        """listener will be called, without argument, every time the serving cell changes."""
+        self._serving_cell_listeners.append(listener)
+
+    def notify_serving_cell_listeners(self):
+        for listener in self._serving_cell_listeners:
+            listener()
     
+def parse_plugins_list(value):
+    """Returns the tuple of plugins names of the configuration value (a list of strings, as written by str()).
+
+    Raises ValueError if value is not such a list."""
+    names = ast.literal_eval(str(value))
+    if not isinstance(names, (list, tuple)) or [name for name in names if not isinstance(name, basestring)]:
+        raise ValueError, 'Expected a list of plugins names, found: %s' % value
+    return tuple(names)
+
 class Config:
 
     def __init__(self, config_filename):
         self._configuration_filename = config_filename
         self._config = self.load_config()
+        # modification time of the file when loaded or saved, see reload()
+        self._mtime = self.get_mtime()
+        # typed values of the configuration, see set_schema() and get_snapshot()
+        self._schema = []
+        self._snapshotClass = collections.namedtuple('ConfigSnapshot', '')
+        self._snapshot = None
                 
     def load_config(self):
         """Try loading the configuration file.
@@ -683,6 +966,62 @@ class Config:
 
     def set(self, section, option, value):
         self._config.set(section, option, value)
+        self.invalidate_snapshot()
+
+    def set_schema(self, schema):
+        """Sets the options of the typed snapshot, see get_snapshot().
+
+        schema is a [ (attribute name, section, option, parser) ], parser returns the typed
+        value of the option from its raw value (e.g. int).
+        """
+        self._schema = schema
+        self._snapshotClass = collections.namedtuple('ConfigSnapshot', [entry[0] for entry in schema])
+        self.invalidate_snapshot()
+
+    def get_snapshot(self):
+        """Returns the typed values of the options of the schema, as an immutable named tuple.
+
+        The values are parsed at the first call after a modification of the configuration, the
+        following calls return the same snapshot. Raises an exception if a value cannot be parsed.
+        """
+        snapshot = self._snapshot
+        if snapshot == None:
+            snapshot = self._snapshotClass(*[parser(self._config.get(section, option))
+                                             for (name, section, option, parser) in self._schema])
+            self._snapshot = snapshot
+        return snapshot
+
+    def invalidate_snapshot(self):
+        """The snapshot will be parsed again at the next get_snapshot() call."""
+        self._snapshot = None
+
+    def get_mtime(self):
+        """Returns the modification time of the configuration file, None if it does not exist."""
+        try:
+            return os.path.getmtime(self._configuration_filename)
+        except OSError:
+            return None
+
+    def reload(self, validate):
+        """Reloads the configuration file if it has been modified since it was loaded or saved.
+
+        validate is called with a Config of the new content, and returns True if it is valid.
+        Only then the new content replaces the current one, at once. An invalid content is
+        not loaded again until the file is modified again.
+        Returns True if the configuration has been replaced.
+        """
+        mtime = self.get_mtime()
+        if mtime == self._mtime:
+            return False
+        self._mtime = mtime
+        candidate = Config(self._configuration_filename)
+        candidate.set_schema(self._schema)
+        if not validate(candidate):
+            logging.error('Modified configuration file could not be validated, keeping the current configuration.')
+            return False
+        self._config = candidate._config
+        self.invalidate_snapshot()
+        return True
 
     def set_config_if_not_exist(self, params):
         """For every value in params, insert it only if it is not already present.
@@ -711,6 +1050,8 @@ class Config:
         logging.info('Save config file \'%s\'' % self._configuration_filename)
         self._config.write(configFile)
         configFile.close()        
+        self._mtime = self.get_mtime()
+        self.invalidate_snapshot()
     
 class Gps:
     
@@ -733,6 +1074,109 @@ class Gps:
         self._vdop = -1
         self._tstamp = -1
 
+        # Last values received through Gypsy signals. Each entry is
+        # name -> (local time of reception, values tuple as returned by the matching Get*() call).
+        # Protected by self._cacheLock: signal handlers and readers may run in different threads.
+        self._cache = {}
+        self._cacheLock = threading.Lock()
+        # Cached values older than this (in seconds) are considered stale, and the
+        # Gypsy daemon is polled instead. Gypsy does not emit signals when nothing changes.
+        self.CACHE_MAX_AGE = 2
+        self._cacheHits = 0
+        self._cacheMisses = 0
+        # Recent fixes, indexed by local reception time, to know where we were when
+        # GSM data was read. Also protected by self._cacheLock.
+        self._fixes = gpsfixes.GpsFixBuffer()
+
+        bus = dbus.SystemBus()
+        for handler, signal, interface in [(self.position_changed_handler, 'PositionChanged',
+                                            'org.freedesktop.Gypsy.Position'),
+                                           (self.accuracy_changed_handler, 'AccuracyChanged',
+                                            'org.freedesktop.Gypsy.Accuracy'),
+                                           (self.course_changed_handler, 'CourseChanged',
+                                            'org.freedesktop.Gypsy.Course')]:
+            bus.add_signal_receiver(handler,
+                                    signal,
+                                    interface,
+                                    'org.freesmartphone.ogpsd',
+                                    '/org/freedesktop/Gypsy')
+
+    def position_changed_handler(self, fields, tstamp, lat, lng, alt, *args, **kwargs):
+        """Handler for org.freedesktop.Gypsy.Position.PositionChanged signal."""
+        self.update_cache('position', (fields, tstamp, lat, lng, alt))
+
+    def accuracy_changed_handler(self, fields, pdop, hdop, vdop, *args, **kwargs):
+        """Handler for org.freedesktop.Gypsy.Accuracy.AccuracyChanged signal."""
+        self.update_cache('accuracy', (fields, pdop, hdop, vdop))
+
+    def course_changed_handler(self, fields, tstamp, speed, heading, climb, *args, **kwargs):
+        """Handler for org.freedesktop.Gypsy.Course.CourseChanged signal."""
+        self.update_cache('course', (fields, tstamp, speed, heading, climb))
+
+    def update_cache(self, name, values):
+        """Stores values in the cache entry name, timestamped with the current time."""
+        self._cacheLock.acquire()
+        now = time.time()
+        self._cache[name] = (now, values)
+        if name == 'position':
+            self.record_fix(now)
+        self._cacheLock.release()
+
+    def record_fix(self, when):
+        """Records in the fixes buffer the current position, with the last accuracy and course received.
+
+        Must be called with self._cacheLock held.
+        """
+        (fields, tstamp, lat, lng, alt) = self._cache['position'][1]
+        valid = (fields == 7)
+        (fields, pdop, hdop, vdop) = self._cache.get('accuracy', (0, (0, -1, -1, -1)))[1]
+        valid = valid and (fields == 7)
+        (fields, courseTstamp, speed, heading, climb) = self._cache.get('course', (0, (0, 0, -1, -1, 0)))[1]
+        valid = valid and (fields & (1 << 0)) and (fields & (1 << 1))
+        self._fixes.append(when, valid, tstamp, lat, lng, alt, pdop, hdop, vdop, speed, heading)
+
+    def refresh(self):
+        """Makes sure the newest values are in the fixes buffer (polls Gypsy if the signals are stale)."""
+        self.get_course()
+        self.get_GPS_data()
+
+    def get_fix_at(self, when):
+        """Returns validity boolean, time stamp, lat, lng, alt, pdop, hdop, vdop, speed in knots, heading.
+
+        The position is interpolated at local time when (as given by time.time()), from the recent fixes.
+        Returns None if no fix is close enough to when.
+        """
+        self.refresh()
+        self._cacheLock.acquire()
+        result = self._fixes.get_at(when)
+        self._cacheLock.release()
+        return result
+
+    def get_cached(self, name, poll):
+        """Returns the cached values for entry name, or calls poll() if they are missing or stale.
+
+        The result of poll() is then cached.
+        """
+        self._cacheLock.acquire()
+        entry = self._cache.get(name)
+        if entry and (time.time() - entry[0]) <= self.CACHE_MAX_AGE:
+            self._cacheHits += 1
+            self._cacheLock.release()
+            return entry[1]
+        self._cacheMisses += 1
+        self._cacheLock.release()
+        logging.debug('GPS %s not received recently, polling.' % name)
+        values = poll()
+        self.update_cache(name, values)
+        return values
+
+    def get_cache_stats(self):
+        """Returns the number of GPS reads served from the cache, and the number of polls."""
+        self._cacheLock.acquire()
+        result = (self._cacheHits, self._cacheMisses)
+        self._cacheLock.release()
+        return result
+
     def request(self):
         """Requests the GPS resource through /org/freesmartphone/Usage."""
         obj = dbus.SystemBus().get_object('org.freesmartphone.ousaged', '/org/freesmartphone/Usage')
@@ -756,9 +1200,14 @@ class Gps:
             return False
     
     def get_GPS_data(self):
-        """Returns Validity boolean, time stamp, lat, lng, alt, pdop, hdop, vdop."""
+        """Returns Validity boolean, time stamp, lat, lng, alt, pdop, hdop, vdop.
+
+        Values come from the Gypsy signals cache, Gypsy is polled only if they are stale.
+        """
         logging.debug('Get GPS position')
-        (fields, tstamp, lat, lng, alt) = dbus.Interface(self._dbusobj, 'org.freedesktop.Gypsy.Position').GetPosition()
+        (fields, tstamp, lat, lng, alt) = self.get_cached('position',
+                                                          dbus.Interface(self._dbusobj,
+                                                                         'org.freedesktop.Gypsy.Position').GetPosition)
         # From Python doc: The precision determines the number of digits after the decimal point and defaults to 6.
         # A difference of the sixth digit in lat/long leads to a difference of under a meter of precision.
         # Thus 6 is good enough.
@@ -767,7 +1216,9 @@ class Gps:
         valid = True
         if fields != 7:
             valid = False
-        (fields, pdop, hdop, vdop) = self._dbusobj.GetAccuracy(dbus_interface='org.freedesktop.Gypsy.Accuracy')
+        (fields, pdop, hdop, vdop) = self.get_cached('accuracy',
+                                                     dbus.Interface(self._dbusobj,
+                                                                    'org.freedesktop.Gypsy.Accuracy').GetAccuracy)
         logging.debug('GPS accuracy: fields (%d), pdop (%g), hdop (%g), vdop (%g)'
                       % (fields, pdop, hdop, vdop))
         if fields != 7:
@@ -782,8 +1233,13 @@ class Gps:
         return valid, tstamp, lat, lng, alt, pdop, hdop, vdop
         
     def get_course(self):
-        """Return validity boolean, speed in knots, heading in decimal degree."""
-        (fields, tstamp, speed, heading, climb) = self._dbusobj.GetCourse(dbus_interface='org.freedesktop.Gypsy.Course')
+        """Return validity boolean, speed in knots, heading in decimal degree.
+
+        Values come from the Gypsy signals cache, Gypsy is polled only if they are stale.
+        """
+        (fields, tstamp, speed, heading, climb) = self.get_cached('course',
+                                                                  dbus.Interface(self._dbusobj,
+                                                                                 'org.freedesktop.Gypsy.Course').GetCourse)
         logging.debug('GPS course: fields (%d), speed (%f), heading (%f)'
                       % (fields, speed, heading))
         if (fields & (1 << 0)) and (fields & (1 << 1)):
@@ -792,7 +1248,7 @@ class Gps:
 
 
 class ObmLogger():
-    # Lock to access the OBM logs files
+    # Lock serialising the uploads of the OBM logs files
     fileToSendLock = threading.Lock()
     APP_HOME_DIR = os.path.join(os.environ['HOME'], '.openBmap')
     TEMP_LOG_FILENAME = os.path.join(APP_HOME_DIR,
@@ -800,6 +1256,15 @@ class ObmLogger():
     CONFIGURATION_FILENAME = os.path.join(APP_HOME_DIR,
                                           'openBmap.conf')
     PLUGINS_RELATIVE_PATH = "plugins"
+    # GSM data, as returned by get_gsm_data(), when none has been read
+    NO_GSM_DATA = (False, ('', '', '', '', 0, '', '', ''), ())
+    # LOG_STORAGE_FORMAT config value -> log files format
+    LOG_STORAGE_FORMATS = {'xml': xmllog.XmlFormat,
+                           'binary': binlog.BinaryFormat}
+    # LOG_COMPRESSION and UPLOAD_COMPRESSION config values
+    COMPRESSIONS = ['none', 'gzip']
+    # LOG_PACKING config values
+    PACKINGS = ['none', 'containers']
 
     def __init__(self):
         self.XML_LOG_VERSION = 'V2'
@@ -815,11 +1280,44 @@ class ObmLogger():
         self.SCAN_SPEED_DEFAULT = 'OpenBmap logger default scanning speed (in sec.)'
         self.MIN_SPEED_FOR_LOGGING = 'GPS minimal speed for logging (km/h)'
         self.MAX_SPEED_FOR_LOGGING = 'GPS maximal speed for logging (km/h)'
+        # the scanning interval adapts to the speed, in order to scan every SCAN_DISTANCE,
+        # but stays between MIN_SCAN_INTERVAL and MAX_SCAN_INTERVAL. SCAN_SPEED_DEFAULT is the
+        # delay before the first scan.
+        self.MIN_SCAN_INTERVAL = 'Minimal scanning interval (in sec.)'
+        self.MAX_SCAN_INTERVAL = 'Maximal scanning interval (in sec.)'
+        self.SCAN_DISTANCE = 'Distance between scans (in m)'
+        # neighbour cells displayed are cached per serving cell (the ones logged are always queried),
+        # for NEIGHBOUR_CACHE_TTL (0 disables the cache),
+        # as long as we stay within NEIGHBOUR_CACHE_DISTANCE. The display is only refreshed from
+        # the cache when not logging, thus the cache hits/misses logged stay low.
+        self.NEIGHBOUR_CACHE_TTL = 'Neighbour cells cache duration (in sec.)'
+        self.NEIGHBOUR_CACHE_DISTANCE = 'Neighbour cells cache invalidation distance (in m)'
         # NB_OF_LOGS_PER_FILE is considered for writing of log to disk only if MAX_LOGS_FILE_SIZE <= 0
         self.NB_OF_LOGS_PER_FILE = 'Number of logs per file'
         # puts sth <=0 to MAX_LOGS_FILE_SIZE to ignore it and let other conditions trigger
         # the write of the log to disk (e.g. NB_OF_LOGS_PER_FILE)
         self.MAX_LOGS_FILE_SIZE = 'Maximal size of log files to be uploaded (kbytes)'
+        # log files are finished once MAX_LOGS_FILE_AGE old, whatever their size. Put sth <=0 to ignore it.
+        self.MAX_LOGS_FILE_AGE = 'Maximal age of log files (in sec.)'
+        # the log file being written (journal) is fsync'ed every JOURNAL_SYNC_SCANS scans and
+        # every JOURNAL_SYNC_PERIOD. Put 0 to disable a criterium.
+        self.JOURNAL_SYNC_SCANS = 'Journal synchronisation interval (in scans)'
+        self.JOURNAL_SYNC_PERIOD = 'Journal synchronisation period (in sec.)'
+        # log files can be stored locally in a compact binary format, converted to XML when uploaded
+        self.LOG_STORAGE_FORMAT = 'Log files storage format (xml, binary)'
+        # log files can be compressed once finished, and the uploads can be compressed.
+        # MAX_LOGS_FILE_SIZE applies to the uncompressed XML.
+        self.LOG_COMPRESSION = 'Log files compression (none, gzip)'
+        self.UPLOAD_COMPRESSION = 'Upload compression (none, gzip)'
+        # finished log files can be packed in one container file per MCC (see container.py)
+        # instead of being stored as separate files
+        self.LOG_PACKING = 'Log files packing (none, containers)'
+        # log files are uploaded by UPLOAD_WORKERS parallel connections
+        self.UPLOAD_WORKERS = 'Number of parallel uploads'
+        # a failed upload is retried after UPLOAD_RETRY_DELAY, doubled at every attempt. After
+        # UPLOAD_MAX_ATTEMPTS refused by the server, the log file is moved to the quarantine.
+        self.UPLOAD_MAX_ATTEMPTS = 'Maximal upload attempts'
+        self.UPLOAD_RETRY_DELAY = 'Upload retry delay (in sec.)'
         self.APP_LOGGING_LEVEL = 'Application logging level (debug, info, warning, error, critical)'
         self.LIST_OF_ACTIVE_PLUGINS = 'List of active plugins (try to load them at startup)'
 
@@ -827,6 +1325,45 @@ class ObmLogger():
         self.OBM_LOGIN = 'OpenBmap login'
         self.OBM_PASSWORD = 'OpenBmap password'
 
+        # the typed configuration snapshot (see Config.get_snapshot()) has one attribute per option,
+        # named after the attribute holding the option name, e.g. snapshot.MAX_SPEED_FOR_LOGGING
+        self.INT_OPTIONS = ['SCAN_SPEED_DEFAULT',
+                            'MIN_SPEED_FOR_LOGGING',
+                            'MAX_SPEED_FOR_LOGGING',
+                            'MIN_SCAN_INTERVAL',
+                            'MAX_SCAN_INTERVAL',
+                            'SCAN_DISTANCE',
+                            'NEIGHBOUR_CACHE_TTL',
+                            'NEIGHBOUR_CACHE_DISTANCE',
+                            'NB_OF_LOGS_PER_FILE',
+                            'MAX_LOGS_FILE_SIZE',
+                            'MAX_LOGS_FILE_AGE',
+                            'JOURNAL_SYNC_SCANS',
+                            'JOURNAL_SYNC_PERIOD',
+                            'UPLOAD_WORKERS',
+                            'UPLOAD_MAX_ATTEMPTS',
+                            'UPLOAD_RETRY_DELAY']
+        self.CONFIG_SCHEMA = [(name, self.GENERAL, getattr(self, name), int) for name in self.INT_OPTIONS] + \
+                             [('APP_LOGGING_LEVEL', self.GENERAL, self.APP_LOGGING_LEVEL, str.upper),
+                              ('LOG_STORAGE_FORMAT', self.GENERAL, self.LOG_STORAGE_FORMAT, str.lower),
+                              ('LOG_COMPRESSION', self.GENERAL, self.LOG_COMPRESSION, str.lower),
+                              ('UPLOAD_COMPRESSION', self.GENERAL, self.UPLOAD_COMPRESSION, str.lower),
+                              ('LOG_PACKING', self.GENERAL, self.LOG_PACKING, str.lower),
+                              ('LIST_OF_ACTIVE_PLUGINS', self.GENERAL, self.LIST_OF_ACTIVE_PLUGINS,
+                               parse_plugins_list)] + \
+                             [(name, self.GENERAL, getattr(self, name), str) for name in
+                              ['OBM_LOGS_DIR_NAME',
+                               'OBM_PROCESSED_LOGS_DIR_NAME',
+                               'OBM_UPLOAD_URL',
+                               'OBM_API_CHECK_URL',
+                               'OBM_API_VERSION']] + \
+                             [(name, self.CREDENTIALS, getattr(self, name), str) for name in
+                              ['OBM_LOGIN',
+                               'OBM_PASSWORD']]
+        # (section, option) -> (attribute name in the snapshot, parser)
+        self._configEntries = dict([((section, option), (name, parser)) for (name, section, option, parser) in
+                                    self.CONFIG_SCHEMA])
+
         # set default values if necessary
         config.set_config_if_not_exist([
                                         (self.GENERAL,[
@@ -846,10 +1383,40 @@ class ObmLogger():
                                                          0),
                                                         (self.MAX_SPEED_FOR_LOGGING,
                                                          150),
+                                                        (self.MIN_SCAN_INTERVAL,
+                                                         3), # in sec.
+                                                        (self.MAX_SCAN_INTERVAL,
+                                                         60), # in sec.
+                                                        (self.SCAN_DISTANCE,
+                                                         100), # in m
+                                                        (self.NEIGHBOUR_CACHE_TTL,
+                                                         10), # in sec.
+                                                        (self.NEIGHBOUR_CACHE_DISTANCE,
+                                                         50), # in m
                                                         (self.NB_OF_LOGS_PER_FILE,
                                                          3),
                                                         (self.MAX_LOGS_FILE_SIZE,
                                                          20),
+                                                        (self.MAX_LOGS_FILE_AGE,
+                                                         3600), # in sec.
+                                                        (self.JOURNAL_SYNC_SCANS,
+                                                         1),
+                                                        (self.JOURNAL_SYNC_PERIOD,
+                                                         0), # in sec.
+                                                        (self.LOG_STORAGE_FORMAT,
+                                                         'xml'),
+                                                        (self.LOG_COMPRESSION,
+                                                         'gzip'),
+                                                        (self.UPLOAD_COMPRESSION,
+                                                         'none'),
+                                                        (self.LOG_PACKING,
+                                                         'containers'),
+                                                        (self.UPLOAD_WORKERS,
+                                                         2),
+                                                        (self.UPLOAD_MAX_ATTEMPTS,
+                                                         5),
+                                                        (self.UPLOAD_RETRY_DELAY,
+                                                         60), # in sec.
                                                         (self.APP_LOGGING_LEVEL,
                                                          'info'),
                                                         (self.LIST_OF_ACTIVE_PLUGINS,
@@ -862,6 +1429,7 @@ class ObmLogger():
                                                              'your_password')
                                                             ])
                                         ])
+        config.set_schema(self.CONFIG_SCHEMA)
         if not self.validate_configuration():
             errMsg = "Configuration file could not be validated. See logs for details. Exiting..."
             logging.critical(errMsg)
@@ -888,54 +1456,106 @@ class ObmLogger():
 
         # is currently logging? Used to tell the thread to stop
         self._logging = False
+        # source id of the next log() call, as returned by gobject.timeout_add()
         self._loggingThread = None
+        # True while a scan waits for its GSM data, see scan()
+        self._scanPending = False
+        self._scanScheduler = scheduler.ScanScheduler(self.get_config_value(self.GENERAL, self.MIN_SCAN_INTERVAL),
+                                                      self.get_config_value(self.GENERAL, self.MAX_SCAN_INTERVAL),
+                                                      self.get_config_value(self.GENERAL, self.SCAN_DISTANCE))
         # This is a list of source ids, such as returned by gobject.idle_add(),
         # gobject.timeout_add()
         self._activePluginScheduledIds = []
 
         self._bus = self.init_dbus()
-        self._gsm = Gsm(self._bus)
+        self._gsm = Gsm(self._bus, ObmLogger.APP_HOME_DIR)
         self._gsm.register(self)
+        self._gsm.register_serving_cell_listener(self.serving_cell_changed)
+        self._gsm.set_neighbour_cache_parameters(self.get_config_value(self.GENERAL, self.NEIGHBOUR_CACHE_TTL),
+                                                 self.get_config_value(self.GENERAL, self.NEIGHBOUR_CACHE_DISTANCE))
         self._mcc = ""
+        # last GSM data read, as returned by get_gsm_data()
+        self._lastGsmData = self.NO_GSM_DATA
+        # time of the last GSM data read requested by get_gsm_data(), and whether it is not done yet
+        self._lastGsmRefresh = 0
+        self._gsmRefreshPending = False
         self._loggerLock = threading.Lock()
-        # we will store every log in this list, until writing it to a file:
-        self._logsInMemory = []
-        # _logsInMemory is a list of strings, which will be concatenated to write to disk
-        self._logsInMemoryLengthInByte = 0
         self._logFileHeader = "<?xml version=\"1.0\" encoding=\"UTF-8\"?>\n" + \
         "<logfile manufacturer=\"%s\" model=\"%s\" revision=\"%s\" swid=\"FSOnen1\" swver=\"%s\">\n" \
-        % ( self._gsm.get_device_info() + (self.SOFTWARE_VERSION,) )
+        % tuple([serializer.escape(value) for value in self._gsm.get_device_info() + (self.SOFTWARE_VERSION,)])
         self._logFileTail = '</logfile>'
+        # every scan is appended to the current log file (journal) as soon as it is formatted
+        logDir = self.get_config_value(self.GENERAL, self.OBM_LOGS_DIR_NAME)
+        # when packing, the finished log files go to the containers of this directory
+        self._containerDir = os.path.join(logDir, 'Packed')
+        # the log files rejected by the server are moved there
+        self._quarantineDir = os.path.join(logDir, 'Quarantine')
+        # digests of the contents uploaded, the log files found there are not sent again
+        self._uploadedHashes = hashindex.HashIndex(os.path.join(logDir, 'Uploaded.hashes'))
+        # state of the uploads, loaded by init_openBmap()
+        self._uploadManifest = manifest.UploadManifest(os.path.join(logDir, 'Uploads.manifest'),
+                                                       self.get_config_snapshot().UPLOAD_MAX_ATTEMPTS,
+                                                       self.get_config_snapshot().UPLOAD_RETRY_DELAY)
+        self._logWriter = logwriter.LogWriter(os.path.join(logDir, 'FSO_GSM'),
+                                              os.path.join(logDir, 'Journal'),
+                                              self.XML_LOG_VERSION,
+                                              self._logFileHeader,
+                                              self._logFileTail,
+                                              self.LOG_STORAGE_FORMATS[self.get_config_value(self.GENERAL,
+                                                                                             self.LOG_STORAGE_FORMAT)])
+        self.configure_log_writer(self.get_config_snapshot())
+        self._logWriter.set_publish_listener(lambda name: self._uploadManifest.add(manifest.make_key('FSO_GSM',
+                                                                                                     name)))
+        # From now on, self._logWriter is only used by the disk writer thread.
+        self._diskWriter = logwriter.BackgroundWriter(self._logWriter)
+        self._diskWriter.start()
+        # see Upload.post_multipart()
+        self._uploadStats = {}
+        # how long (in sec.) we wait for the disk writer to write the scans queued
+        self.DISK_WRITER_TIMEOUT = 30
+        # when not logging, how often (in sec.) at most get_gsm_data() reads new GSM data
+        self.GSM_REFRESH_PERIOD = 5
         
-        logLvl = self.get_config_value(self.GENERAL, self.APP_LOGGING_LEVEL)
-        logLvl = logging.__dict__[logLvl]
-        logging.getLogger().setLevel(logLvl)
-        logging.info('Application logging level set to %s' % logging.getLevelName(logLvl))
+        self.set_logging_level(self.get_config_snapshot())
+        # how often (in sec.) we check if the configuration file has been modified, see reload_configuration()
+        self.CONFIG_RELOAD_PERIOD = 5
 
         # DEBUG = True if you want to activate GPS/Web connection simulation
         self.DEBUG = False
         if self.DEBUG:
             self.get_gps_data = self.simulate_gps_data
+            self.get_gps_data_at = self.simulate_gps_data_at
             #self.get_gsm_data = self.simulate_gsm_data
 
-    def validate_configuration(self):
-        """Validates the config values. Returns True uppon success."""
+    def validate_configuration(self, configuration=None):
+        """Validates the config values (of configuration, by default the one used). Returns True uppon success."""
         section = self.GENERAL
 
-        for option in [self.SCAN_SPEED_DEFAULT,
-                      self.MIN_SPEED_FOR_LOGGING,
-                      self.MAX_SPEED_FOR_LOGGING,
-                      self.NB_OF_LOGS_PER_FILE,
-                      self.MAX_LOGS_FILE_SIZE]:
+        for option in [getattr(self, name) for name in self.INT_OPTIONS]:
             try:
-                self.get_config_value(section, option)
+                self.parse_config_value(section, option, configuration)
             except Exception, e:
                 logging.error('Validation of configuration failed for (%s, %s): %s. It should be an integer.' %
                               (section, option, str(e)) )
                 return False
 
+        for (option, choices) in [(self.LOG_STORAGE_FORMAT, self.LOG_STORAGE_FORMATS.keys()),
+                                  (self.LOG_COMPRESSION, self.COMPRESSIONS),
+                                  (self.UPLOAD_COMPRESSION, self.COMPRESSIONS),
+                                  (self.LOG_PACKING, self.PACKINGS)]:
+            try:
+                res = self.parse_config_value(section, option, configuration)
+                if not res in choices:
+                    logging.error('%s should be one of %s. Found: %s' %
+                                  (option, ', '.join(choices), res))
+                    return False
+            except Exception, e:
+                logging.error('Validation of configuration failed for (%s, %s): %s.' %
+                                  (section, option, str(e)) )
+                return False
+
         try:
-            res = self.get_config_value(section, self.APP_LOGGING_LEVEL)
+            res = self.parse_config_value(section, self.APP_LOGGING_LEVEL, configuration)
             if not res in ['DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL']:
                 logging.error('Application logging level should be one of'\
                               ' DEBUG, INFO, WARNING, ERROR, CRITICAL.'\
@@ -946,30 +1566,121 @@ class ObmLogger():
                               (section, self.APP_LOGGING_LEVEL, str(e)) )
             return False
 
+        try:
+            self.parse_config_value(section, self.LIST_OF_ACTIVE_PLUGINS, configuration)
+        except Exception, e:
+            logging.error('Validation of configuration failed for (%s, %s): %s.' %
+                              (section, self.LIST_OF_ACTIVE_PLUGINS, str(e)) )
+            return False
+
         return True
 
     def get_config_value(self, section, option):
         """Returns the value, under the expected form (string, int, etc.).
 
+        The values of the options of CONFIG_SCHEMA come from the configuration snapshot. Hot paths
+        should rather read the attributes of get_config_snapshot().
         See validate_configuration() method for expected values format.
         """
-        if option in [self.SCAN_SPEED_DEFAULT,
-                      self.MIN_SPEED_FOR_LOGGING,
-                      self.MAX_SPEED_FOR_LOGGING,
-                      self.NB_OF_LOGS_PER_FILE,
-                      self.MAX_LOGS_FILE_SIZE]:
-            return config.getint(section, option)
-
-        elif option in [self.APP_LOGGING_LEVEL]:
-            return str.upper(config.get(section, option))
-
-        else:
-            return config.get(section, option)
+        entry = self._configEntries.get((section, option))
+        if entry != None:
+            return getattr(config.get_snapshot(), entry[0])
+        return config.get(section, option)
+
+    def parse_config_value(self, section, option, configuration=None):
+        """Returns the value, parsed from configuration (by default the one used), not from the snapshot."""
+        if configuration == None:
+            configuration = config
+        entry = self._configEntries.get((section, option))
+        if entry == None:
+            return configuration.get(section, option)
+        return entry[1](configuration.get(section, option))
+
+    def get_config_snapshot(self):
+        """Returns the typed configuration snapshot, see Config.get_snapshot() and CONFIG_SCHEMA."""
+        return config.get_snapshot()
 
     def get_config(self):
         """Gets the config object used."""
         return config
 
+    def set_logging_level(self, snapshot):
+        """Sets the application logging level of the configuration snapshot."""
+        logLvl = logging.__dict__[snapshot.APP_LOGGING_LEVEL]
+        logging.getLogger().setLevel(logLvl)
+        logging.info('Application logging level set to %s' % logging.getLevelName(logLvl))
+
+    def configure_log_writer(self, snapshot):
+        """Applies the log files settings of the configuration snapshot to the log writer.
+
+        Once the disk writer is started, this must run in its thread (see BackgroundWriter.call()).
+        The log files already open keep their format, the scans they contain are kept.
+        """
+        self._logWriter.set_format(self.LOG_STORAGE_FORMATS[snapshot.LOG_STORAGE_FORMAT])
+        if snapshot.LOG_PACKING == 'containers':
+            self._logWriter.set_container_dir(self._containerDir)
+        else:
+            self._logWriter.set_container_dir(None)
+        self._logWriter.set_sync_policy(snapshot.JOURNAL_SYNC_SCANS, snapshot.JOURNAL_SYNC_PERIOD)
+        self._logWriter.set_compression(snapshot.LOG_COMPRESSION == 'gzip')
+        self._logWriter.set_rotation(snapshot.MAX_LOGS_FILE_SIZE * 1024,
+                                     max(1, snapshot.NB_OF_LOGS_PER_FILE),
+                                     snapshot.MAX_LOGS_FILE_AGE)
+
+    def reload_configuration(self):
+        """Reloads the configuration file if it has been modified, and applies the new values.
+
+        Called periodically from the main loop. If the new file cannot be validated, the current
+        configuration is kept. Always returns True.
+        """
+        previous = self.get_config_snapshot()
+        try:
+            if not config.reload(self.validate_configuration):
+                return True
+        except Exception, e:
+            logging.error('Unable to reload the configuration file: %s' % str(e))
+            return True
+        logging.info('Configuration file modified, reloaded.')
+        self.apply_configuration(previous, self.get_config_snapshot())
+        return True
+
+    def apply_configuration(self, previous, current):
+        """Applies the values of the current configuration snapshot which differ from the previous one."""
+        if current.APP_LOGGING_LEVEL != previous.APP_LOGGING_LEVEL:
+            self.set_logging_level(current)
+        self._gsm.set_neighbour_cache_parameters(current.NEIGHBOUR_CACHE_TTL, current.NEIGHBOUR_CACHE_DISTANCE)
+        self._uploadManifest.set_policy(current.UPLOAD_MAX_ATTEMPTS, current.UPLOAD_RETRY_DELAY)
+        # the scans already queued are written with the previous settings
+        self._diskWriter.put(lambda: self.configure_log_writer(current))
+        self.apply_scan_configuration(previous, current)
+
+        for name in ['OBM_LOGS_DIR_NAME', 'OBM_PROCESSED_LOGS_DIR_NAME', 'LIST_OF_ACTIVE_PLUGINS']:
+            if getattr(current, name) != getattr(previous, name):
+                logging.warning('Modification of \'%s\' will be taken into account at next start.' %
+                                getattr(self, name))
+
+    def apply_scan_configuration(self, previous, current):
+        """Applies the scanning interval settings, retries later if the OBM logger is locked. Returns False."""
+        if not self._loggerLock.acquire(False):
+            logging.info('OBM logger currently locked. Will retry applying the scanning settings later.')
+            gobject.idle_add(self.apply_scan_configuration, previous, current)
+            return False
+        logging.debug('OBM logger locked by apply_scan_configuration().')
+        self._scanScheduler.set_parameters(current.MIN_SCAN_INTERVAL,
+                                           current.MAX_SCAN_INTERVAL,
+                                           current.SCAN_DISTANCE)
+        if ((current.MIN_SCAN_INTERVAL, current.MAX_SCAN_INTERVAL, current.SCAN_DISTANCE) !=
+            (previous.MIN_SCAN_INTERVAL, previous.MAX_SCAN_INTERVAL, previous.SCAN_DISTANCE) and
+            self._logging and self._loggingThread != None and not self._scanPending):
+            delay = self._scanScheduler.reschedule(time.time(), self._gps_speed_for_scheduling())
+            if delay != None:
+                gobject.source_remove(self._loggingThread)
+                self._loggingThread = gobject.timeout_add(int(delay * 1000), self.log)
+                logging.info('Scanning interval changed, next logging loop scheduled in %.1f seconds.' % delay)
+        self._loggerLock.release()
+        logging.debug('OBM logger lock released by apply_scan_configuration().')
+        return False
+
     def request_resource(self, resource):
         """Requests the given string resource through /org/freesmartphone/Usage."""
         obj = self._bus.get_object('org.freesmartphone.ousaged', '/org/freesmartphone/Usage')
@@ -996,175 +1707,40 @@ class ObmLogger():
         self.write_obm_log(str(datetime.now()), 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12)
     
     def write_obm_log(self, date, tstamp, servingCell, lng, lat, alt, spe, heading, hdop, vdop, pdop, neighbourCells):
-        """Format and stores in memory given data, possibly triggers writing in log file."""
-        # log format, for release 0.2.0
-        # "<gsm mcc=\"%s\" mnc=\"%s\" lac=\"%s\" id=\"%s\" ss=\"%i\"/>" % servingCell[:5]
-        logmsg = "<scan time=\"%s\">" % date + \
-        "<gsmserving mcc=\"%s\" mnc=\"%s\" lac=\"%s\" id=\"%s\" ss=\"%i\" act=\"%s\"" % servingCell[:6]
-        if servingCell[6] != "":
-            logmsg += " tav=\"%s\"" % servingCell[6]
-        else:
-            logging.debug("No timing advance available for serving cell, skip it.")
-        if servingCell[7] != "":
-            logmsg += " rxlev=\"%s\"" % servingCell[7]
-        else:
-            logging.debug("No rxlev available for serving cell, skip it.")
-        logmsg += "/>"
-         
-        
-        for cell in neighbourCells:
-            # the best answer we could get was: it is highly probable that the neighbour cells have
-            # the same MCC and MNC as the serving one, but this is not absolutely sure.
-            logmsg += "<gsmneighbour mcc=\"%s\" mnc=\"%s\" lac=\"%s\"" % (servingCell[:2] + (cell['lac'],)) +\
-            " id=\"%s\"" % cell['cid'] + \
-            " rxlev=\"%i\"" % cell['rxlev'] + \
-            " c1=\"%i\"" % cell['c1'] + \
-            " c2=\"%i\"" % cell['c2'] + \
-            "/>"
-            #" ctype=\"%s\"" % cell['ctype'] + \
-
-        logmsg += self.format_gps_data_for_xml_log(
-                                                   (True,
-                                                    tstamp,
-                                                    lat,
-                                                    lng,
-                                                    alt,
-                                                    pdop,
-                                                    hdop,
-                                                    vdop,
-                                                    spe,
-                                                    heading)
-                                                   )
-        logmsg += "</scan>\n"
-        logging.info(logmsg)
-        self.fileToSendLock.acquire()
-        logging.info('OpenBmap log file lock acquired by write_obm_log.')
+        """Queues given data for writing in the log file, see serializer.serialize_scan() for the format."""
+        record = xmllog.ScanRecord(date, tstamp, servingCell, lng, lat, alt, spe, heading, hdop, vdop, pdop,
+                                   neighbourCells)
+        logging.debug('Scan to log: %s' % (record,))
         #debug
-        #self._gsm._call_ongoing = True
+        #self._gsm.publish_state(callOngoing = True)
         #end of debug
         if self._gsm.call_ongoing():
             # see comments in log() about not logging in a call.
             logging.info('write_obm_log() canceled because a call is ongoing.')
-            self.fileToSendLock.release()
-            logging.info('OpenBmap log file lock released.')
             return
 
-        maxLogsFileSize = self.get_config_value(self.GENERAL, self.MAX_LOGS_FILE_SIZE) * 1024
-
-        if ( maxLogsFileSize > 0 ):
-            # we use the max log file size as criterium to trigger write of file
-            
-            # we write ascii file, that is to say, one byte per character
-            fileLengthInByte = len(self._logFileHeader) + len(logmsg) \
-            + self._logsInMemoryLengthInByte + len(self._logFileTail)
-
-            if (fileLengthInByte <= maxLogsFileSize):
-                logging.debug('Current size of logs in memory %i bytes, max size of log files is %i bytes.'
-                              % (fileLengthInByte, maxLogsFileSize))
-            else:
-                self.write_gsm_log_to_disk_unprotected()
-            self._logsInMemory.append(logmsg)
-            self._logsInMemoryLengthInByte += len(logmsg)
-        else:
-            self._logsInMemory.append(logmsg)
-            self._logsInMemoryLengthInByte += len(logmsg)
-            if len(self._logsInMemory) < self.get_config_value(self.GENERAL, self.NB_OF_LOGS_PER_FILE):
-                logging.debug('Max logs per file (%i/%i) not reached, wait to write to a file.'
-                              % (len(self._logsInMemory), self.get_config_value(self.GENERAL, self.NB_OF_LOGS_PER_FILE)))
-            else:
-                self.write_gsm_log_to_disk_unprotected()
-
-        self.fileToSendLock.release()
-        logging.info('OpenBmap log file lock released.')
+        # the formatting and disk I/O are done by the writer thread, we only block if its queue is full
+        self._diskWriter.write(servingCell[0], record)
 
     def format_gps_data_for_xml_log(self, gpsData):
         """Receives GPS data as parameter, returns an XML formated string for log file.
 
-        gpsData follows the return type of get_gps_data():
-        validity boolean, time stamp, lat, lng, alt, pdop, hdop, vdop, speed in km/h, heading."""
-
-        # From Python doc: %f -> The precision determines the number of digits after the decimal point and defaults to 6.
-        # A difference of the sixth digit in lat/long leads to a difference of under a meter of precision.
-        # Maximum error by rounding is 5. GPS precision is at best 10m. 2 x (maxError x error) = 2 x (5 x 1)
-        # introduces an error of 10m! Thus we settle to 9.
-        latLonPrecision = 9
-        # http://gpsd.berlios.de/gpsd.html:
-        # Altitude determination is more sensitive to variability to atmospheric signal lag than latitude/longitude,
-        # and is also subject to errors in the estimation of local mean sea level; base error is 12 meters at 66%
-        # confidence, 23 meters at 95% confidence. Again, this will be multiplied by a vertical dilution of
-        # precision (VDOP).
-        # Altitude is in meter.
-        altitudePrecision = 1
-        # speed is in km/h.
-        speedPrecision = 3
-        # Precision of 2 digits after the decimal point for h/p/v-dop is enough.
-        hvpdopPrecision = 2
-        # heading in decimal degrees
-        headingPrecision = 9
-
-        return (
-                "<gps time=\"%s\"" % time.strftime('%Y%m%d%H%M%S', time.gmtime(gpsData[1])) + \
-                " lng=\"%s\"" % ( ('%.*f' % (latLonPrecision, gpsData[3])).rstrip('0').rstrip('.') ) + \
-                " lat=\"%s\"" % ( ('%.*f' % (latLonPrecision, gpsData[2])).rstrip('0').rstrip('.') ) + \
-                " alt=\"%s\"" % ( ('%.*f' % (altitudePrecision, gpsData[4])).rstrip('0').rstrip('.') ) + \
-                " hdg=\"%s\"" % ( ('%.*f' % (headingPrecision, gpsData[9])).rstrip('0').rstrip('.') ) + \
-                " spe=\"%s\"" % ( ('%.*f' % (speedPrecision, gpsData[8])).rstrip('0').rstrip('.') ) + \
-                " hdop=\"%s\"" % ( ('%.*f' % (hvpdopPrecision, gpsData[6])).rstrip('0').rstrip('.') ) + \
-                " vdop=\"%s\"" % ( ('%.*f' % (hvpdopPrecision, gpsData[7])).rstrip('0').rstrip('.') ) + \
-                " pdop=\"%s\"" % ( ('%.*f' % (hvpdopPrecision, gpsData[5])).rstrip('0').rstrip('.') ) + \
-                "/>"
-                )
+        gpsData follows the return type of get_gps_data(). See serializer.format_gps_data()."""
+        return serializer.format_gps_data(gpsData)
 
     def write_obm_log_to_disk(self):
-        """Gets the Lock and then calls write_gsm_log_to_disk_unprotected()."""
-        self.fileToSendLock.acquire()
-        logging.info('OpenBmap log file lock acquired by write_obm_log_to_disk().')
-        self.write_gsm_log_to_disk_unprotected()
-        self.fileToSendLock.release()
-        logging.info('OpenBmap log file lock released by write_obm_log_to_disk().')
-
-    def write_gsm_log_to_disk_unprotected(self):
-        """Takes the logs already formatted in memory and write them to disk. Clears the log in memory.
-
-        Warning: this method is not protected by a Lock!
-        """
-
-        if len(self._logsInMemory) == 0:
-            logging.info('No log to write to disk, returning.')
-            return
-
-        now = datetime.now()
-        #"yyyyMMddHHmmss"
-        date = now.strftime("%Y%m%d%H%M%S")
-
-        logDir = self.get_config_value(self.GENERAL, self.OBM_LOGS_DIR_NAME)
-        logDir = os.path.join(logDir, "FSO_GSM")
-        if (not os.path.exists(logDir)):
-            os.mkdir(logDir)
-
-        # at the moment: log files follow: logYYYYMMDDhhmmss.xml
-        # log format, for release 0.2.0
-        # filename = os.path.join(logDir, 'log' + date + '.xml')
-        # new filename format VX_MCC_logYYYYMMDDhhmmss.xml
-        mcc = self._logsInMemory[0]
-        # len('mcc="') = 5
-        mcc = mcc[mcc.find("mcc=") + 5 : ]
-        mcc = mcc[ : mcc.find('"')]
-        filename = os.path.join(logDir, self.XML_LOG_VERSION + '_' + mcc + '_log' + date + '.xml')
-        logmsg = self._logFileHeader
-        for log in self._logsInMemory:
-            logmsg += log
-        #TODO: escaped characters wich would lead to malformed XML document (e.g. '"')
-        logmsg += self._logFileTail
-        logging.debug('Write logs to file: %s' % logmsg)
-        try:
-            file = open(filename, 'w')
-            file.write(logmsg)
-            file.close()
-            self._logsInMemory[:] = []
-            self._logsInMemoryLengthInByte = 0
-        except Exception, e:
-            logging.error("Error while writing GSM/GPS log to file: %s" % str(e))
+        """Finishes the current log file, thus it can be uploaded. Waits for the disk writer."""
+        self._diskWriter.finish()
+        if not self._diskWriter.barrier(self.DISK_WRITER_TIMEOUT):
+            logging.error('Log file could not be finished in time.')
+
+    def get_disk_writer_stats(self):
+        """Returns the disk writer counters dictionary, see logwriter.BackgroundWriter.get_counters()."""
+        result = self._diskWriter.get_counters()
+        result['syncs'] = self._logWriter.get_nb_syncs()
+        # bytes 'published', 'stored' on disk and 'saved' by compression
+        result.update(self._logWriter.get_stats())
+        return result
 
     def write_generic_log_file_to_disk(self, plugin_name, file_name, content):
         """Generic method to write given content, into corresponding path and file.
@@ -1180,72 +1756,172 @@ class ObmLogger():
             absolute_filename = os.path.join(logDir, plugin_name)
             absolute_filename = os.path.join(absolute_filename, file_name)
             try:
-                targetFile = open(absolute_filename, 'w')
+                # the uploads skip the file until it is complete
+                targetFile = open(absolute_filename + logwriter.JOURNAL_SUFFIX, 'w')
                 targetFile.write(content)
                 targetFile.close()
+                os.rename(absolute_filename + logwriter.JOURNAL_SUFFIX, absolute_filename)
                 logging.info("writen '%s' targetFile on disk", absolute_filename)
             except Exception, e:
                 logging.error("Error while writing generic log targetFile to disk: %s" % str(e))
 
-    def send_logs(self):
-        """Try uploading available log files to OBM database.
-        
-        Returns (b, i, i):
+    def send_logs(self, callback):
+        """Starts uploading the available log files to OBM database, in a thread.
+
+        Once done, callback(b, i, i) is called from the main loop:
         True if nothing wrong happened.
         The total number of successfully uploaded files.
         The total number of files available for upload.
+        Returns False if an upload is already running (callback will not be called).
         """
+        if not self.fileToSendLock.acquire(False):
+            logging.warning('An upload is already running.')
+            return False
+        logging.info('OpenBmap upload lock acquired by send_logs.')
+        # the scans go on in the main loop while we upload
+        thread = threading.Thread(target=self.upload_logs, args=(callback,), name='Upload')
+        thread.setDaemon(True)
+        thread.start()
+        return True
+
+    def upload_logs(self, callback):
+        """Uploads the log files, called by send_logs() in its thread with fileToSendLock held."""
+        result = (False, 0, 0)
+        try:
+            result = self.upload_session()
+        finally:
+            self.fileToSendLock.release()
+            logging.info('OpenBmap upload lock released.')
+            gobject.idle_add(callback, *result)
+
+    def upload_session(self):
+        """Uploads the available log files. Returns (b, i, i), see send_logs()."""
         totalFilesToUpload = 0
         totalFilesUploaded = 0
         result = True
         
-        # to store the data once sent:
-        dirProcessed = os.path.join(self.get_config_value(self.GENERAL, self.OBM_PROCESSED_LOGS_DIR_NAME))
-        logsDir = self.get_config_value(self.GENERAL, self.OBM_LOGS_DIR_NAME)
-        logsDir = os.path.join(logsDir, "FSO_GSM")
-        
-        self.fileToSendLock.acquire()
-        logging.info('OpenBmap log file lock acquired by send_logs.')
+        snapshot = self.get_config_snapshot()
+        # uploads are serialised, but do not hold the scans writing: the log files are only
+        # renamed into the upload directory (or packed) once complete. We just wait for the scans already queued.
+        self._diskWriter.barrier(self.DISK_WRITER_TIMEOUT)
+        client = None
         try:
             if not self.check_obm_api_version():
                 logging.error('We do not support the server API version,' + \
                               'do you have the latest version of the software?')
                 return (False, -1, -1)
-            os.chdir(logsDir)
-            for f in os.listdir(logsDir):
-                totalFilesToUpload += 1
-                logging.info('Try uploading \'%s\'' % f)
-                fileRead = open(f, 'r')
-                content = fileRead.read()
-                fileRead.close()
-                (status, reason, resRead) = Upload.post_url(self.get_config_value(self.GENERAL, self.OBM_UPLOAD_URL),
-                                                            [('openBmap_login', self.get_config_value(self.CREDENTIALS, self.OBM_LOGIN)),
-                                                            ('openBmap_passwd', self.get_config_value(self.CREDENTIALS, self.OBM_PASSWORD))],
-                                                            [('file', f, content)])
-                logging.debug('Upload response status:%s, reason:%s, body:%s' % (status, reason, resRead))
-                if resRead.startswith('Stored in'):
-                    newName = os.path.join(dirProcessed, f)
-                    os.rename(f, newName)
-                    logging.info('File \'%s\' successfully uploaded. Moved to \'%s\'. Thanks for contributing!' %
-                                 (f, newName))
-                    totalFilesUploaded += 1
-                elif resRead.strip(' ').endswith('already exists.'):
-                    # We assume the file has already been uploaded...
-                    newName = os.path.join(dirProcessed, f)
-                    os.rename(f, newName)
-                    logging.info('File \'%s\' probably already uploaded. Moved to \'%s\'. Thanks for contributing!' %
-                                 (f, newName))
-                else:
-                    logging.error('Unable to upload file \'%s\'. Err: %d/%s: %s' % (f, status, reason, resRead))
+            compressUpload = snapshot.UPLOAD_COMPRESSION == 'gzip'
+            nbSkipped = 0
+            # the workers share the keep-alive connections
+            client = Upload.UploadClient(urlparse.urlsplit(snapshot.OBM_UPLOAD_URL)[1],
+                                         maxIdle=snapshot.UPLOAD_WORKERS)
+            jobs = self.list_upload_jobs(snapshot)
+            self._uploadManifest.sync([job.key for job in jobs])
+            # the failed uploads are retried once their delay has elapsed
+            now = time.time()
+            jobs = [job for job in jobs if self._uploadManifest.is_due(job.key, now)]
+            totalFilesToUpload = len(jobs)
+            logging.info('Upload of %(pending)i log files, %(waiting)i of them wait for a retry, '
+                         '%(rejected)i in quarantine.' % self._uploadManifest.get_counts(now))
+            engine = uploader.ParallelUploader(lambda name, content: self.post_log(client, name, content,
+                                                                                   compressUpload),
+                                               snapshot.UPLOAD_WORKERS,
+                                               self._uploadManifest,
+                                               self._quarantineDir,
+                                               self._uploadedHashes)
+            engine.start(jobs)
+            engine.wait()
+            for res in engine.get_results():
+                logging.debug('Upload of \'%s\': %s in %.3f sec.' % (res.name, res.answer, res.duration))
+                if res.answer == None:
                     result = False
+                elif res.answer == 'stored':
+                    totalFilesUploaded += 1
+                elif res.answer == uploader.SKIPPED:
+                    nbSkipped += 1
+            if nbSkipped > 0:
+                logging.info('%i log files skipped, their content had already been uploaded.' % nbSkipped)
         except Exception, e:
             logging.error("Error while sending GSM/GPS logged data: %s" % str(e))
             return (False, totalFilesUploaded, totalFilesToUpload)
         finally:
-            self.fileToSendLock.release()
-            logging.info('OpenBmap log file lock released.')
+            if client != None:
+                client.close()
+                logging.info('Upload connections: %(requests)i requests, %(connections)i connections opened, '
+                             '%(reused)i reused (%(stale)i stale).' % client.get_counters())
+            # only the small side file is rewritten
+            self._uploadedHashes.save()
+            logging.info('Upload bytes sent: %(sent)i, %(saved)i saved by compression.' % self.get_upload_stats())
         return (result, totalFilesUploaded, totalFilesToUpload)
 
+    def list_upload_jobs(self, snapshot):
+        """Returns the log files to upload (uploader.FileJob or uploader.SliceJob).
+
+        They are the GSM log files, separate or packed in containers, and the log files of the plugins
+        (found in the logs directory, under the name of the plugin).
+        """
+        dirProcessed = snapshot.OBM_PROCESSED_LOGS_DIR_NAME
+        jobs = []
+        for (source, processedDir) in [("FSO_GSM", dirProcessed)] + \
+                                      [(pluginName, os.path.join(dirProcessed, pluginName))
+                                       for pluginName in snapshot.LIST_OF_ACTIVE_PLUGINS]:
+            dirName = os.path.join(snapshot.OBM_LOGS_DIR_NAME, source)
+            if not os.path.isdir(dirName):
+                continue
+            for f in sorted(os.listdir(dirName)):
+                # plugin log files being written
+                if not f.endswith(logwriter.JOURNAL_SUFFIX):
+                    jobs.append(uploader.FileJob(os.path.join(dirName, f), processedDir,
+                                                 manifest.make_key(source, f)))
+        # the log files packed in containers are extracted one by one
+        for logContainer in container.list_containers(self._containerDir):
+            for entry in logContainer.get_pending():
+                jobs.append(uploader.SliceJob(logContainer, entry, dirProcessed,
+                                              manifest.make_key("FSO_GSM", entry.name)))
+        return jobs
+
+    def post_log(self, client, filename, content, compressUpload):
+        """Uploads content, the XML content of the log file filename, with client (Upload.UploadClient).
+
+        content is a string, or an Upload.FilePart read in chunks while sent.
+
+        Returns 'stored', 'duplicate' if the server already had it, None if it refused this log file.
+        Raises httplib.HTTPException on server errors (HTTP 5xx), worth retrying, and
+        uploader.SessionError on any other answer (wrong URL or credentials, captive portal...).
+        """
+        uploadName = logwriter.get_xml_name(filename)
+        (status, reason, resRead) = client.post_url(self.get_config_value(self.GENERAL, self.OBM_UPLOAD_URL),
+                                                    [('openBmap_login', self.get_config_value(self.CREDENTIALS, self.OBM_LOGIN)),
+                                                    ('openBmap_passwd', self.get_config_value(self.CREDENTIALS, self.OBM_PASSWORD))],
+                                                    [('file', uploadName, content)],
+                                                    compressUpload,
+                                                    self._uploadStats)
+        logging.debug('Upload response status:%s, reason:%s, body:%s' % (status, reason, resRead))
+        if resRead.startswith('Stored in'):
+            logging.info('File \'%s\' successfully uploaded. Thanks for contributing!' % filename)
+            return 'stored'
+        elif resRead.strip(' ').endswith('already exists.'):
+            # We assume the file has already been uploaded...
+            logging.info('File \'%s\' probably already uploaded. Thanks for contributing!' % filename)
+            return 'duplicate'
+        if status >= 500:
+            raise httplib.HTTPException('Server error %d/%s: %s' % (status, reason, resRead))
+        if status in uploader.FILE_REJECTED_STATUSES:
+            logging.error('Unable to upload file \'%s\'. Err: %d/%s: %s' % (filename, status, reason, resRead))
+            return None
+        raise uploader.SessionError('Unexpected answer %d/%s: %s' % (status, reason, resRead[:200]))
+
+    def get_upload_counts(self):
+        """Returns the number of log files per upload state, see manifest.UploadManifest.get_counts()."""
+        return self._uploadManifest.get_counts()
+
+    def get_upload_stats(self):
+        """Returns a dictionary: 'body' bytes of the uploads, bytes 'sent' and 'saved' by compression."""
+        result = {'body': 0, 'sent': 0}
+        result.update(self._uploadStats)
+        result['saved'] = result['body'] - result['sent']
+        return result
+
     def delete_processed_logs(self):
         """Deletes all the files located in the 'processed' folder. Returns number deleted."""
         # no Lock used here, I don't see this needed for Processed logs...
@@ -1303,26 +1979,59 @@ class ObmLogger():
         if not os.path.exists(dirProcessed):
             logging.info('Directory for storing processed cell logs does not exists, creating \'%s\'' % dirProcessed)
             os.mkdir(dirProcessed)
+
+        # publishes the log files which were being written when we were stopped (crash, battery empty, etc.)
+        try:
+            recovered = self._diskWriter.call(self._logWriter.recover, self.DISK_WRITER_TIMEOUT)
+            if len(recovered) > 0:
+                logging.warning('%i log files recovered from the journal.' % len(recovered))
+        except Exception, e:
+            logging.error('Unable to recover the journal: %s' % str(e))
+
+        # packs the log files left separate by a previous version (or with packing disabled)
+        if self.get_config_snapshot().LOG_PACKING == 'containers':
+            try:
+                packed = self._diskWriter.call(lambda: container.compact(os.path.join(logDir, 'FSO_GSM'),
+                                                                         self._containerDir),
+                                               self.DISK_WRITER_TIMEOUT)
+                if packed > 0:
+                    logging.info('%i log files moved into containers.' % packed)
+            except Exception, e:
+                logging.error('Unable to move the log files into containers: %s' % str(e))
+
+        try:
+            self._uploadManifest.load()
+            self._uploadManifest.sync([job.key for job in self.list_upload_jobs(self.get_config_snapshot())])
+        except Exception, e:
+            logging.error('Unable to load the upload manifest: %s' % str(e))
             
         # request the current status. If we are connected we get the data now. Otherwise
         # we would need to wait for a signal update.
         self._gsm.get_status()
         
-        # check if we have no ongoing call...
-        self._gsm.call_status_handler(None)
+        # check if we have no ongoing call. Afterwards the calls are tracked
+        # from the CallStatus signals, ListCalls only double checks from time to time.
+        self._gsm.sync_calls()
+        gobject.timeout_add_seconds(self._gsm.CALLS_RECONCILIATION_PERIOD, self._gsm.sync_calls)
+        # the configuration file can be modified while we run
+        gobject.timeout_add_seconds(self.CONFIG_RELOAD_PERIOD, self.reload_configuration)
 
     def exit_openBmap(self):
         """Puts the logger in a nice state for exiting the application.
 
-        * Saves logs in memory if any."""
-        self.write_obm_log_to_disk()
+        * Finishes the current log file, and stops the disk writer.
+        * Saves the cells seen for the first time."""
+        self._diskWriter.stop(self.DISK_WRITER_TIMEOUT)
+        self._uploadManifest.close()
+        self._uploadedHashes.close()
+        self._gsm.save_seen_cells_index(True)
         self._gps.release()
         self.release_resource('CPU')
 
     def load_active_plugins(self):
         """Tries loading active plugins. Returns a list of successfully loaded pluging."""
         result = []
-        pluginsNames = eval(str(self.get_config_value(self.GENERAL, self.LIST_OF_ACTIVE_PLUGINS)))
+        pluginsNames = self.get_config_snapshot().LIST_OF_ACTIVE_PLUGINS
 
         for pluginName in pluginsNames:
             try:
@@ -1413,12 +2122,16 @@ class ObmLogger():
         return result
 
     def log(self):
+        """Does one scan if worth it, and schedules the next one. Always returns False.
+
+        See scheduler.ScanScheduler for the choice of the next scan time.
+        """
         logging.info("OpenBmap logger runs.")
         self._loggerLock.acquire()
         logging.debug('OBM logger locked by log().')
-        scanSpeed = self.get_config_value(self.GENERAL, self.SCAN_SPEED_DEFAULT)
-        minSpeed = self.get_config_value(self.GENERAL, self.MIN_SPEED_FOR_LOGGING)
-        maxSpeed = self.get_config_value(self.GENERAL, self.MAX_SPEED_FOR_LOGGING)
+        snapshot = self.get_config_snapshot()
+        minSpeed = snapshot.MIN_SPEED_FOR_LOGGING
+        maxSpeed = snapshot.MAX_SPEED_FOR_LOGGING
 
 
         startTime = datetime.now()
@@ -1450,51 +2163,159 @@ class ObmLogger():
             # described above.
             logging.info('Log canceled because a call is ongoing.')
         else:
-            (validGsm, servingCell, neighbourCells) = self.get_gsm_data()
+            # cheap checks first (cached GPS data, last GSM data received through signals),
+            # in order to avoid the D-Bus queries if the scan is not worth it.
+            # This also gets a fix just before reading GSM data, in case Gypsy signals are stale.
             (validGps, tstamp, lat, lng, alt, pdop, hdop, vdop, spe, heading) = self.get_gps_data()
+            (scan, reason) = self._scanScheduler.should_scan(time.time(), validGps, spe, lat, lng,
+                                                             self._gsm.get_serving_cell(), minSpeed)
+            if scan:
+                # the logging loop is ended by scan() once GSM data has been read
+                self.scan(adate2, minSpeed, maxSpeed, startTime)
+                return False
+            logging.info('Scan avoided: %s.' % reason)
+            self.notify_observers()
+        self.end_logging_loop(startTime)
+        # the next call, if any, has been scheduled with its own delay
+        return False
+
+    def end_logging_loop(self, startTime):
+        """Ends the logging loop started at startTime by log(), schedules the next one.
 
-            duration = datetime.now() - startTime
-            timeLimitToGetData = 2
+        Must be called with the OBM logger lock held, releases it.
+        """
+        duration = datetime.now() - startTime
+        logging.info("Logging loop ended, total duration: %i sec." % duration.seconds)
 
-            if (duration.seconds > timeLimitToGetData):
-                #to be sure to keep data consistent, we need to grab all the info in a reasonable amount
-                # of time. At 50 km/h, you go about 15 m / second.
-                # Thus you should spend only little time to grab everything you need.
-                logging.warning('Log rejected because getting data took %i second(s), limit is %i second(s)'
-                             % (duration.seconds, timeLimitToGetData))
-            elif spe < minSpeed:
+        if not self._logging:
+            logging.info('Logging loop is stopping.')
+            self._loggingThread = None
+            self.set_current_remember_cells_structure_id()
+            self._gsm.save_seen_cells_index()
+            self.log_stats()
+        else:
+            delay = self._scanScheduler.next_delay(time.time(), self._gps_speed_for_scheduling())
+            self._loggingThread = gobject.timeout_add(int(delay * 1000), self.log)
+            logging.info('Next logging loop scheduled in %.1f seconds.' % delay)
+        self._loggerLock.release()
+        logging.debug('OBM logger lock released by log().')
+
+    def _gps_speed_for_scheduling(self):
+        """Returns the current speed in km/h, -1 if unknown."""
+        (valid, tstamp, lat, lng, alt, pdop, hdop, vdop, spe, heading) = self.get_gps_data()
+        if valid:
+            return spe
+        return -1
+
+    def scan(self, date, minSpeed, maxSpeed, startTime):
+        """Reads GSM data and the matching GPS position, and logs them if valid.
+
+        Must be called with the OBM logger lock held by the logging loop started at startTime.
+        The lock is released while waiting for the GSM data (the main loop goes on meanwhile,
+        see Gsm.query_monitoring_data()), then the loop is ended (see end_logging_loop()).
+        """
+        self._scanPending = True
+        self._loggerLock.release()
+        logging.debug('OBM logger lock released while reading GSM data.')
+        gsmStartTime = time.time()
+        def gsm_data_read(validGsm, servingCell, neighbourCells):
+            self._loggerLock.acquire()
+            logging.debug('OBM logger locked by scan(), GSM data read.')
+            self._scanPending = False
+            try:
+                self.log_scan(date, minSpeed, maxSpeed, gsmStartTime, validGsm, servingCell, neighbourCells)
+            except Exception, e:
+                logging.error('Scan failed: %s' % str(e))
+                self._scanScheduler.scan_done(False)
+            self.notify_observers()
+            self.end_logging_loop(startTime)
+        try:
+            self.read_gsm_data(gsm_data_read)
+        except Exception, e:
+            logging.error('Unable to read GSM data: %s' % str(e))
+            if self._scanPending:
+                gsm_data_read(*self.NO_GSM_DATA)
+
+    def log_scan(self, date, minSpeed, maxSpeed, gsmStartTime, validGsm, servingCell, neighbourCells):
+        """Logs GSM data read since gsmStartTime with the matching GPS position, if valid.
+
+        Must be called with the OBM logger lock held.
+        """
+        # to be sure to keep data consistent, the position logged is the one we had
+        # while reading GSM data (at 50 km/h, you go about 15 m / second).
+        gsmTime = (gsmStartTime + time.time()) / 2
+        gpsData = self.get_gps_data_at(gsmTime)
+
+        if gpsData == None:
+            logging.warning('Log rejected because no GPS fix is close enough to the time GSM data was read.')
+        else:
+            (validGps, tstamp, lat, lng, alt, pdop, hdop, vdop, spe, heading) = gpsData
+            if spe < minSpeed:
                 # the test upon the speed, prevents from logging many times the same position with the same cell.
                 # Nevertheless, it also prevents from logging the same position with the cell changing...
                 logging.info('Log rejected because speed (%g) is under minimal speed (%g).' % (spe, minSpeed))
             elif spe > maxSpeed:
                 logging.info('Log rejected because speed (%g) is over maximal speed (%g).' % (spe, maxSpeed))
             elif validGps and validGsm:
-                self.write_obm_log(adate2, tstamp, servingCell, lng, lat, alt, spe, heading, hdop, vdop, pdop,
+                self.write_obm_log(date, tstamp, servingCell, lng, lat, alt, spe, heading, hdop, vdop, pdop,
                                    neighbourCells)
+                self._scanScheduler.scan_done(True, gsmTime, lat, lng)
+                return
             else:
                 logging.info('Data were not valid for creating openBmap log.')
                 logging.info("Validity=%s, MCC=%s, MNC=%s, lac=%s, cid=%s, strength=%i, act=%s, tav=%s, rxlev=%s"
                               % ((validGsm,) + servingCell) )
                 logging.info("Validity=%s, lng=%f, lat=%f, alt=%f, spe=%f, hdop=%f, vdop=%f, pdop=%f" \
                               % (validGps, lng, lat, alt, spe, hdop, vdop, pdop))
+        self._scanScheduler.scan_done(False)
 
-            self.notify_observers()
-        duration = datetime.now() - startTime
-        logging.info("Logging loop ended, total duration: %i sec." % duration.seconds)
+    def serving_cell_changed(self):
+        """Called upon handover: schedules a scan right now, instead of waiting for the next one.
 
-        if not self._logging:
-            logging.info('Logging loop is stopping.')
-            self._loggingThread = None
-            self.set_current_remember_cells_structure_id()
-        else:
-            logging.info('Next logging loop scheduled in %d seconds.' % scanSpeed)
-        # storing in 'result' prevents modification of the return value between
-        # the lock release() and the return statement.
-        result = self._logging
+        The scan replaces the next scheduled one, thus two scans never run at once.
+        Rate limited by the scan scheduler.
+        """
+        if not self._loggerLock.acquire(False):
+            # a scan is running (or logger is being started/stopped): it will see the new cell
+            logging.debug('Serving cell changed while OBM logger locked, no extra scan.')
+            return
+        logging.debug('OBM logger locked by serving_cell_changed().')
+        if self._scanPending:
+            # the scan waiting for GSM data will see the new cell
+            logging.debug('Serving cell changed while scanning, no extra scan.')
+        elif self._logging and self._loggingThread != None:
+            if self._scanScheduler.handover_scan_allowed(time.time()):
+                gobject.source_remove(self._loggingThread)
+                self._loggingThread = gobject.idle_add(self.log)
+                logging.info('Serving cell changed: scan scheduled now.')
+            else:
+                logging.info('Serving cell changed: no extra scan, last one was too recent.')
         self._loggerLock.release()
-        logging.debug('OBM logger lock released by log().')
-        # together with timeout_add(). self._logging is True if it must keep looping.
-        return result
+        logging.debug('OBM logger lock released by serving_cell_changed().')
+
+    def get_scan_stats(self):
+        """Returns a dictionary of the scan scheduler counters (scans done, accepted, avoided...)."""
+        return self._scanScheduler.get_counters()
+
+    def log_stats(self):
+        """Logs the counters of the scans, of the GSM and GPS reads, and of the disk writer.
+
+        They are cumulated since the application started.
+        """
+        logging.info('Scans: %(scans)i done, %(accepted)i accepted, %(avoided_no_fix)i avoided without fix, '
+                     '%(avoided_speed)i because of the speed, %(avoided_distance)i because of the distance. '
+                     '%(serving_cell_changes)i serving cell changes, %(handover_scans)i handover scans, '
+                     '%(handover_rate_limited)i rate limited.' % self.get_scan_stats())
+        for (name, (latency, calls, failures)) in sorted(self._gsm.get_monitoring_latency().items()):
+            logging.info('%s cells info D-Bus queries: %i, %i failed, last latency %.3f sec.' %
+                         (name, calls, failures, latency))
+        logging.info('Neighbour cells cache: %(hits)i hits, %(misses)i misses, %(invalidated)i invalidated.' %
+                     self._gsm.get_neighbour_cache_stats())
+        logging.info('GPS reads: %i from the cache, %i polls.' % self._gps.get_cache_stats())
+        logging.info('Disk writer: %(written)i scans written in %(batches)i batches, %(syncs)i syncs, '
+                     'max queue depth %(max_depth)i (full %(queue_full)i times), '
+                     'max write latency %(max_write_latency).3f sec., %(errors)i errors.' %
+                     self.get_disk_writer_stats())
         
     def start_logging(self):
         """Schedules a call to the logging method, using the scanning time."""
@@ -1506,10 +2327,19 @@ class ObmLogger():
             logging.debug('OBM logger is already running.')
         else:
             self._logging = True
-            scanSpeed = self.get_config_value(self.GENERAL, self.SCAN_SPEED_DEFAULT)
+            snapshot = self.get_config_snapshot()
+            scanSpeed = snapshot.SCAN_SPEED_DEFAULT
             self.set_current_remember_cells_structure_id()
-            self._loggingThread = gobject.timeout_add_seconds( scanSpeed, self.log )
-            logging.info('start_logging: OBM logger scheduled every %i second(s).' % scanSpeed)
+            self._scanScheduler.set_parameters(snapshot.MIN_SCAN_INTERVAL,
+                                               snapshot.MAX_SCAN_INTERVAL,
+                                               snapshot.SCAN_DISTANCE)
+            self._scanScheduler.start(time.time(), scanSpeed)
+            if self._scanPending:
+                # the last loop, stopping the logger, is still scanning: it will schedule the next one
+                logging.info('start_logging: OBM logger loop resumed.')
+            else:
+                self._loggingThread = gobject.timeout_add_seconds( scanSpeed, self.log )
+                logging.info('start_logging: OBM logger first scan scheduled in %i second(s).' % scanSpeed)
 
             for plugin in self._activePluginsList:
                 plugin.init()
@@ -1535,6 +2365,10 @@ class ObmLogger():
             logging.debug('OBM logger locked by stop_logging().')
             self._logging = False
             logging.info('Requested logger to stop.')
+            if self._loggingThread != None and not self._scanPending:
+                # the next scan may be far away: run the last loop now, it will stop the logger
+                gobject.source_remove(self._loggingThread)
+                self._loggingThread = gobject.idle_add(self.log)
 
             for plugin, scheduledId in self._activePluginScheduledIds:
                 logging.debug('Unscheduled plugin %s', (plugin.get_id()))
@@ -1565,25 +2399,54 @@ class ObmLogger():
         
         
     def get_gsm_data(self):
-        """Returns Fields validity boolean, MCC, MNC, lac, cid, signal strength, tuple of neighbour cells dictionaries.
-        
+        """Returns the last GSM data read: validity boolean, serving cell tuple, tuple of neighbour cells dictionaries.
+
+        Does not wait: see read_gsm_data() for the format. While logging, the data is the one of the
+        last scan. Otherwise, new data is read in the background (at most every GSM_REFRESH_PERIOD),
+        and the observers are notified once it is available.
+        """
+        if not self._logging and not self._gsmRefreshPending and \
+                time.time() - self._lastGsmRefresh >= self.GSM_REFRESH_PERIOD:
+            self._gsmRefreshPending = True
+            self._lastGsmRefresh = time.time()
+            try:
+                # only displayed: the neighbour cells cache is good enough
+                self.read_gsm_data(self.gsm_data_refreshed, True)
+            except Exception, e:
+                logging.error('Unable to read GSM data: %s' % str(e))
+                self._gsmRefreshPending = False
+        return self._lastGsmData
+
+    def gsm_data_refreshed(self, valid, servingCell, neighbourCells):
+        """Called when the GSM data read by get_gsm_data() is available."""
+        self._gsmRefreshPending = False
+        self.notify_observers()
+
+    def read_gsm_data(self, callback, useCache=False):
+        """Reads GSM data: callback(Fields validity boolean, serving cell tuple, tuple of neighbour cells dictionaries).
+
+        The serving cell tuple contains MCC, MNC, lac, cid, signal strength, access type, timing advance, rxlev.
         Each neighbour cell dictionary contains lac and cid fields.
         They may contain rxlev, c1, c2, and ctype.
-        If MCC has changed, triggers writing of log file.
+        callback is called from the main loop, see Gsm.get_gsm_data() (and useCache).
         """
         
-        result = self._gsm.get_gsm_data()
-        currentMcc = result[1][0]
-        if currentMcc != self._mcc:
-            # as soon as we have changed from MCC (thus from country), we save the logs because
-            # for now the log files have the MCC in their name, to make easy to dispatch them.
-            # Thus, a log file is supposed to contain only one MCC related data.
-            logging.info("MCC has changed from '%s' to '%s'." % (self._mcc, currentMcc))
-            self.write_obm_log_to_disk()
-            self._mcc = currentMcc
-        else:
-            logging.debug("MCC unchanged (was '%s', is '%s')" % (self._mcc, currentMcc))
-        return result
+        # keep the neighbour cells cache aware of our moves (GPS data is cached, thus cheap)
+        (validGps, tstamp, lat, lng, alt, pdop, hdop, vdop, spe, heading) = self.get_gps_data()
+        if validGps:
+            self._gsm.set_position(lat, lng)
+        def gsm_data_read(*result):
+            currentMcc = result[1][0]
+            if currentMcc != self._mcc:
+                # the log files have the MCC in their name, to make easy to dispatch them. Thus, a log
+                # file contains only one MCC related data: the disk writer keeps one log file per MCC.
+                logging.info("MCC has changed from '%s' to '%s'." % (self._mcc, currentMcc))
+                self._mcc = currentMcc
+            else:
+                logging.debug("MCC unchanged (was '%s', is '%s')" % (self._mcc, currentMcc))
+            self._lastGsmData = result
+            callback(*result)
+        self._gsm.get_gsm_data(gsm_data_read, useCache)
 
     def get_seen_cells_stats(self):
         """Returns the number of cells which have been seen.
@@ -1595,7 +2458,9 @@ class ObmLogger():
         number of serving cells seen in last remember structure,
         number of neighbour cells seen in last remember structure,
         number of serving cells seen since launch,
-        number of neighbour cells seen since launch
+        number of neighbour cells seen since launch,
+        number of serving cells ever seen (-1 if unknown),
+        number of neighbour cells ever seen (-1 if unknown)
         """
         return self._gsm.get_seen_cells_stats()
 
@@ -1605,6 +2470,18 @@ class ObmLogger():
         (valSpe, speed, heading) = self._gps.get_course()
         # knots * 1.852 = km/h
         return (valPos and valSpe, tstamp, lat, lng, alt, pdop, hdop, vdop, speed * 1.852, heading)
+
+    def get_gps_data_at(self, when):
+        """Same as get_gps_data(), but for the position at local time when (see time.time()).
+
+        Returns None if no GPS fix is close enough to when.
+        """
+        fix = self._gps.get_fix_at(when)
+        if fix == None:
+            return None
+        (valid, tstamp, lat, lng, alt, pdop, hdop, vdop, speed, heading) = fix
+        # knots * 1.852 = km/h
+        return (valid, tstamp, lat, lng, alt, pdop, hdop, vdop, speed * 1.852, heading)
     
     def get_credentials(self):
         """Returns openBmap login, password."""
@@ -1613,8 +2490,8 @@ class ObmLogger():
 
     def set_credentials(self, login, password):
         """Sets the given login and password, saves the config file."""
-        config.set(config.CREDENTIALS, config.OBM_LOGIN, login)
-        config.set(config.CREDENTIALS, config.OBM_PASSWORD, password)
+        config.set(self.CREDENTIALS, self.OBM_LOGIN, login)
+        config.set(self.CREDENTIALS, self.OBM_PASSWORD, password)
         config.save_config()
         logging.info('Credentials set to \'%s\', \'%s\'' % (login, password) )
 
@@ -1657,6 +2534,10 @@ class ObmLogger():
     def simulate_gps_data(self):
         """Return simulated validity boolean, time stamp, lat, lng, alt, pdop, hdop, vdop, speed in km/h, heading."""
         return (True, 345678, 2.989123456923999, 69.989123456123444, 2.896, 6.123, 2.468, 3.1, 3.456, 10)
+
+    def simulate_gps_data_at(self, when):
+        """Return simulated GPS data, see simulate_gps_data()."""
+        return self.simulate_gps_data()
     
     def simulate_gsm_data(self):
         """Return simulated Fields validity boolean, (MCC, MNC, lac, cid, signal strength, act), neighbour cells."""
@@ -1672,6 +2553,8 @@ class ObmLogger():
 #----------------------------------------------------------------------------#
 # program starts here
 #----------------------------------------------------------------------------#
+# the disk writer thread must be able to run while the main loop waits
+gobject.threads_init()
 dbus.mainloop.glib.DBusGMainLoop( set_as_default=True )
 
 if not os.path.exists(ObmLogger.APP_HOME_DIR):
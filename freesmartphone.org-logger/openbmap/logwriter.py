@@ -0,0 +1,767 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Append only writer of the log files (segments), journaled.
+
+Log files are stored either as XML (xmllog.XmlFormat) or in a compact binary
+form converted to XML when uploaded (binlog.BinaryFormat). Once finished, they may
+be gzip compressed (COMPRESSED_SUFFIX is then added to their name), see load_as_xml().
+
+While a segment is written, it lives in the journal directory, under its final name
+plus JOURNAL_SUFFIX. Once finished it is renamed (atomically) into the logs directory,
+thus the latter never contains truncated XML, or appended to the container of its MCC
+(see container.LogContainer and set_container_dir()). After a crash, recover() turns the
+journals left into well formed log files.
+
+BackgroundWriter runs a LogWriter in its own thread, fed by a bounded queue.
+"""
+
+import gzip
+import logging
+import os
+import struct
+import time
+import threading
+import zlib
+import Queue
+from cStringIO import StringIO
+
+import xmllog
+import binlog
+import container
+
+JOURNAL_SUFFIX = '.journal'
+COMPRESSED_SUFFIX = '.gz'
+# log file extension -> format class
+FORMATS = {xmllog.XmlFormat.EXTENSION: xmllog.XmlFormat,
+           binlog.BinaryFormat.EXTENSION: binlog.BinaryFormat}
+
+def _strip_compressed_suffix(filename):
+    if filename.endswith(COMPRESSED_SUFFIX):
+        return filename[:-len(COMPRESSED_SUFFIX)]
+    return filename
+
+def get_format(filename):
+    """Returns the format class of the log file, depending on its name.
+
+    Files of unknown extension (e.g. written by the plugins) are taken as XML.
+    """
+    return FORMATS.get(os.path.splitext(_strip_compressed_suffix(filename))[1], xmllog.XmlFormat)
+
+def get_xml_name(filename):
+    """Returns the name of the log file once converted to uncompressed XML."""
+    (root, extension) = os.path.splitext(_strip_compressed_suffix(filename))
+    if extension in FORMATS:
+        return root + xmllog.XmlFormat.EXTENSION
+    return root + extension
+
+def open_log(filename):
+    """Returns a file object reading the log file, uncompressed."""
+    if filename.endswith(COMPRESSED_SUFFIX):
+        return gzip.open(filename, 'rb')
+    return open(filename, 'rb')
+
+def get_xml_size(filename):
+    """Returns the size of the XML log file once uncompressed, None if it is not stored as XML."""
+    if get_format(filename) != xmllog.XmlFormat:
+        return None
+    if not filename.endswith(COMPRESSED_SUFFIX):
+        return os.path.getsize(filename)
+    file = open(filename, 'rb')
+    try:
+        return get_gzip_size(file, os.path.getsize(filename))
+    finally:
+        file.close()
+
+def get_gzip_size(file, end):
+    """Returns the uncompressed size of the gzip data ending at offset end of file."""
+    # the gzip trailer ends with the uncompressed size (modulo 2^32)
+    file.seek(end - 4)
+    data = file.read(4)
+    if len(data) != 4:
+        raise IOError, 'Truncated gzip data.'
+    return struct.unpack('<I', data)[0]
+
+def open_gzip_part(file, size):
+    """Returns a file object reading uncompressed the gzip data of the size bytes read from file.
+
+    Unlike gzip.GzipFile, it never seeks: e.g. a container slice is streamed, see
+    container.LogContainer.open_slice().
+    """
+    return _GzipPartReader(file, size)
+
+def load_as_xml(filename):
+    """Returns the content of the log file as XML, whatever its format and compression."""
+    file = open_log(filename)
+    try:
+        return _read_as_xml(filename, file)
+    finally:
+        file.close()
+
+def decode_as_xml(filename, content):
+    """Returns content, the content of the log file filename (e.g. a container slice), as XML."""
+    if filename.endswith(COMPRESSED_SUFFIX):
+        file = gzip.GzipFile(filename, 'rb', fileobj=StringIO(content))
+    else:
+        file = StringIO(content)
+    return _read_as_xml(filename, file)
+
+def _read_as_xml(filename, file):
+    if get_format(filename) == binlog.BinaryFormat:
+        return binlog.convert_to_string(file)
+    return file.read()
+
+class _GzipPartReader:
+    """See open_gzip_part(). Only the chunks being read are held in memory."""
+
+    CHUNK_SIZE = 65536
+
+    def __init__(self, file, size):
+        self._file = file
+        self._remaining = size
+        # 16 + MAX_WBITS: gzip header and trailer
+        self._decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        # compressed data not decompressed yet, because of the size asked to read()
+        self._tail = ''
+        self._flushed = False
+
+    def read(self, size=-1):
+        pieces = []
+        wanted = size
+        while size < 0 or wanted > 0:
+            if self._tail:
+                data = self._tail
+            elif self._remaining > 0:
+                data = self._file.read(min(self.CHUNK_SIZE, self._remaining))
+                if data == '':
+                    raise IOError, 'Truncated gzip data: %i bytes missing.' % self._remaining
+                self._remaining -= len(data)
+            elif not self._flushed:
+                self._flushed = True
+                pieces.append(self._decompressor.flush())
+                break
+            else:
+                break
+            if size < 0:
+                output = self._decompressor.decompress(data)
+            else:
+                output = self._decompressor.decompress(data, wanted)
+            self._tail = self._decompressor.unconsumed_tail
+            pieces.append(output)
+            wanted -= len(output)
+        return ''.join(pieces)
+
+    def close(self):
+        self._file.close()
+
+class _Segment:
+    """A log file being written: the journal file and its accounting."""
+
+    def __init__(self, mcc, filename, file, format):
+        self.mcc = mcc
+        self.filename = filename
+        self.file = file
+        self.format = format
+        self.started = time.time()
+        # size of the log file once converted to XML
+        self.size = 0
+        # size of the log file as written
+        self.diskSize = 0
+        self.nbScans = 0
+        self.unsyncedScans = 0
+        self.lastSync = self.started
+        self.dirty = False
+
+    def write(self, data, xmlSize):
+        self.file.write(data)
+        self.diskSize += len(data)
+        self.size += xmlSize
+        self.dirty = True
+
+
+class LogWriter:
+    """Streams the scans into the log files, one open segment per MCC.
+
+    A segment is opened for a given MCC, named VERSION_MCC_logYYYYMMDDhhmmss plus the extension
+    of the format, the header is written once, then every scan record is appended as soon as it
+    is received. finish() writes the tail and publishes the segment. The size of the segments
+    once in XML is tracked exactly (we write ascii files, that is to say one byte per character),
+    whatever the format.
+    Every MCC has its own segment, thus scans of alternating MCCs (near a border) do not force
+    the segments to be finished. Each segment is rotated on its own, see set_rotation().
+    Scans are flushed to the system by commit(), the journals are fsync'ed depending on the
+    policy given to set_sync_policy().
+    This class is not thread safe, the caller is in charge of locking.
+    """
+
+    def __init__(self, logDir, journalDir, version, header, tail, format=xmllog.XmlFormat):
+        self._logDir = logDir
+        # class of the format of the new segments, see FORMATS
+        self._format = format
+        self._journalDir = journalDir
+        self._version = version
+        self._header = header
+        self._tail = tail
+        # MCC -> _Segment
+        self._segments = {}
+        # fsync every _syncScans scans and/or every _syncPeriod seconds. 0 disables the criterium.
+        self._syncScans = 1
+        self._syncPeriod = 0
+        self._nbSyncs = 0
+        # finish a segment when it would exceed _maxSize bytes, or, if _maxSize <= 0,
+        # when it contains _maxScans scans. Both <= 0: segments are only finished on request.
+        self._maxSize = 0
+        self._maxScans = 0
+        # finish a segment _maxAge seconds after it has been started. <= 0 to ignore.
+        self._maxAge = 0
+        # gzip the segments when they are published
+        self._compress = False
+        # if not None, the segments are published in the containers of this directory
+        self._containerDir = None
+        # 'published': bytes of the segments finished, 'stored': bytes they use once published
+        self._stats = {'published': 0, 'stored': 0}
+        # called with the name of every log file published
+        self._publishListener = None
+
+    def set_compression(self, compress):
+        """If compress is True, the segments are gzip compressed when they are finished."""
+        self._compress = compress
+
+    def set_container_dir(self, containerDir):
+        """Segments are published in the containers (one per MCC) of containerDir, see container.LogContainer.
+
+        None to publish them as separate files in the logs directory.
+        """
+        self._containerDir = containerDir
+
+    def set_publish_listener(self, listener):
+        """listener(name) is called once the log file name (without directory) is published. None to remove it."""
+        self._publishListener = listener
+
+    def get_container(self, filename):
+        """Returns the container (container.LogContainer) of the log file filename, None if not packing."""
+        if self._containerDir == None:
+            return None
+        return container.LogContainer(container.container_filename(self._containerDir, filename))
+
+    def is_published(self, filename):
+        """Returns True if the log file filename is in the logs directory or in its container."""
+        if os.path.exists(filename):
+            return True
+        logContainer = self.get_container(filename)
+        return logContainer != None and logContainer.contains(os.path.basename(filename))
+
+    def get_stats(self):
+        """Returns a copy of the dictionary of the published bytes, stored bytes, and 'saved' bytes."""
+        result = dict(self._stats)
+        result['saved'] = result['published'] - result['stored']
+        return result
+
+    def set_rotation(self, maxSize, maxScans, maxAge=0):
+        """Segments are finished before exceeding maxSize bytes (tail included).
+
+        If maxSize <= 0, segments are finished once they contain maxScans scans.
+        If both are <= 0, segments are only finished by finish().
+        Independently, segments are finished maxAge seconds after having been started, if maxAge > 0.
+        """
+        self._maxSize = maxSize
+        self._maxScans = maxScans
+        self._maxAge = maxAge
+
+    def set_sync_policy(self, scans, period):
+        """The journal is fsync'ed every scans scans and every period seconds. 0 disables the criterium.
+
+        With both set to 0, the journal is only fsync'ed when the segment is finished.
+        """
+        self._syncScans = max(0, scans)
+        self._syncPeriod = max(0, period)
+
+    def get_nb_syncs(self):
+        """Returns the number of fsync done on the journals."""
+        return self._nbSyncs
+
+    def set_header(self, header):
+        """Sets the header used by the next segments."""
+        self._header = header
+
+    def set_format(self, format):
+        """Sets the class of the format of the next segments, see FORMATS."""
+        self._format = format
+
+    def is_open(self, mcc=None):
+        """Returns True if a segment is open for given MCC (any MCC if None)."""
+        if mcc == None:
+            return len(self._segments) > 0
+        return mcc in self._segments
+
+    def get_open_mccs(self):
+        """Returns the sorted list of the MCCs having an open segment."""
+        result = self._segments.keys()
+        result.sort()
+        return result
+
+    def get_filename(self, mcc):
+        """Returns the full path the segment of given MCC will be published to, None if none is open."""
+        if not mcc in self._segments:
+            return None
+        return self._segments[mcc].filename
+
+    def get_size(self, mcc):
+        """Returns the number of bytes of the segment of given MCC once in XML, tail excluded."""
+        if not mcc in self._segments:
+            return 0
+        return self._segments[mcc].size
+
+    def get_disk_size(self, mcc):
+        """Returns the number of bytes written to the segment of given MCC."""
+        if not mcc in self._segments:
+            return 0
+        return self._segments[mcc].diskSize
+
+    def get_tail_size(self):
+        return len(self._tail)
+
+    def get_nb_scans(self, mcc):
+        """Returns the number of scans in the segment of given MCC."""
+        if not mcc in self._segments:
+            return 0
+        return self._segments[mcc].nbScans
+
+    def make_filename(self, mcc, when=None):
+        """Returns the full path of a segment started at local time when (defaults to now)."""
+        if when == None:
+            when = time.time()
+        date = time.strftime('%Y%m%d%H%M%S', time.localtime(when))
+        filename = os.path.join(self._logDir, self._version + '_' + mcc + '_log' + date + self._format.EXTENSION)
+        if self._compress:
+            filename += COMPRESSED_SUFFIX
+        return filename
+
+    def journal_filename(self, filename):
+        """Returns the full path of the journal of the segment to be published as filename."""
+        return os.path.join(self._journalDir, os.path.basename(filename) + JOURNAL_SUFFIX)
+
+    def make_dirs(self):
+        for dir in (self._logDir, self._journalDir, self._containerDir):
+            if dir != None and not os.path.exists(dir):
+                os.mkdir(dir)
+
+    def open(self, mcc):
+        """Starts a new segment for given MCC, and writes its header.
+
+        Finishes the current segment of this MCC first, if any.
+        """
+        if mcc in self._segments:
+            self.finish(mcc)
+        self.make_dirs()
+        when = time.time()
+        filename = self.make_filename(mcc, when)
+        # never overwrite a log file, or a journal not recovered yet
+        while self.is_published(filename) or os.path.exists(self.journal_filename(filename)):
+            when += 1
+            filename = self.make_filename(mcc, when)
+        segment = _Segment(mcc, filename, open(self.journal_filename(filename), 'wb'), self._format())
+        self._segments[mcc] = segment
+        segment.write(segment.format.begin(self._header, self._tail), len(self._header))
+        logging.info('Log file \'%s\' started.' % filename)
+        return segment
+
+    def append(self, mcc, record, commit=True):
+        """Appends the scan record (xmllog.ScanRecord) to the segment of given MCC.
+
+        A new segment is started if none is open for this MCC.
+        The segment is rotated depending on set_rotation().
+        If commit is False, the caller is in charge of calling commit() afterwards, thus
+        several scans can be committed at once.
+        """
+        segment = self._segments.get(mcc)
+        if not segment:
+            segment = self.open(mcc)
+        (data, xmlSize) = segment.format.encode(record)
+        if segment.nbScans > 0 and self._maxSize > 0:
+            # we use the max log file size as criterium to trigger write of file
+            fileLengthInByte = segment.size + xmlSize + len(self._tail)
+            if (fileLengthInByte <= self._maxSize):
+                logging.debug('Current size of log file %i bytes, max size of log files is %i bytes.'
+                              % (fileLengthInByte, self._maxSize))
+            else:
+                self.finish(mcc)
+                segment = self.open(mcc)
+                # the encoding may depend on what has been written before
+                (data, xmlSize) = segment.format.encode(record)
+        segment.write(data, xmlSize)
+        segment.nbScans += 1
+        segment.unsyncedScans += 1
+        if self._maxSize <= 0 and self._maxScans > 0:
+            if segment.nbScans < self._maxScans:
+                logging.debug('Max logs per file (%i/%i) not reached, wait to finish the file.'
+                              % (segment.nbScans, self._maxScans))
+            else:
+                self.finish(mcc)
+                return
+        if commit:
+            self.commit()
+
+    def commit(self):
+        """Flushes the scans appended to the system, fsync's them depending on the sync policy."""
+        now = time.time()
+        for segment in self._segments.itervalues():
+            if segment.dirty:
+                segment.file.flush()
+                segment.dirty = False
+            if segment.unsyncedScans > 0 and \
+               ((self._syncScans > 0 and segment.unsyncedScans >= self._syncScans) or \
+                (self._syncPeriod > 0 and now - segment.lastSync >= self._syncPeriod)):
+                self._sync(segment)
+
+    def _sync(self, segment):
+        os.fsync(segment.file.fileno())
+        self._nbSyncs += 1
+        segment.unsyncedScans = 0
+        segment.lastSync = time.time()
+
+    def next_expiry(self):
+        """Returns the delay in sec. before a segment is too old, or has scans to fsync because
+        of the sync period, None if there is no such deadline.
+
+        finish_expired() then commit() must be called at that time, even if no scan is appended.
+        """
+        deadlines = []
+        for segment in self._segments.itervalues():
+            if self._maxAge > 0:
+                deadlines.append(segment.started + self._maxAge)
+            if self._syncPeriod > 0 and segment.unsyncedScans > 0:
+                deadlines.append(segment.lastSync + self._syncPeriod)
+        if len(deadlines) == 0:
+            return None
+        return max(0, min(deadlines) - time.time())
+
+    def finish_expired(self):
+        """Finishes the segments older than the maximal age. Returns their filenames."""
+        result = []
+        if self._maxAge <= 0:
+            return result
+        now = time.time()
+        for mcc in self.get_open_mccs():
+            if now - self._segments[mcc].started >= self._maxAge:
+                logging.info('Log file for MCC \'%s\' is too old, finishing it.' % mcc)
+                result.append(self.finish(mcc))
+        return result
+
+    def finish(self, mcc):
+        """Writes the tail and publishes the segment of given MCC. Returns its filename, None if none was open."""
+        segment = self._segments.pop(mcc, None)
+        if not segment:
+            return None
+        try:
+            segment.write(segment.format.end(self._tail), len(self._tail))
+            segment.file.flush()
+            self._sync(segment)
+            segment.file.close()
+            self._publish(self.journal_filename(segment.filename), segment.filename)
+            logging.info('Log file \'%s\' finished, %i scans, %i bytes (%i bytes in XML).' %
+                         (segment.filename, segment.nbScans, segment.diskSize, segment.size))
+        finally:
+            if not segment.file.closed:
+                segment.file.close()
+        return segment.filename
+
+    def _publish(self, journal, filename):
+        """Moves the (complete and fsync'ed) journal to filename, compresses it if filename says so.
+
+        When packing, the journal is appended to the container of filename instead.
+        """
+        published = os.path.getsize(journal)
+        source = journal
+        if filename.endswith(COMPRESSED_SUFFIX):
+            # compressed aside in the journal directory
+            source = journal[:-len(JOURNAL_SUFFIX)]
+            self._compress_file(journal, source, filename)
+        logContainer = self.get_container(filename)
+        if logContainer != None:
+            stored = logContainer.append(os.path.basename(filename), source).length
+            if source != journal:
+                os.remove(source)
+            os.remove(journal)
+        else:
+            os.rename(source, filename)
+            stored = os.path.getsize(filename)
+            if source != journal:
+                os.remove(journal)
+        self._stats['published'] += published
+        self._stats['stored'] += stored
+        if self._publishListener != None:
+            try:
+                self._publishListener(os.path.basename(filename))
+            except Exception, e:
+                logging.error('Publish listener failed for \'%s\': %s' % (filename, str(e)))
+
+    def _compress_file(self, journal, tmpFilename, filename):
+        """Writes the journal gzip compressed in tmpFilename (fsync'ed), for the log file filename."""
+        source = open(journal, 'rb')
+        out = open(tmpFilename, 'wb')
+        try:
+            compressed = gzip.GzipFile(os.path.basename(filename), 'wb', 9, out)
+            while True:
+                data = source.read(65536)
+                if data == '':
+                    break
+                compressed.write(data)
+            compressed.close()
+            out.flush()
+            os.fsync(out.fileno())
+        finally:
+            out.close()
+            source.close()
+
+    def finish_all(self):
+        """Finishes all the open segments. Returns their filenames."""
+        return [self.finish(mcc) for mcc in self.get_open_mccs()]
+
+    def recover(self):
+        """Publishes the journals left by a previous run as well formed log files.
+
+        Incomplete scans at the end of a journal are dropped, journals without any complete
+        scan are deleted. Must not be called while a segment is open.
+        Returns the list of the log files published.
+        """
+        result = []
+        if not os.path.exists(self._journalDir):
+            return result
+        self.make_dirs()
+        for f in sorted(os.listdir(self._journalDir)):
+            if not f.endswith(JOURNAL_SUFFIX):
+                # compression interrupted, see _publish()
+                logging.warning('Deleting \'%s\' left in the journal directory.' % f)
+                os.remove(os.path.join(self._journalDir, f))
+                continue
+            journal = os.path.join(self._journalDir, f)
+            filename = os.path.join(self._logDir, f[:-len(JOURNAL_SUFFIX)])
+            if self.is_published(filename):
+                logging.warning('Journal \'%s\' already published, deleting it.' % journal)
+                os.remove(journal)
+                continue
+            try:
+                format = get_format(filename)()
+                file = open(journal, 'r+b')
+                try:
+                    content = file.read()
+                    end = format.complete_length(content)
+                    if end < 0:
+                        logging.warning('Journal \'%s\' has no complete scan, deleting it.' % journal)
+                        file.close()
+                        os.remove(journal)
+                        continue
+                    if end < len(content):
+                        logging.warning('Journal \'%s\': %i bytes of incomplete scan dropped.' %
+                                        (journal, len(content) - end))
+                    file.seek(end)
+                    file.truncate()
+                    file.write(format.end(self._tail))
+                    file.flush()
+                    os.fsync(file.fileno())
+                finally:
+                    file.close()
+                self._publish(journal, filename)
+                logging.info('Journal \'%s\' recovered as \'%s\'.' % (journal, filename))
+                result.append(filename)
+            except Exception, e:
+                logging.error('Unable to recover journal \'%s\': %s' % (journal, str(e)))
+        return result
+
+
+class BackgroundWriter(threading.Thread):
+    """Thread which owns a LogWriter, and runs the requests queued by other threads.
+
+    The queue is bounded: when it is full the callers block (backpressure). All the scans
+    waiting in the queue are written, then committed at once (group commit).
+    The thread sleeps until a request is queued: a timer queues an 'expire' request when the
+    oldest segment becomes too old, or when the scans of a segment must be fsync'ed because of
+    the sync period (see LogWriter.next_expiry()).
+    """
+
+    def __init__(self, writer, maxQueued=64, maxBatch=32):
+        threading.Thread.__init__(self, name='BackgroundWriter')
+        self.setDaemon(True)
+        self._writer = writer
+        self._queue = Queue.Queue(maxQueued)
+        self._maxBatch = maxBatch
+        # threading.Timer queueing the next 'expire' request, and when it is due
+        self._expiryTimer = None
+        self._expiryDue = None
+        self._countersLock = threading.Lock()
+        self._counters = {'queued': 0,
+                          'written': 0,
+                          'batches': 0,
+                          'queue_full': 0,
+                          'max_depth': 0,
+                          'errors': 0,
+                          'last_write_latency': 0.0,
+                          'max_write_latency': 0.0}
+
+    def _put(self, request):
+        self._countersLock.acquire()
+        if self._queue.full():
+            self._counters['queue_full'] += 1
+        self._countersLock.release()
+        if self._queue.full():
+            logging.warning('Disk writer queue full, waiting.')
+        self._queue.put(request)
+        self._countersLock.acquire()
+        self._counters['queued'] += 1
+        self._counters['max_depth'] = max(self._counters['max_depth'], self._queue.qsize())
+        self._countersLock.release()
+
+    def write(self, mcc, record):
+        """Queues the scan record for writing. Blocks while the queue is full."""
+        self._put(('scan', mcc, record))
+
+    def put(self, function):
+        """Queues function, to run in the writer thread after the requests already queued.
+
+        Does not wait for it: its exceptions are logged.
+        """
+        self._put(('call', function, None))
+
+    def finish(self):
+        """Queues the finishing of all the open segments."""
+        self.put(self._writer.finish_all)
+
+    def call(self, function, timeout=None):
+        """Runs function in the writer thread, after the requests already queued. Returns its result.
+
+        Raises the exception raised by function, or Exception if timeout (in sec.) elapses.
+        """
+        result = [threading.Event(), None, None]
+        self._put(('call', function, result))
+        result[0].wait(timeout)
+        if not result[0].isSet():
+            raise Exception, 'Disk writer did not answer within %s sec.' % timeout
+        if result[2]:
+            raise result[2]
+        return result[1]
+
+    def barrier(self, timeout=None):
+        """Waits until all the requests queued so far are written and committed.
+
+        Returns False if timeout (in sec.) elapsed before.
+        """
+        try:
+            self.call(lambda: None, timeout)
+        except Exception, e:
+            logging.warning(str(e))
+            return False
+        return True
+
+    def stop(self, timeout=None):
+        """Finishes the current segment and stops the thread."""
+        self.finish()
+        self._put(None)
+        self.join(timeout)
+
+    def _queue_expiry(self):
+        try:
+            self._queue.put_nowait(('expire',))
+        except Queue.Full:
+            # the writer is busy, it checks the segments age after each batch anyway
+            pass
+
+    def _schedule_expiry(self):
+        """(Re)arms the timer of the 'expire' request, if the oldest segment is due at another time."""
+        delay = self._writer.next_expiry()
+        due = None
+        if delay != None:
+            due = time.time() + delay
+        if self._expiryTimer != None and self._expiryTimer.isAlive() and due != None and \
+                abs(due - self._expiryDue) < 1:
+            return
+        if self._expiryTimer != None:
+            self._expiryTimer.cancel()
+            self._expiryTimer = None
+        self._expiryDue = due
+        if due != None:
+            self._expiryTimer = threading.Timer(delay, self._queue_expiry)
+            self._expiryTimer.setDaemon(True)
+            self._expiryTimer.start()
+
+    def get_counters(self):
+        """Returns a copy of the counters dictionary, plus the current queue 'depth'."""
+        self._countersLock.acquire()
+        result = dict(self._counters)
+        self._countersLock.release()
+        result['depth'] = self._queue.qsize()
+        return result
+
+    def run(self):
+        running = True
+        while running:
+            # sleeps until a request, or the 'expire' one queued by the timer
+            batch = [self._queue.get()]
+            while len(batch) < self._maxBatch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except Queue.Empty:
+                    break
+            start = time.time()
+            written = 0
+            errors = 0
+            done = []
+            for request in batch:
+                if request == None:
+                    running = False
+                    continue
+                try:
+                    if request[0] == 'scan':
+                        self._writer.append(request[1], request[2], commit=False)
+                        written += 1
+                    elif request[0] == 'expire':
+                        # the segments too old are finished, and the scans due are fsync'ed below
+                        pass
+                    else:
+                        # the scans before must be committed before running a call
+                        self._writer.commit()
+                        result = request[2]
+                        try:
+                            value = request[1]()
+                            if result:
+                                result[1] = value
+                        except Exception, e:
+                            if result:
+                                result[2] = e
+                            else:
+                                raise
+                        if result:
+                            done.append(result[0])
+                except Exception, e:
+                    logging.error('Error while writing GSM/GPS log to file: %s' % str(e))
+                    errors += 1
+            try:
+                self._writer.finish_expired()
+                self._writer.commit()
+            except Exception, e:
+                logging.error('Error while committing GSM/GPS log to file: %s' % str(e))
+                errors += 1
+            if running:
+                self._schedule_expiry()
+            elif self._expiryTimer != None:
+                self._expiryTimer.cancel()
+            latency = time.time() - start
+            for event in done:
+                event.set()
+            self._countersLock.acquire()
+            self._counters['written'] += written
+            if len(batch) > 0:
+                self._counters['batches'] += 1
+            self._counters['errors'] += errors
+            self._counters['last_write_latency'] = latency
+            self._counters['max_write_latency'] = max(self._counters['max_write_latency'], latency)
+            self._countersLock.release()
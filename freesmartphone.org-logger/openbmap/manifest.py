@@ -0,0 +1,251 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Durable state of the uploads of the log files.
+
+The manifest knows every log file waiting for upload (by its key, e.g. 'FSO_GSM/V2_208_log20100605143059.xml'),
+its state (PENDING, IN_FLIGHT, DONE, REJECTED), how many times its upload has been attempted, and the last error.
+A failed upload is retried after a delay doubled at every attempt. After maxAttempts attempts refused by the
+server, the log file is REJECTED: the uploader moves it to the quarantine directory. Network errors
+(transient) are retried forever.
+
+It is stored as a journal of text lines, one per change (fsync'ed), the last line of a key wins. The journal is
+rewritten (compacted) when loaded, and when it has grown too much.
+"""
+
+import collections
+import logging
+import os
+import threading
+import time
+
+PENDING = 'pending'
+IN_FLIGHT = 'in-flight'
+DONE = 'done'
+REJECTED = 'rejected'
+STATES = [PENDING, IN_FLIGHT, DONE, REJECTED]
+# journal line of a key removed from the manifest
+_DROPPED = 'dropped'
+# in sec.
+MAX_RETRY_DELAY = 6 * 3600
+_COMPACT_MIN_LINES = 1000
+
+# nextAttempt is the time (in sec. since epoch) before which the upload is not retried
+ManifestEntry = collections.namedtuple('ManifestEntry', 'key state attempts nextAttempt lastError')
+
+def make_key(source, name):
+    """Returns the key of the log file name, from the directory source (e.g. 'FSO_GSM' or a plugin name)."""
+    return source + '/' + name
+
+def _clean(text):
+    return ' '.join(str(text).split())
+
+
+class UploadManifest:
+    """The upload states of the log files, stored in the file filename. Thread safe."""
+
+    def __init__(self, filename, maxAttempts=5, retryDelay=60):
+        self._filename = filename
+        self._maxAttempts = maxAttempts
+        self._retryDelay = retryDelay
+        # key -> ManifestEntry
+        self._entries = {}
+        self._journal = None
+        self._nbLines = 0
+        self._lock = threading.Lock()
+
+    def set_policy(self, maxAttempts, retryDelay):
+        """Sets the number of attempts before a log file is rejected, and the first retry delay (in sec.)."""
+        self._maxAttempts = maxAttempts
+        self._retryDelay = retryDelay
+
+    def load(self):
+        """Reads the manifest file. The uploads which were in flight are pending again."""
+        self._lock.acquire()
+        try:
+            self._entries = {}
+            if os.path.exists(self._filename):
+                file = open(self._filename, 'r')
+                try:
+                    for line in file:
+                        self._replay(line)
+                finally:
+                    file.close()
+            for entry in self._entries.values():
+                if entry.state == IN_FLIGHT:
+                    self._entries[entry.key] = entry._replace(state=PENDING)
+            self._compact()
+        finally:
+            self._lock.release()
+
+    def _replay(self, line):
+        fields = line.rstrip('\n').split('\t')
+        if len(fields) != 5:
+            # interrupted write
+            logging.warning('Upload manifest \'%s\': invalid line ignored.' % self._filename)
+            return
+        try:
+            entry = ManifestEntry(fields[0], fields[1], int(fields[2]), float(fields[3]), fields[4])
+        except ValueError:
+            logging.warning('Upload manifest \'%s\': invalid line ignored.' % self._filename)
+            return
+        if entry.state == _DROPPED:
+            self._entries.pop(entry.key, None)
+        elif entry.state in STATES:
+            self._entries[entry.key] = entry
+
+    def _compact(self):
+        """Rewrites the journal with the current entries only (the done ones are forgotten)."""
+        if self._journal != None:
+            self._journal.close()
+            self._journal = None
+        for entry in self._entries.values():
+            if entry.state == DONE:
+                del self._entries[entry.key]
+        tmpFilename = self._filename + '.tmp'
+        file = open(tmpFilename, 'w')
+        try:
+            for key in sorted(self._entries):
+                file.write(self._format(self._entries[key]))
+            file.flush()
+            os.fsync(file.fileno())
+        finally:
+            file.close()
+        os.rename(tmpFilename, self._filename)
+        self._nbLines = len(self._entries)
+
+    def _format(self, entry):
+        return '%s\t%s\t%i\t%.0f\t%s\n' % (entry.key, entry.state, entry.attempts, entry.nextAttempt,
+                                            _clean(entry.lastError))
+
+    def _write(self, entry):
+        """Records entry. Must be called with the lock held."""
+        if entry.state == _DROPPED:
+            self._entries.pop(entry.key, None)
+        else:
+            self._entries[entry.key] = entry
+        if self._nbLines > max(_COMPACT_MIN_LINES, 4 * len(self._entries)):
+            self._compact()
+            return
+        if self._journal == None:
+            self._journal = open(self._filename, 'a')
+        self._journal.write(self._format(entry))
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
+        self._nbLines += 1
+
+    def close(self):
+        self._lock.acquire()
+        try:
+            if self._journal != None:
+                self._journal.close()
+                self._journal = None
+        finally:
+            self._lock.release()
+
+    def get(self, key):
+        """Returns the ManifestEntry of key, None if unknown."""
+        self._lock.acquire()
+        try:
+            return self._entries.get(key)
+        finally:
+            self._lock.release()
+
+    def add(self, key):
+        """Adds the log file key as pending, if it is not known yet."""
+        self._lock.acquire()
+        try:
+            if not key in self._entries:
+                self._write(ManifestEntry(key, PENDING, 0, 0, ''))
+        finally:
+            self._lock.release()
+
+    def sync(self, keys):
+        """Matches the manifest with the log files found waiting for upload (their keys).
+
+        The new ones are added, the ones not found any more are forgotten, except the rejected ones.
+        A rejected log file found again (e.g. moved back from the quarantine) is pending again.
+        """
+        keys = set(keys)
+        self._lock.acquire()
+        try:
+            for entry in self._entries.values():
+                if not entry.key in keys and entry.state != REJECTED:
+                    self._write(ManifestEntry(entry.key, _DROPPED, 0, 0, ''))
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry == None or entry.state in (DONE, REJECTED):
+                    self._write(ManifestEntry(key, PENDING, 0, 0, ''))
+        finally:
+            self._lock.release()
+
+    def is_due(self, key, now=None):
+        """Returns True if the log file key is pending, and its retry delay has elapsed."""
+        if now == None:
+            now = time.time()
+        entry = self.get(key)
+        return entry != None and entry.state == PENDING and entry.nextAttempt <= now
+
+    def start(self, key):
+        """The upload of the log file key starts."""
+        self._lock.acquire()
+        try:
+            entry = self._entries.get(key, ManifestEntry(key, PENDING, 0, 0, ''))
+            self._write(entry._replace(state=IN_FLIGHT, attempts=entry.attempts + 1))
+        finally:
+            self._lock.release()
+
+    def succeeded(self, key):
+        """The log file key has been uploaded."""
+        self._lock.acquire()
+        try:
+            entry = self._entries.get(key, ManifestEntry(key, PENDING, 0, 0, ''))
+            self._write(entry._replace(state=DONE, nextAttempt=0, lastError=''))
+        finally:
+            self._lock.release()
+
+    def failed(self, key, error, transient=False, now=None):
+        """The upload of the log file key failed. Returns its new state: PENDING or REJECTED."""
+        if now == None:
+            now = time.time()
+        self._lock.acquire()
+        try:
+            entry = self._entries.get(key, ManifestEntry(key, PENDING, 1, 0, ''))
+            if not transient and entry.attempts >= self._maxAttempts:
+                entry = entry._replace(state=REJECTED, nextAttempt=0, lastError=error)
+            else:
+                delay = min(self._retryDelay * 2 ** max(0, entry.attempts - 1), MAX_RETRY_DELAY)
+                entry = entry._replace(state=PENDING, nextAttempt=now + delay, lastError=error)
+            self._write(entry)
+            return entry.state
+        finally:
+            self._lock.release()
+
+    def get_entries(self):
+        """Returns all the entries (ManifestEntry), sorted by key."""
+        self._lock.acquire()
+        try:
+            return [self._entries[key] for key in sorted(self._entries)]
+        finally:
+            self._lock.release()
+
+    def get_counts(self, now=None):
+        """Returns a dictionary: number of log files per state, and 'waiting' ones (pending, not due yet)."""
+        if now == None:
+            now = time.time()
+        result = dict([(state, 0) for state in STATES])
+        result['waiting'] = 0
+        for entry in self.get_entries():
+            result[entry.state] += 1
+            if entry.state == PENDING and entry.nextAttempt > now:
+                result['waiting'] += 1
+        return result
@@ -0,0 +1,87 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Cache of the neighbour cells, per serving cell."""
+
+import logging
+
+import scheduler
+
+class NeighbourCellsCache:
+    """Neighbour cells last queried, per serving cell.
+
+    Neighbour cells do not change much while the serving cell and the position stay the same.
+    An entry is used for ttl seconds after it has been stored, as long as the current position
+    (see set_position()) stays within maxDistance meters from where it has been stored.
+    The counters ('hits', 'misses', and 'invalidated' for the entries dropped before their time)
+    only account for the lookups: Gsm only looks up the cache to refresh the display, the
+    neighbour cells logged are always queried.
+    This class is not thread safe, the caller is in charge of locking.
+    """
+
+    def __init__(self, ttl=0, maxDistance=0):
+        # serving cell key -> (time stored, (lat, lng) or None, neighbour cells)
+        self._entries = {}
+        self._position = None
+        self._counters = {'hits': 0, 'misses': 0, 'invalidated': 0}
+        self.set_parameters(ttl, maxDistance)
+
+    def set_parameters(self, ttl, maxDistance):
+        """Sets the time to live (in sec., 0 disables the cache) and the invalidation distance (in m, 0 to ignore)."""
+        self._ttl = ttl
+        self._maxDistance = maxDistance
+        if ttl <= 0:
+            self._entries.clear()
+
+    def set_position(self, lat, lng):
+        """Sets the current position: the entries stored farther than the invalidation distance are dropped."""
+        self._position = (lat, lng)
+        if self._maxDistance <= 0:
+            return
+        for key, (stored, position, cells) in self._entries.items():
+            if position and scheduler.distance_m(position[0], position[1], lat, lng) > self._maxDistance:
+                logging.debug('Neighbour cells cache entry %s dropped, too far away.' % (key,))
+                del self._entries[key]
+                self._counters['invalidated'] += 1
+
+    def lookup(self, key, now):
+        """Returns the neighbour cells cached for serving cell key at time now, None if none is valid."""
+        if self._ttl <= 0:
+            return None
+        entry = self._entries.get(key)
+        if entry and (now - entry[0]) <= self._ttl:
+            self._counters['hits'] += 1
+            return entry[2]
+        self._counters['misses'] += 1
+        # forget expired entries
+        for k, (stored, position, cells) in self._entries.items():
+            if (now - stored) > self._ttl:
+                del self._entries[k]
+        return None
+
+    def store(self, key, neighbourCells, now):
+        """Caches neighbour cells for serving cell key, queried at time now at the current position."""
+        if self._ttl > 0:
+            self._entries[key] = (now, self._position, neighbourCells)
+
+    def invalidate(self, key):
+        """Drops the entry of serving cell key, if any."""
+        if self._entries.pop(key, None) != None:
+            self._counters['invalidated'] += 1
+
+    def clear(self):
+        """Drops every entry."""
+        self._entries.clear()
+
+    def get_counters(self):
+        """Returns a copy of the counters dictionary."""
+        return dict(self._counters)
@@ -0,0 +1,234 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""On disk set of fixed width records, searched in the memory mapped file.
+
+Shared by cellregistry.SeenCellsIndex and hashindex.HashIndex.
+"""
+
+import logging
+import mmap
+import os
+
+class RecordIndex:
+    """On disk set of records, strings of recordSize bytes.
+
+    The file is a sorted array of the records, thus lookups are a binary search directly
+    in the memory mapped file: millions of records cost almost no memory.
+    New records are kept in memory, and saved by save() in a small side file (its name
+    plus SIDE_SUFFIX), loaded in memory and searched as well. The side file is merged
+    into the index file once it holds MAX_SIDE records, or by merge() (e.g. at exit): the
+    whole index file is rewritten only then.
+    The file is only opened on first use.
+    This class is not thread safe, the caller (or the subclass) is in charge of locking.
+    """
+
+    SIDE_SUFFIX = '.new'
+    # number of new records after which add() saves them in the side file
+    MAX_PENDING = 512
+    # number of records in the side file after which save() merges it into the index file
+    MAX_SIDE = 8192
+    # used in the log messages
+    DESCRIPTION = 'Record index'
+    UNIT = 'records'
+
+    def __init__(self, filename, recordSize):
+        self._filename = filename
+        self._sideFilename = filename + self.SIDE_SUFFIX
+        self._recordSize = recordSize
+        self._file = None
+        self._map = None
+        self._nbRecords = 0
+        # records of the side file, and records not saved yet
+        self._side = set()
+        self._pending = set()
+        self._opened = False
+
+    def _open(self):
+        """Maps the index file, if it exists and is not empty, and loads the side file."""
+        self._opened = True
+        try:
+            size = os.path.getsize(self._filename)
+        except OSError:
+            logging.info('No %s \'%s\' yet.' % (self.DESCRIPTION.lower(), self._filename))
+            size = 0
+        if size % self._recordSize != 0:
+            logging.error('%s \'%s\' is corrupted (size %i), ignoring the trailing bytes.' %
+                          (self.DESCRIPTION, self._filename, size))
+        self._nbRecords = size // self._recordSize
+        if self._nbRecords > 0:
+            self._file = open(self._filename, 'rb')
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            logging.info('%s \'%s\' mapped, %i %s.' % (self.DESCRIPTION, self._filename,
+                                                      self._nbRecords, self.UNIT))
+        # records already in the index file if we stopped while merging
+        self._side = set([record for record in self._read_side_file() if not self._find(record)])
+
+    def _read_side_file(self):
+        """Returns the list of the records of the side file."""
+        try:
+            f = open(self._sideFilename, 'rb')
+        except IOError:
+            return []
+        try:
+            data = f.read()
+        finally:
+            f.close()
+        size = self._recordSize
+        if len(data) % size != 0:
+            logging.error('%s side file \'%s\' is corrupted (size %i), ignoring the trailing bytes.' %
+                          (self.DESCRIPTION, self._sideFilename, len(data)))
+        return [data[i * size : (i + 1) * size] for i in xrange(len(data) // size)]
+
+    def _close(self):
+        if self._map:
+            self._map.close()
+            self._map = None
+        if self._file:
+            self._file.close()
+            self._file = None
+        self._nbRecords = 0
+        self._side = set()
+        self._opened = False
+
+    def _record(self, i):
+        return self._map[i * self._recordSize : (i + 1) * self._recordSize]
+
+    def _lower_bound(self, record):
+        """Returns the position of the first record of the mapped file not lower than record."""
+        lo, hi = 0, self._nbRecords
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._record(mid) < record:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _find(self, record):
+        """Returns True if record is in the mapped file."""
+        position = self._lower_bound(record)
+        return position < self._nbRecords and self._record(position) == record
+
+    def _known(self, record):
+        if not self._opened:
+            self._open()
+        return record in self._pending or record in self._side or self._find(record)
+
+    def contains(self, record):
+        """Returns True if record has been added."""
+        return self._known(record)
+
+    def add(self, record):
+        """Adds record. Returns True if it was not there yet."""
+        if len(record) != self._recordSize:
+            raise ValueError, 'Wrong record size (%i).' % len(record)
+        if self._known(record):
+            return False
+        self._pending.add(record)
+        if len(self._pending) >= self.MAX_PENDING:
+            self.save()
+        return True
+
+    def count(self):
+        """Returns the number of records."""
+        if not self._opened:
+            self._open()
+        return self._nbRecords + len(self._side) + len(self._pending)
+
+    def save(self):
+        """Saves the new records in the side file, merges it into the index file once it is big enough.
+
+        Returns False if the records could not be saved (the error is logged): they are kept in
+        memory, and saved next time.
+        """
+        if len(self._pending) == 0:
+            return True
+        if not self._opened:
+            self._open()
+        try:
+            if len(self._side) + len(self._pending) >= self.MAX_SIDE:
+                self._merge()
+                return True
+            side = self._side | self._pending
+            tmpFilename = self._sideFilename + '.tmp'
+            self._write(tmpFilename, sorted(side))
+            os.rename(tmpFilename, self._sideFilename)
+        except EnvironmentError, e:
+            logging.error('Unable to save the %s \'%s\': %s' % (self.DESCRIPTION.lower(), self._filename, str(e)))
+            return False
+        logging.info('%s \'%s\': %i new %s saved.' % (self.DESCRIPTION, self._filename,
+                                                     len(self._pending), self.UNIT))
+        self._side = side
+        self._pending.clear()
+        return True
+
+    def merge(self):
+        """Merges the side file and the new records into the index file. Returns False on error (logged)."""
+        if not self._opened:
+            self._open()
+        if len(self._side) == 0 and len(self._pending) == 0:
+            return True
+        try:
+            self._merge()
+        except EnvironmentError, e:
+            logging.error('Unable to merge the %s \'%s\': %s' % (self.DESCRIPTION.lower(), self._filename, str(e)))
+            return False
+        return True
+
+    def close(self):
+        """Merges the new records into the index file, and unmaps it."""
+        self.merge()
+        self._close()
+
+    def _write(self, filename, chunks):
+        """Writes chunks (an iterable of strings) in the file named filename, synced."""
+        out = open(filename, 'wb')
+        try:
+            for chunk in chunks:
+                out.write(chunk)
+            out.flush()
+            os.fsync(out.fileno())
+        finally:
+            out.close()
+
+    def _merged_chunks(self, pending):
+        """Yields the records of the index file and pending (sorted), in order.
+
+        The records of the index file between two pending ones are yielded at once.
+        """
+        size = self._recordSize
+        copied = 0
+        for record in pending:
+            position = self._lower_bound(record)
+            if position > copied:
+                yield self._map[copied * size : position * size]
+            yield record
+            copied = position
+        if self._nbRecords > copied:
+            yield self._map[copied * size : self._nbRecords * size]
+
+    def _merge(self):
+        """Rewrites the index file with the records of the side file and the new ones.
+
+        The merged file is written aside, then renamed over the old one. Raises EnvironmentError.
+        """
+        pending = sorted(self._side | self._pending)
+        tmpFilename = self._filename + '.tmp'
+        self._write(tmpFilename, self._merged_chunks(pending))
+        self._close()
+        os.rename(tmpFilename, self._filename)
+        # if we stop before, _open() ignores the records of the side file already merged
+        if os.path.exists(self._sideFilename):
+            os.remove(self._sideFilename)
+        logging.info('%s \'%s\': %i %s merged.' % (self.DESCRIPTION, self._filename, len(pending), self.UNIT))
+        self._pending.clear()
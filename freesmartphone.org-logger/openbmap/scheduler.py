@@ -0,0 +1,147 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Decides when the next GSM scan should happen, depending on the motion."""
+
+import logging
+import math
+
+# mean Earth radius, in meters
+EARTH_RADIUS = 6371000.0
+
+def distance_m(lat1, lng1, lat2, lng2):
+    """Returns the distance in meters between two positions in decimal degrees (haversine formula)."""
+    lat1, lng1, lat2, lng2 = [math.radians(v) for v in (lat1, lng1, lat2, lng2)]
+    a = math.sin((lat2 - lat1) / 2) ** 2 + \
+        math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS * math.asin(min(1, math.sqrt(a)))
+
+
+class ScanScheduler:
+    """Motion aware scans scheduler.
+
+    The interval between two scans is the time needed to travel the target distance at the
+    current speed, bounded by the minimal and maximal intervals. A scan is avoided, before any
+    expensive D-Bus work, when there is no GPS fix, when we are too slow, or when we have not
+    travelled the target distance since the last accepted scan, unless the serving cell has
+    changed or the maximal interval has elapsed.
+    Wakeups are computed from the previous target time, not from the end of the previous scan,
+    thus the time spent scanning does not make the schedule drift.
+    """
+
+    def __init__(self, minInterval, maxInterval, targetDistance):
+        self.set_parameters(minInterval, maxInterval, targetDistance)
+        self._counters = {'scans': 0,
+                          'accepted': 0,
+                          'avoided_no_fix': 0,
+                          'avoided_speed': 0,
+                          'avoided_distance': 0,
+                          'serving_cell_changes': 0,
+                          'handover_scans': 0,
+                          'handover_rate_limited': 0}
+        self.start(0)
+
+    def set_parameters(self, minInterval, maxInterval, targetDistance):
+        """Sets the intervals bounds (in sec.) and the target distance between scans (in m)."""
+        self._minInterval = max(1, minInterval)
+        self._maxInterval = max(self._minInterval, maxInterval)
+        self._targetDistance = max(0, targetDistance)
+
+    def start(self, now, firstDelay=0):
+        """Resets the schedule, the first scan being due firstDelay seconds after now."""
+        self._nextTarget = now + firstDelay
+        # target before the last next_delay() call, None if there is nothing to reschedule
+        self._previousTarget = None
+        self._lastHandoverScan = None
+        self._lastAccepted = None
+        self._lastCell = None
+        self._cellChanged = False
+
+    def should_scan(self, now, validFix, speed, lat, lng, servingCell, minSpeed):
+        """Returns (boolean, reason string): True if the scan is worth doing.
+
+        speed is in km/h, servingCell any comparable identifier of the current serving cell.
+        """
+        if self._lastCell != None and servingCell != self._lastCell:
+            self._counters['serving_cell_changes'] += 1
+            self._cellChanged = True
+        self._lastCell = servingCell
+
+        if not validFix:
+            return self.avoided('avoided_no_fix', 'no valid GPS fix')
+        if speed < minSpeed:
+            return self.avoided('avoided_speed', 'speed (%g) is under minimal speed (%g)' % (speed, minSpeed))
+        if self._cellChanged:
+            return (True, 'serving cell changed')
+        if self._lastAccepted:
+            (lastTime, lastLat, lastLng) = self._lastAccepted
+            distance = distance_m(lastLat, lastLng, lat, lng)
+            if distance < self._targetDistance and (now - lastTime) < self._maxInterval:
+                return self.avoided('avoided_distance', 'only %i m travelled since last scan' % distance)
+        return (True, 'ok')
+
+    def avoided(self, counter, reason):
+        self._counters[counter] += 1
+        return (False, reason)
+
+    def scan_done(self, accepted, now=None, lat=None, lng=None):
+        """Tells the scheduler a scan has been done, and if it has been logged at given position."""
+        self._counters['scans'] += 1
+        if accepted:
+            self._counters['accepted'] += 1
+            self._lastAccepted = (now, lat, lng)
+            self._cellChanged = False
+
+    def handover_scan_allowed(self, now):
+        """Returns True if an out of band scan may be done now, because of a handover.
+
+        At most one handover scan is allowed every minimal interval. If allowed, the
+        schedule restarts from now.
+        """
+        if self._lastHandoverScan != None and (now - self._lastHandoverScan) < self._minInterval:
+            self._counters['handover_rate_limited'] += 1
+            return False
+        self._lastHandoverScan = now
+        self._counters['handover_scans'] += 1
+        self._nextTarget = now
+        self._previousTarget = None
+        return True
+
+    def next_delay(self, now, speed):
+        """Returns the delay in seconds before the next scan. speed is in km/h, -1 if unknown."""
+        if speed > 0:
+            interval = self._targetDistance / (speed / 3.6)
+        else:
+            interval = self._maxInterval
+        interval = min(self._maxInterval, max(self._minInterval, interval))
+        self._previousTarget = self._nextTarget
+        self._nextTarget += interval
+        if self._nextTarget < now:
+            # we are late by more than one interval: resynchronise instead of catching up
+            logging.debug('Scan scheduler late by %.1f sec., resynchronising.' % (now - self._nextTarget))
+            self._nextTarget = now + self._minInterval
+        return self._nextTarget - now
+
+    def reschedule(self, now, speed):
+        """Returns the delay in seconds before the next scan, computed again with the current parameters.
+
+        To be called after set_parameters(), the next scan being scheduled by next_delay().
+        Returns None if there is nothing to reschedule (first scan or handover scan pending).
+        """
+        if self._previousTarget == None:
+            return None
+        self._nextTarget = self._previousTarget
+        return self.next_delay(now, speed)
+
+    def get_counters(self):
+        """Returns a copy of the counters dictionary."""
+        return dict(self._counters)
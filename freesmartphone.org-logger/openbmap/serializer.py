@@ -0,0 +1,193 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Serialisation of the scan records (xmllog.ScanRecord) to the XML log format (V2).
+
+Every element is produced by a single format operation on a template built once, and
+every value written as text is XML escaped.
+"""
+
+import re
+import time
+
+# every scan ends with this
+SCAN_END = '</scan>\n'
+
+# From Python doc: %f -> The precision determines the number of digits after the decimal point and defaults to 6.
+# A difference of the sixth digit in lat/long leads to a difference of under a meter of precision.
+# Maximum error by rounding is 5. GPS precision is at best 10m. 2 x (maxError x error) = 2 x (5 x 1)
+# introduces an error of 10m! Thus we settle to 9.
+LAT_LON_PRECISION = 9
+# http://gpsd.berlios.de/gpsd.html:
+# Altitude determination is more sensitive to variability to atmospheric signal lag than latitude/longitude,
+# and is also subject to errors in the estimation of local mean sea level; base error is 12 meters at 66%
+# confidence, 23 meters at 95% confidence. Again, this will be multiplied by a vertical dilution of
+# precision (VDOP).
+# Altitude is in meter.
+ALTITUDE_PRECISION = 1
+# speed is in km/h.
+SPEED_PRECISION = 3
+# Precision of 2 digits after the decimal point for h/p/v-dop is enough.
+HVPDOP_PRECISION = 2
+# heading in decimal degrees
+HEADING_PRECISION = 9
+
+# (attribute, index in the gpsData tuple, precision), in the order of the <gps> attributes
+_GPS_FIELDS = (('lng', 3, LAT_LON_PRECISION),
+               ('lat', 2, LAT_LON_PRECISION),
+               ('alt', 4, ALTITUDE_PRECISION),
+               ('hdg', 9, HEADING_PRECISION),
+               ('spe', 8, SPEED_PRECISION),
+               ('hdop', 6, HVPDOP_PRECISION),
+               ('vdop', 7, HVPDOP_PRECISION),
+               ('pdop', 5, HVPDOP_PRECISION))
+# all the GPS numbers are formatted at once, then split
+_GPS_NUMBERS_TEMPLATE = '|'.join(['%%.%if' % precision for (name, index, precision) in _GPS_FIELDS])
+_GPS_TEMPLATE = '<gps time="%s"' + ''.join([' %s="%%s"' % name for (name, index, precision) in _GPS_FIELDS]) + '/>'
+
+_SCAN_TEMPLATE = '<scan time="%s"><gsmserving mcc="%s" mnc="%s" lac="%s" id="%s" ss="%i" act="%s"'
+_TAV_TEMPLATE = ' tav="%s"'
+_RXLEV_TEMPLATE = ' rxlev="%s"'
+_SERVING_END = '/>'
+# the best answer we could get was: it is highly probable that the neighbour cells have
+# the same MCC and MNC as the serving one, but this is not absolutely sure.
+_NEIGHBOUR_TEMPLATE = '<gsmneighbour mcc="%s" mnc="%s" lac="%s" id="%s" rxlev="%i" c1="%i" c2="%i"/>'
+
+_ESCAPES = {'&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&apos;'}
+_NEEDS_ESCAPE = re.compile('[&<>"\']')
+
+def _nb_specials(text):
+    """Returns the number of characters of text which would have to be escaped."""
+    return text.count('"') + text.count('<') + text.count('>') + text.count('&') + text.count("'")
+
+# number of such characters brought by the templates in a scan
+_SCAN_SPECIALS = _nb_specials(_SCAN_TEMPLATE + _SERVING_END + _GPS_TEMPLATE + SCAN_END)
+_TAV_SPECIALS = _nb_specials(_TAV_TEMPLATE)
+_RXLEV_SPECIALS = _nb_specials(_RXLEV_TEMPLATE)
+_NEIGHBOUR_SPECIALS = _nb_specials(_NEIGHBOUR_TEMPLATE)
+
+# lengths of the templates without their values, see scan_length()
+_SCAN_LENGTH = len(_SCAN_TEMPLATE % ('', '', '', '', '', 0, '')) - len('0') + len(_SERVING_END) + len(SCAN_END)
+_TAV_LENGTH = len(_TAV_TEMPLATE % '')
+_RXLEV_LENGTH = len(_RXLEV_TEMPLATE % '')
+_NEIGHBOUR_LENGTH = len(_NEIGHBOUR_TEMPLATE % ('', '', '', '', 0, 0, 0)) - 3 * len('0')
+# the GPS time is formatted as YYYYmmddHHMMSS
+_GPS_LENGTH = len(_GPS_TEMPLATE % (('',) * 9)) + len('20100605143059')
+_ZEROS = ('0',) * len(_GPS_FIELDS)
+
+def escape(value):
+    """Returns value as text (unicode is kept), escaped to be used as an XML attribute value."""
+    if isinstance(value, basestring):
+        text = value
+    else:
+        text = str(value)
+    if _NEEDS_ESCAPE.search(text) == None:
+        return text
+    return _NEEDS_ESCAPE.sub(lambda match: _ESCAPES[match.group()], text)
+
+def format_fixed(value, precision):
+    """Returns value with given number of decimals, without the trailing zeros (nor the trailing point)."""
+    return ('%.*f' % (precision, value)).rstrip('0').rstrip('.')
+
+def _format_gps(tstamp, lat, lng, alt, pdop, hdop, vdop, spe, heading):
+    numbers = (_GPS_NUMBERS_TEMPLATE % (lng, lat, alt, heading, spe, hdop, vdop, pdop)).split('|')
+    return _GPS_TEMPLATE % (time.strftime('%Y%m%d%H%M%S', time.gmtime(tstamp)),
+                            numbers[0].rstrip('0').rstrip('.'), numbers[1].rstrip('0').rstrip('.'),
+                            numbers[2].rstrip('0').rstrip('.'), numbers[3].rstrip('0').rstrip('.'),
+                            numbers[4].rstrip('0').rstrip('.'), numbers[5].rstrip('0').rstrip('.'),
+                            numbers[6].rstrip('0').rstrip('.'), numbers[7].rstrip('0').rstrip('.'))
+
+def format_gps_data(gpsData):
+    """Receives GPS data as parameter, returns an XML formated string for log file.
+
+    gpsData follows the return type of ObmLogger.get_gps_data():
+    validity boolean, time stamp, lat, lng, alt, pdop, hdop, vdop, speed in km/h, heading."""
+    return _format_gps(*gpsData[1:10])
+
+def _format_scan(record):
+    """Returns (the scan record formatted without escaping, number of characters to escape it should have)."""
+    servingCell = record.servingCell
+    (mcc, mnc) = servingCell[:2]
+    logmsg = [_SCAN_TEMPLATE % ((record.date,) + servingCell[:6])]
+    nbSpecials = _SCAN_SPECIALS
+    if servingCell[6] != "":
+        logmsg.append(_TAV_TEMPLATE % servingCell[6])
+        nbSpecials += _TAV_SPECIALS
+    if servingCell[7] != "":
+        logmsg.append(_RXLEV_TEMPLATE % servingCell[7])
+        nbSpecials += _RXLEV_SPECIALS
+    logmsg.append(_SERVING_END)
+    for cell in record.neighbourCells:
+        logmsg.append(_NEIGHBOUR_TEMPLATE % (mcc, mnc, cell['lac'], cell['cid'], cell['rxlev'], cell['c1'], cell['c2']))
+    nbSpecials += len(record.neighbourCells) * _NEIGHBOUR_SPECIALS
+    logmsg.append(_format_gps(record.tstamp, record.lat, record.lng, record.alt,
+                              record.pdop, record.hdop, record.vdop, record.spe, record.heading))
+    logmsg.append(SCAN_END)
+    return (''.join(logmsg), nbSpecials)
+
+def _escape_record(record):
+    """Returns a copy of the scan record with its textual values escaped."""
+    servingCell = record.servingCell
+    neighbourCells = []
+    for cell in record.neighbourCells:
+        cell = dict(cell)
+        cell['lac'] = escape(cell['lac'])
+        cell['cid'] = escape(cell['cid'])
+        neighbourCells.append(cell)
+    return record._replace(date=escape(record.date),
+                           servingCell=tuple([escape(value) for value in servingCell[:4]]) + (servingCell[4],) +
+                                       tuple([escape(value) for value in servingCell[5:8]]),
+                           neighbourCells=tuple(neighbourCells))
+
+def scan_length(record):
+    """Returns len(serialize_scan(record)), computed from the lengths of the values only."""
+    servingCell = record.servingCell
+    # all the textual values, measured (and checked for escaping) at once
+    texts = (record.date,) + servingCell[:4] + servingCell[5:8]
+    length = _SCAN_LENGTH + len('%i' % servingCell[4])
+    if servingCell[6] != "":
+        length += _TAV_LENGTH
+    if servingCell[7] != "":
+        length += _RXLEV_LENGTH
+    neighbourCells = record.neighbourCells
+    if neighbourCells:
+        # every neighbour cell has the MCC and MNC of the serving one
+        texts += servingCell[:2] * len(neighbourCells)
+        for cell in neighbourCells:
+            texts += (cell['lac'], cell['cid'])
+            length += len('%i%i%i' % (cell['rxlev'], cell['c1'], cell['c2']))
+        length += len(neighbourCells) * _NEIGHBOUR_LENGTH
+    try:
+        text = ''.join(texts)
+    except TypeError:
+        text = ''.join([isinstance(value, basestring) and value or str(value) for value in texts])
+    length += len(text)
+    if _NEEDS_ESCAPE.search(text) != None:
+        length += 3 * text.count('<') + 3 * text.count('>') + 4 * text.count('&') + \
+                  5 * text.count('"') + 5 * text.count("'")
+    # the GPS numbers, without their trailing zeros (nor point) like format_fixed()
+    numbers = '|'.join(map(str.rstrip, (_GPS_NUMBERS_TEMPLATE % (record.lng, record.lat, record.alt, record.heading,
+                                                                 record.spe, record.hdop, record.vdop,
+                                                                 record.pdop)).split('|'), _ZEROS)) + '|'
+    return length + len(numbers) - numbers.count('.|') - len(_GPS_FIELDS) + _GPS_LENGTH
+
+def serialize_scan(record):
+    """Returns the XML formatted scan record."""
+    (scan, nbSpecials) = _format_scan(record)
+    # values almost never have to be escaped: it is faster to check the result than every value
+    if _nb_specials(scan) != nbSpecials:
+        (scan, nbSpecials) = _format_scan(_escape_record(record))
+    return scan
+
+def serialize_scans(records):
+    """Returns the XML formatted scan records, concatenated."""
+    return ''.join([serialize_scan(record) for record in records])
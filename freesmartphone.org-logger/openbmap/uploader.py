@@ -0,0 +1,247 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Uploads of the log files by a pool of worker threads.
+
+Every log file to upload is a job: a separate file (FileJob) or a slice of a container
+(SliceJob). Once uploaded, it is moved to the processed logs directory.
+When given a manifest (manifest.UploadManifest), the uploader records there the state of
+the jobs, by their key, and moves the log files rejected to the quarantine directory.
+When given an index of the uploaded contents (hashindex.HashIndex), the log files already
+uploaded byte for byte are not sent again (SKIPPED).
+"""
+
+import collections
+import httplib
+import logging
+import os
+import socket
+import threading
+import time
+import Queue
+
+import hashindex
+import logwriter
+import manifest
+import Upload
+import xmllog
+
+class SessionError(Exception):
+    """The answer of the server is not about the log file posted (wrong URL or credentials, captive
+    portal...): the jobs not started yet are cancelled, and the failure is transient."""
+    pass
+
+# errors worth retrying later, whatever the number of attempts
+TRANSIENT_ERRORS = (socket.error, httplib.HTTPException, SessionError)
+
+# HTTP statuses of the answers refusing the log file posted itself
+FILE_REJECTED_STATUSES = (400, 413, 415, 422)
+
+# answer of a job skipped because its content has already been uploaded
+SKIPPED = 'skipped'
+
+# answer is the one of the post function or SKIPPED, None on failure (error is then the exception
+# message, if any). duration in sec.
+UploadResult = collections.namedtuple('UploadResult', 'name answer error duration')
+
+def content_digest(content):
+    """Returns the digest (see hashindex) of content, a string or an Upload.FilePart."""
+    if isinstance(content, Upload.FilePart):
+        file = content.open()
+        try:
+            return hashindex.digest_file(file, content.size)
+        finally:
+            file.close()
+    return hashindex.digest_string(content)
+
+
+class FileJob:
+    """A log file stored as a separate file."""
+
+    def __init__(self, filename, processedDir, key=None):
+        self.name = os.path.basename(filename)
+        # in the upload manifest
+        self.key = key or self.name
+        self._filename = filename
+        self._processedDir = processedDir
+
+    def load(self):
+        """Returns the content to upload (XML): a string, or Upload.FilePart if it can be read in chunks."""
+        size = logwriter.get_xml_size(self._filename)
+        if size == None:
+            return logwriter.load_as_xml(self._filename)
+        return Upload.FilePart(lambda: logwriter.open_log(self._filename), size)
+
+    def complete(self):
+        """Moves the log file to the processed logs directory. Returns its new name."""
+        return self.move_to(self._processedDir)
+
+    def move_to(self, directory):
+        """Moves the log file to directory. Returns its new name."""
+        newName = os.path.join(directory, self.name)
+        os.rename(self._filename, newName)
+        return newName
+
+
+class SliceJob:
+    """A log file packed in a container (container.LogContainer)."""
+
+    def __init__(self, logContainer, entry, processedDir, key=None):
+        self.name = entry.name
+        self.key = key or self.name
+        self._container = logContainer
+        self._entry = entry
+        self._processedDir = processedDir
+
+    def load(self):
+        """Returns the content to upload (XML): a string, or Upload.FilePart if it can be read in chunks."""
+        entry = self._entry
+        if logwriter.get_xml_name(self.name) == self.name:
+            return Upload.FilePart(lambda: self._container.open_slice(entry), entry.length)
+        if logwriter.get_format(self.name) == xmllog.XmlFormat:
+            # compressed XML, uncompressed while read
+            data = self._container.open_slice(entry)
+            try:
+                size = logwriter.get_gzip_size(data, entry.offset + entry.length)
+            finally:
+                data.close()
+            return Upload.FilePart(lambda: logwriter.open_gzip_part(self._container.open_slice(entry),
+                                                                    entry.length), size)
+        # binary slices are converted in memory
+        return logwriter.decode_as_xml(self.name, self._container.extract(entry))
+
+    def complete(self):
+        """Extracts the log file to the processed logs directory, and marks it done. Returns its new name."""
+        return self.move_to(self._processedDir)
+
+    def move_to(self, directory):
+        """Extracts the log file to directory, and marks it done. Returns its new name."""
+        newName = os.path.join(directory, self.name)
+        self._container.extract_to(self._entry, newName)
+        self._container.mark_done(self._entry)
+        return newName
+
+
+class ParallelUploader:
+    """Runs upload jobs with at most nbWorkers threads.
+
+    post(name, content) uploads one log file, and returns None if the server refused it (anything
+    else is a success). It raises SessionError if the upload session must be aborted.
+    The jobs are completed (moved) by the worker which uploaded them.
+    If uploadManifest is not None, the jobs it rejects are moved to quarantineDir (in a
+    sub-directory named after the source of their key).
+    If hashIndex is not None, the content of a job is hashed before it is posted. It is skipped
+    if found in hashIndex, else its digest is added there once uploaded.
+    """
+
+    def __init__(self, post, nbWorkers=2, uploadManifest=None, quarantineDir=None, hashIndex=None):
+        self._post = post
+        self._nbWorkers = max(1, nbWorkers)
+        self._manifest = uploadManifest
+        self._quarantineDir = quarantineDir
+        self._hashIndex = hashIndex
+        self._queue = Queue.Queue()
+        self._workers = []
+        self._results = []
+        self._lock = threading.Lock()
+
+    def start(self, jobs):
+        """Starts uploading jobs in the background."""
+        for job in jobs:
+            self._queue.put(job)
+        for i in range(min(self._nbWorkers, len(jobs))):
+            worker = threading.Thread(target=self._work, name='Uploader-%i' % i)
+            worker.setDaemon(True)
+            self._workers.append(worker)
+            worker.start()
+
+    def _work(self):
+        while True:
+            try:
+                job = self._queue.get_nowait()
+            except Queue.Empty:
+                return
+            start = time.time()
+            answer = None
+            error = None
+            transient = False
+            if self._manifest != None:
+                self._manifest.start(job.key)
+            try:
+                content = job.load()
+                digest = None
+                if self._hashIndex != None:
+                    digest = content_digest(content)
+                if digest != None and self._hashIndex.contains(digest):
+                    logging.info('\'%s\' skipped, the same content has already been uploaded.' % job.name)
+                    answer = SKIPPED
+                else:
+                    answer = self._post(job.name, content)
+                if answer != None:
+                    logging.info('Moved to \'%s\'.' % job.complete())
+                    if digest != None:
+                        self._hashIndex.add(digest)
+            except Exception, e:
+                answer = None
+                error = str(e)
+                transient = isinstance(e, TRANSIENT_ERRORS)
+                logging.error('Unable to upload \'%s\': %s' % (job.name, error))
+                if isinstance(e, SessionError):
+                    logging.error('Upload session aborted.')
+                    self.cancel()
+            if self._manifest != None:
+                self._record(job, answer, error, transient)
+            self._lock.acquire()
+            self._results.append(UploadResult(job.name, answer, error, time.time() - start))
+            self._lock.release()
+
+    def _record(self, job, answer, error, transient):
+        """Records the result of job in the manifest, quarantines it if rejected."""
+        try:
+            if answer != None:
+                self._manifest.succeeded(job.key)
+            elif self._manifest.failed(job.key, error or 'refused by the server', transient) == manifest.REJECTED:
+                directory = os.path.join(self._quarantineDir, os.path.dirname(job.key))
+                if not os.path.exists(directory):
+                    os.makedirs(directory)
+                logging.warning('\'%s\' rejected, moved to \'%s\'.' % (job.name, job.move_to(directory)))
+        except Exception, e:
+            logging.error('Unable to record the upload of \'%s\': %s' % (job.name, str(e)))
+
+    def cancel(self):
+        """The jobs not started yet are dropped."""
+        while True:
+            try:
+                self._queue.get_nowait()
+            except Queue.Empty:
+                return
+
+    def wait(self, timeout=None):
+        """Waits for the workers, at most timeout seconds if not None. Returns True if all the jobs are done."""
+        if timeout != None:
+            end = time.time() + timeout
+        for worker in self._workers:
+            if timeout == None:
+                worker.join()
+            else:
+                worker.join(max(0, end - time.time()))
+            if worker.isAlive():
+                return False
+        return True
+
+    def get_results(self):
+        """Returns the results (UploadResult) of the jobs done so far, in the order they finished."""
+        self._lock.acquire()
+        try:
+            return list(self._results)
+        finally:
+            self._lock.release()
@@ -0,0 +1,52 @@
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, version 3 of the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Scan records, and the XML log files (V2) format. The scans are formatted by the serializer module."""
+
+import collections
+import logging
+
+import serializer
+
+# What is logged for every scan, see ObmLogger.write_obm_log() for the fields.
+ScanRecord = collections.namedtuple('ScanRecord',
+                                    'date tstamp servingCell lng lat alt spe heading hdop vdop pdop neighbourCells')
+
+# every scan ends with this
+SCAN_END = serializer.SCAN_END
+
+
+class XmlFormat:
+    """XML log files format, for logwriter.LogWriter."""
+
+    EXTENSION = '.xml'
+
+    def begin(self, header, tail):
+        """Returns the data starting a file with given header and tail."""
+        return header
+
+    def encode(self, record):
+        """Returns (data, length of the scan in XML)."""
+        data = serializer.serialize_scan(record)
+        logging.info(data)
+        return (data, len(data))
+
+    def end(self, tail):
+        """Returns the data ending a file."""
+        return tail
+
+    def complete_length(self, content):
+        """Returns the length of content up to its last complete scan, -1 if there is none."""
+        end = content.rfind(SCAN_END)
+        if end < 0:
+            return -1
+        return end + len(SCAN_END)